@@ -0,0 +1,42 @@
+"""Add audit_events
+
+Revision ID: a9d4e6b2c718
+Revises: f3b7c90d2e15
+Create Date: 2026-10-19 16:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9d4e6b2c718'
+down_revision: Union[str, None] = 'f3b7c90d2e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('audit_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(length=32), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('action', sa.String(length=10), nullable=False),
+    sa.Column('changes', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_id')
+    )
+    op.create_index('ix_audit_events_user_id_id', 'audit_events', ['user_id', 'id'], unique=False)
+    op.create_index('ix_audit_events_user_id_contact_id_id', 'audit_events', ['user_id', 'contact_id', 'id'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audit_events_user_id_contact_id_id', table_name='audit_events')
+    op.drop_index('ix_audit_events_user_id_id', table_name='audit_events')
+    op.drop_table('audit_events')
@@ -0,0 +1,88 @@
+"""Add contact dedup keys
+
+Revision ID: b3d8e2f61a07
+Revises: 7c1e5a9f4b20
+Create Date: 2026-10-19 10:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import unicodedata
+
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3d8e2f61a07'
+down_revision: Union[str, None] = '7c1e5a9f4b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+# services.dedup as of this revision, so later changes to it don't change what this migration writes.
+PHONE_DIGITS = 9
+SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ["aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"]) for letter in letters}
+
+
+def soundex(name):
+    letters = [ch for ch in unicodedata.normalize("NFKD", name.lower()) if ch in SOUNDEX_CODES]
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES[letter]
+        if digit != "0" and digit != previous:
+            code += digit
+        if letter not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+
+def dedup_keys(row):
+    digits = "".join(ch for ch in row.phone_number or "" if ch.isdigit())
+    first, last = soundex(row.first_name or ""), soundex(row.last_name or "")
+    keys = {
+        "email": (row.email or "").strip().lower(),
+        "phone": digits[-PHONE_DIGITS:] if len(digits) >= PHONE_DIGITS else "",
+        "name": f"{first}{last}" if first and last else "",
+    }
+    return {kind: value for kind, value in keys.items() if value}
+
+
+def upgrade() -> None:
+    keys = op.create_table('contact_dedup_keys',
+    sa.Column('contact_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('value', sa.String(length=255), nullable=False),
+    sa.ForeignKeyConstraint(['contact_id'], ['contacts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('contact_id', 'kind')
+    )
+
+    # Index the existing contacts before creating the lookup index.
+    contacts = sa.table('contacts', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer),
+                        sa.column('first_name', sa.String), sa.column('last_name', sa.String),
+                        sa.column('phone_number', sa.String), sa.column('email', sa.String))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(contacts).where(contacts.c.id > last_id, contacts.c.user_id.isnot(None))
+                                  .order_by(contacts.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        values = [{'contact_id': row.id, 'user_id': row.user_id, 'kind': kind, 'value': value}
+                  for row in rows for kind, value in dedup_keys(row).items()]
+        if values:
+            connection.execute(keys.insert(), values)
+        last_id = rows[-1].id
+
+    op.create_index('ix_contact_dedup_keys_block', 'contact_dedup_keys', ['user_id', 'kind', 'value'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_dedup_keys_block', table_name='contact_dedup_keys')
+    op.drop_table('contact_dedup_keys')
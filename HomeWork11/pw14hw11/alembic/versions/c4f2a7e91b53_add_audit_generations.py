@@ -0,0 +1,51 @@
+"""Add shard generations to audit_events
+
+Revision ID: c4f2a7e91b53
+Revises: a9d4e6b2c718
+Create Date: 2026-10-19 19:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f2a7e91b53'
+down_revision: Union[str, None] = 'a9d4e6b2c718'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('shard_directory', sa.Column('generation', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('audit_events', sa.Column('generation', sa.Integer(), server_default='0', nullable=False))
+    op.drop_index('ix_audit_events_user_id_contact_id_id', table_name='audit_events')
+    op.drop_index('ix_audit_events_user_id_id', table_name='audit_events')
+    op.create_index('ix_audit_events_user_id_created_at', 'audit_events', ['user_id', 'created_at', 'id'],
+                    unique=False)
+    op.create_index('ix_audit_events_user_id_contact', 'audit_events',
+                    ['user_id', 'generation', 'contact_id', 'created_at', 'id'], unique=False)
+    op.create_table('contact_id_moves',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('generation', sa.Integer(), nullable=False),
+    sa.Column('old_id', sa.Integer(), nullable=False),
+    sa.Column('new_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'generation', 'old_id')
+    )
+    op.create_index('ix_contact_id_moves_new_id', 'contact_id_moves', ['user_id', 'generation', 'new_id'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contact_id_moves_new_id', table_name='contact_id_moves')
+    op.drop_table('contact_id_moves')
+    op.drop_index('ix_audit_events_user_id_contact', table_name='audit_events')
+    op.drop_index('ix_audit_events_user_id_created_at', table_name='audit_events')
+    op.create_index('ix_audit_events_user_id_id', 'audit_events', ['user_id', 'id'], unique=False)
+    op.create_index('ix_audit_events_user_id_contact_id_id', 'audit_events', ['user_id', 'contact_id', 'id'],
+                    unique=False)
+    op.drop_column('audit_events', 'generation')
+    op.drop_column('shard_directory', 'generation')
@@ -0,0 +1,66 @@
+"""Add contacts.phone_e164
+
+Revision ID: d5a91c3e8f42
+Revises: b3d8e2f61a07
+Create Date: 2026-10-19 11:30:00.000000
+
+"""
+import os
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a91c3e8f42'
+down_revision: Union[str, None] = 'b3d8e2f61a07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+# services.phone as of this revision, so later changes to it don't change what this migration writes.
+SEPARATORS = re.compile(r"[\s().\-/]")
+
+
+def to_e164(number, country_code=os.getenv("PHONE_COUNTRY_CODE", "380")):
+    number = SEPARATORS.sub("", number or "")
+    if number.startswith("+"):
+        digits = number[1:]
+    elif number.startswith("00"):
+        digits = number[2:]
+    elif number.startswith(country_code) and len(number) > 10:
+        digits = number
+    else:
+        digits = country_code + number.removeprefix("0")
+    if not digits.isdigit() or not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        return None
+    return f"+{digits}"
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('phone_e164', sa.String(length=16), nullable=True))
+
+    # Backfill in id ranges so every batch is a short statement; the index is built afterwards.
+    contacts = sa.table('contacts', sa.column('id', sa.Integer), sa.column('phone_number', sa.String),
+                        sa.column('phone_e164', sa.String))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(contacts.c.id, contacts.c.phone_number)
+                                  .where(contacts.c.id > last_id).order_by(contacts.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        values = [{'contact_id': row.id, 'phone_e164': to_e164(row.phone_number)} for row in rows]
+        connection.execute(contacts.update().where(contacts.c.id == sa.bindparam('contact_id'))
+                           .values(phone_e164=sa.bindparam('phone_e164')), values)
+        last_id = rows[-1].id
+
+    op.create_index('ix_contacts_user_id_phone_e164', 'contacts', ['user_id', 'phone_e164'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_phone_e164', table_name='contacts')
+    op.drop_column('contacts', 'phone_e164')
@@ -0,0 +1,52 @@
+"""Add contacts.email_domain
+
+Revision ID: e8c24f7a1d96
+Revises: d5a91c3e8f42
+Create Date: 2026-10-19 12:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8c24f7a1d96'
+down_revision: Union[str, None] = 'd5a91c3e8f42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 10000
+
+
+# services.email_address as of this revision, so later changes to it don't change what this migration writes.
+def email_domain(email):
+    local, at, domain = (email or "").strip().lower().rpartition("@")
+    return domain if local and at and domain else None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('email_domain', sa.String(length=255), nullable=True))
+
+    # Backfill in id ranges so every batch is a short statement; the index is built afterwards.
+    contacts = sa.table('contacts', sa.column('id', sa.Integer), sa.column('email', sa.String),
+                        sa.column('email_domain', sa.String))
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(sa.select(contacts.c.id, contacts.c.email)
+                                  .where(contacts.c.id > last_id).order_by(contacts.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        values = [{'contact_id': row.id, 'email_domain': email_domain(row.email)} for row in rows]
+        connection.execute(contacts.update().where(contacts.c.id == sa.bindparam('contact_id'))
+                           .values(email_domain=sa.bindparam('email_domain')), values)
+        last_id = rows[-1].id
+
+    op.create_index('ix_contacts_user_id_email_domain', 'contacts', ['user_id', 'email_domain'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_email_domain', table_name='contacts')
+    op.drop_column('contacts', 'email_domain')
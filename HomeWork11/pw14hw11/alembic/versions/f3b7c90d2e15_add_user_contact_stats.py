@@ -0,0 +1,51 @@
+"""Add user_contact_stats
+
+Revision ID: f3b7c90d2e15
+Revises: e8c24f7a1d96
+Create Date: 2026-10-19 14:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b7c90d2e15'
+down_revision: Union[str, None] = 'e8c24f7a1d96'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade() -> None:
+    stats = op.create_table('user_contact_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('contacts', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'month')
+    )
+
+    # Count in user id ranges so every batch is a short statement.
+    contacts = sa.table('contacts', sa.column('user_id', sa.Integer), sa.column('birthdate', sa.Date))
+    month = sa.func.coalesce(sa.extract('month', contacts.c.birthdate), 0)
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        user_ids = connection.scalars(sa.select(contacts.c.user_id.distinct()).where(contacts.c.user_id > last_id)
+                                      .order_by(contacts.c.user_id).limit(BATCH_SIZE)).all()
+        if not user_ids:
+            break
+        connection.execute(stats.insert().from_select(
+            ['user_id', 'month', 'contacts'],
+            sa.select(contacts.c.user_id, month, sa.func.count())
+            .where(contacts.c.user_id.between(user_ids[0], user_ids[-1]))
+            .group_by(contacts.c.user_id, month)))
+        last_id = user_ids[-1]
+
+
+def downgrade() -> None:
+    op.drop_table('user_contact_stats')
@@ -0,0 +1,113 @@
+"""
+Connection pool occupancy benchmark
+===================================
+
+Runs the same request mix against the app with an eager per-request session
+and with the lazy session from ``get_db``, sampling how many pooled
+connections are checked out.
+
+Usage::
+
+    python -m benchmarks.bench_pool_occupancy [--threads N] [--requests N]
+
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+os.environ.setdefault("CONTACTS_RATE_LIMIT", "1000000/1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from main import app
+from models import Base, Contact, User
+from database.connection import LazySession, get_db
+from services.auth import auth_service
+
+
+def seed(session_factory) -> str:
+    with session_factory() as db:
+        user = User(email="bench@example.com", password="x", confirmed=True)
+        db.add(user)
+        db.flush()
+        db.add_all([Contact(first_name=f"First{i}", last_name=f"Last{i}", phone_number=str(i),
+                            email=f"c{i}@example.com", user_id=user.id) for i in range(100)])
+        db.commit()
+    return asyncio.run(auth_service.create_access_token(data={"sub": "bench@example.com"}, expires_delta=3600))
+
+
+def run(engine, threads: int, requests: int, token: str) -> dict:
+    samples = []
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            samples.append(engine.pool.checkedout())
+            sleep(0.0005)
+
+    def worker(n):
+        client = TestClient(app)
+        good = {"Authorization": f"Bearer {token}"}
+        bad = {"Authorization": "Bearer invalid"}
+        for i in range(requests):
+            # Half authenticated reads, half auth failures that return early.
+            client.get("/api/contacts/" if i % 2 else "/api/contacts/1", headers=good if (i + n) % 2 else bad)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    start = perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = perf_counter() - start
+    done.set()
+    sampler.join()
+    return {"mean": sum(samples) / len(samples), "peak": max(samples), "rps": threads * requests / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{directory}/bench.db", connect_args={"check_same_thread": False},
+                               pool_size=args.threads, max_overflow=0)
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        token = seed(session_factory)
+
+        def eager_get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        def lazy_get_db():
+            db = LazySession(session_factory)
+            try:
+                yield db
+            finally:
+                db.close()
+
+        print(f"{'session':<8}{'mean checked out':>18}{'peak':>6}{'req/s':>10}")
+        for name, dependency in (("eager", eager_get_db), ("lazy", lazy_get_db)):
+            app.dependency_overrides[get_db] = dependency
+            result = run(engine, args.threads, args.requests, token)
+            print(f"{name:<8}{result['mean']:>18.2f}{result['peak']:>6}{result['rps']:>10.0f}")
+        app.dependency_overrides.clear()
+
+
+if __name__ == '__main__':
+    main()
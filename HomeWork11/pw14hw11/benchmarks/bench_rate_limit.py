@@ -0,0 +1,61 @@
+"""
+Rate limiter overhead benchmark
+===============================
+
+Measures the cost of one rate limit check per backend and compares it with
+the bcrypt verification it protects.
+
+Usage::
+
+    python -m benchmarks.bench_rate_limit [--iterations N] [--redis]
+
+"""
+
+import argparse
+import asyncio
+from time import perf_counter
+
+from services.rate_limit import MemoryBackend, RedisBackend, RateLimit
+from env import REDIS_URL
+
+
+async def bench_backend(backend, iterations: int, keys: int) -> float:
+    limit = RateLimit(f"{iterations}/1")
+    for i in range(min(keys, iterations)):
+        await limit.check(backend, f"bench:{i}")
+    start = perf_counter()
+    for i in range(iterations):
+        await limit.check(backend, f"bench:{i % keys}")
+    return (perf_counter() - start) / iterations
+
+
+def bench_bcrypt(iterations: int = 5) -> float:
+    from services.auth import auth_service
+
+    hashed = auth_service.get_password_hash("password123")
+    start = perf_counter()
+    for _ in range(iterations):
+        auth_service.verify_password("password123", hashed)
+    return (perf_counter() - start) / iterations
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--keys", type=int, default=10_000, help="number of distinct keys (IPs/emails)")
+    parser.add_argument("--redis", action="store_true", help=f"also benchmark Redis at {REDIS_URL}")
+    args = parser.parse_args()
+
+    results = {"memory": await bench_backend(MemoryBackend(), args.iterations, args.keys)}
+    if args.redis:
+        results["redis"] = await bench_backend(RedisBackend(REDIS_URL), args.iterations // 10, args.keys)
+    bcrypt = bench_bcrypt()
+
+    print(f"{'backend':<10}{'per check':>14}{'% of bcrypt verify':>22}")
+    for name, seconds in results.items():
+        print(f"{name:<10}{seconds * 1e6:>11.2f} us{seconds / bcrypt * 100:>21.4f}%")
+    print(f"{'bcrypt':<10}{bcrypt * 1e3:>11.2f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
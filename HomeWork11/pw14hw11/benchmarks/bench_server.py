@@ -0,0 +1,222 @@
+"""
+Server configuration benchmark
+==============================
+
+Starts ``server.py`` with each production option switched on in turn and
+drives it with keep-alive HTTP/1.1 connections from several client processes:
+
+- ``dev``: one worker, asyncio event loop and the h11 parser (what ``main.py`` runs).
+- ``+uvloop/httptools``: one worker with uvloop and httptools.
+- ``+workers``: ``--workers`` workers.
+- ``no keep-alive``: the same server, but every request opens a new connection,
+  which is what clients see when idle connections time out too early.
+- ``+preload``: gunicorn with the app imported before forking.
+
+For each configuration it reports requests per second, p50/p99 latency,
+errors and the proportional set size (PSS) of all server processes, where
+preloading shows up. A final burst of simultaneous connections compares a
+small listen backlog with the configured one.
+
+The client competes with the server for CPUs, so run it on a machine with
+more cores than ``--workers`` plus ``--clients`` for meaningful numbers.
+Linux only (PSS is read from /proc).
+
+Usage::
+
+    python -m benchmarks.bench_server [--workers N] [--clients N] [--connections N] [--duration S]
+
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from server import default_workers
+
+ROOT = Path(__file__).resolve().parent.parent
+CONTENT_LENGTH = re.compile(rb"content-length:\s*(\d+)", re.IGNORECASE)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, database: str, *options: str) -> subprocess.Popen:
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}", LOG_LEVEL="WARNING",
+               ADMISSION_DEFAULT_CONCURRENCY="100000", ADMISSION_DEFAULT_QUEUE="100000")
+    process = subprocess.Popen([sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port), *options],
+                               cwd=ROOT, env=env, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            time.sleep(1)  # let the remaining workers finish starting
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"server with options {options} did not start")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def process_tree_pss_mb(pid: int) -> float:
+    """Sum the PSS of a process and all its descendants, in megabytes."""
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            for line in Path(f"/proc/{current}/smaps_rollup").read_text().splitlines():
+                if line.startswith("Pss:"):
+                    total_kb += int(line.split()[1])
+            for task in Path(f"/proc/{current}/task").iterdir():
+                pending.extend(int(child) for child in (task / "children").read_text().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total_kb / 1024
+
+
+async def _read_response(reader) -> bool:
+    head = await reader.readuntil(b"\r\n\r\n")
+    await reader.readexactly(int(CONTENT_LENGTH.search(head).group(1)))
+    return head.startswith(b"HTTP/1.1 200")
+
+
+async def _connection(port: int, deadline: float, keep_alive: bool, latencies: list, errors: list) -> None:
+    request = b"GET / HTTP/1.1\r\nHost: localhost\r\n" + (b"" if keep_alive else b"Connection: close\r\n") + b"\r\n"
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            ok = await _read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, AttributeError):
+            ok = False
+            writer = None
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(1)
+        if writer is not None and not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+def _client(port: int, connections: int, duration: float, keep_alive: bool) -> tuple[list, int]:
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+
+    async def run():
+        await asyncio.gather(*(_connection(port, deadline, keep_alive, latencies, errors)
+                               for _ in range(connections)))
+
+    asyncio.run(run())
+    return latencies, len(errors)
+
+
+def load(port: int, clients: int, connections: int, duration: float, keep_alive: bool = True) -> dict:
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.starmap(_client, [(port, max(1, connections // clients), duration, keep_alive)] * clients)
+    latencies = sorted(latency for result, _ in results for latency in result)
+    errors = sum(error for _, error in results)
+    if not latencies:
+        return {"rps": 0.0, "p50": 0.0, "p99": 0.0, "errors": errors}
+    return {
+        "rps": len(latencies) / duration,
+        "p50": latencies[len(latencies) // 2] * 1000,
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "errors": errors,
+    }
+
+
+def burst(port: int, connections: int) -> dict:
+    """Open ``connections`` connections at once and send one request on each."""
+
+    async def one():
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), 10)
+            writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            ok = await asyncio.wait_for(_read_response(reader), 10)
+            writer.close()
+            return ok
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return False
+
+    async def run():
+        return await asyncio.gather(*(one() for _ in range(connections)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    return {"ok": sum(results), "failed": connections - sum(results), "seconds": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=max(2, default_workers()))
+    parser.add_argument("--clients", type=int, default=2, help="client processes")
+    parser.add_argument("--connections", type=int, default=64, help="concurrent connections in total")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--burst", type=int, default=2000, help="connections opened at once for the backlog test")
+    args = parser.parse_args()
+
+    workers = str(args.workers)
+    configurations = [
+        ("dev", ["--workers", "1", "--loop", "asyncio", "--http", "h11"], True),
+        ("+uvloop/httptools", ["--workers", "1"], True),
+        (f"+workers ({workers})", ["--workers", workers], True),
+        ("no keep-alive", ["--workers", workers], False),
+        ("+preload", ["--workers", workers, "--preload"], True),
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "bench.db")
+        print(f"{'configuration':<22}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'PSS MB':>9}")
+        for name, options, keep_alive in configurations:
+            port = free_port()
+            server = start_server(port, database, *options)
+            try:
+                load(port, args.clients, args.connections, 1, keep_alive)  # warm up
+                result = load(port, args.clients, args.connections, args.duration, keep_alive)
+                pss = process_tree_pss_mb(server.pid)
+            finally:
+                stop_server(server)
+            print(f"{name:<22}{result['rps']:>9.0f}{result['p50']:>9.1f}{result['p99']:>9.1f}"
+                  f"{result['errors']:>8}{pss:>9.1f}")
+
+        print(f"\nburst of {args.burst} connections")
+        for backlog in ("16", None):
+            port = free_port()
+            options = ["--workers", workers] + (["--backlog", backlog] if backlog else [])
+            server = start_server(port, database, *options)
+            try:
+                result = burst(port, args.burst)
+            finally:
+                stop_server(server)
+            label = f"backlog {backlog or 'default'}"
+            print(f"{label:<22}{result['ok']:>6} ok{result['failed']:>6} failed{result['seconds']:>8.2f} s")
+
+
+if __name__ == '__main__':
+    main()
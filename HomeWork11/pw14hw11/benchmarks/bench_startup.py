@@ -0,0 +1,74 @@
+"""
+Startup import-time benchmark
+=============================
+
+Imports ``main`` in a fresh interpreter with ``python -X importtime`` and
+reports the cumulative import time of the app and its slowest modules. Exits
+with status 1 when the import takes longer than the budget, so it can guard
+against import-time regressions in CI.
+
+Usage::
+
+    python -m benchmarks.bench_startup [--budget-ms MS] [--top N] [--runs N]
+
+The budget defaults to the ``STARTUP_BUDGET_MS`` environment variable.
+
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str = "main") -> dict[str, tuple[int, int]]:
+    """
+    Import ``module`` in a subprocess and parse the ``-X importtime`` report.
+
+    Args:
+        module (str): The module to import.
+
+    Returns:
+        dict[str, tuple[int, int]]: Self and cumulative microseconds per top-level import.
+
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.getcwd())
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, _, name = match.groups()
+            times[name] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "0")) or None)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    # The fastest run is the least disturbed by disk cache and scheduler noise.
+    runs = [measure() for _ in range(args.runs)]
+    times = min(runs, key=lambda run: run["main"][1])
+    total_ms = times["main"][1] / 1000
+
+    print(f"{'module':<48}{'self ms':>10}{'cumulative ms':>15}")
+    for name, (self_us, cumulative_us) in sorted(times.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{name:<48}{self_us / 1000:>10.1f}{cumulative_us / 1000:>15.1f}")
+    print(f"\nimport main: {total_ms:.0f} ms")
+
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"over budget of {args.budget_ms:.0f} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+from conftest import BENCH_EMAIL, BENCH_PASSWORD
+
+# The /api/contacts body schema requires an id, which the routes ignore.
+CONTACT = {"id": 0, "first_name": "Bench", "last_name": "Mark", "phone_number": "+380501234567",
+           "email": "bench.mark@example.com", "birthdate": "1990-05-17"}
+
+
+def test_list_contacts(benchmark, client, headers):
+    response = benchmark(client.get, "/api/contacts/", params={"limit": 100}, headers=headers)
+
+    assert response.status_code == 200, response.text
+
+
+def test_read_contact(benchmark, client, headers, contact_id):
+    response = benchmark(client.get, f"/api/contacts/{contact_id}", headers=headers)
+
+    assert response.status_code == 200, response.text
+
+
+def test_create_contact(benchmark, client, headers):
+    response = benchmark.pedantic(lambda: client.post("/api/contacts/", json=CONTACT, headers=headers),
+                                  setup=tuple, rounds=50)
+
+    assert response.status_code == 200, response.text
+
+
+def test_update_contact(benchmark, client, headers, contact_id):
+    response = benchmark(client.put, f"/api/contacts/{contact_id}", json=CONTACT, headers=headers)
+
+    assert response.status_code == 200, response.text
+
+
+def test_search_contacts(benchmark, client):
+    response = benchmark(client.get, "/contacts/", params={"search_name": "Anna"})
+
+    assert response.status_code == 200, response.text
+
+
+def test_login(benchmark, client):
+    form = {"username": BENCH_EMAIL, "password": BENCH_PASSWORD}
+
+    response = benchmark.pedantic(lambda: client.post("/api/auth/login", data=form), setup=tuple, rounds=3)
+
+    assert response.status_code == 200, response.text
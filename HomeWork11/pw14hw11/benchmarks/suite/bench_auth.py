@@ -0,0 +1,34 @@
+from conftest import BENCH_EMAIL, BENCH_PASSWORD
+from services.auth import auth_service
+
+
+def test_create_access_token(benchmark):
+    benchmark(auth_service.create_access_token, {"sub": BENCH_EMAIL})
+
+
+def test_create_refresh_token(benchmark):
+    benchmark(auth_service.create_refresh_token, {"sub": BENCH_EMAIL})
+
+
+def test_decode_token(benchmark, loop):
+    token = loop.run_until_complete(auth_service.create_access_token({"sub": BENCH_EMAIL}))
+
+    payload = benchmark(auth_service.decode_token, token)
+
+    assert payload["sub"] == BENCH_EMAIL
+
+
+def test_decode_refresh_token(benchmark, loop):
+    token = loop.run_until_complete(auth_service.create_refresh_token({"sub": BENCH_EMAIL}))
+
+    assert benchmark(auth_service.decode_refresh_token, token) == BENCH_EMAIL
+
+
+def test_get_password_hash(benchmark):
+    benchmark.pedantic(auth_service.get_password_hash, setup=lambda: (BENCH_PASSWORD,), rounds=3)
+
+
+def test_verify_password(benchmark):
+    hashed = auth_service.get_password_hash(BENCH_PASSWORD)
+
+    assert benchmark.pedantic(auth_service.verify_password, setup=lambda: (BENCH_PASSWORD, hashed), rounds=3)
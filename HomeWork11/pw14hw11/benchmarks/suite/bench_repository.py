@@ -0,0 +1,97 @@
+import asyncio
+from datetime import date
+from itertools import count
+
+from conftest import BENCH_EMAIL
+from models import Contact, User
+from repository import contacts as repository_contacts
+from repository import users as repository_users
+from schemas import ContactCreate, UserModel
+
+BODY = ContactCreate(first_name="Bench", last_name="Mark", phone_number="+380501234567",
+                     email="bench.mark@example.com", birthdate=date(1990, 5, 17))
+
+
+def test_get_contacts(benchmark, db, user):
+    contacts = benchmark(repository_contacts.get_contacts, 0, 100, user, db)
+
+    assert contacts
+
+
+def test_get_contacts_concurrent(benchmark, db, user):
+    async def refresh():
+        # 20 identical concurrent reads, like a shared dashboard refreshing; they share one query.
+        return await asyncio.gather(*(repository_contacts.get_contacts(0, 100, user, db) for _ in range(20)))
+
+    assert all(benchmark(refresh))
+
+
+def test_get_contacts_by_domain(benchmark, db, user, contact_id):
+    domain = db.get(Contact, contact_id).email_domain
+    assert benchmark(repository_contacts.get_contacts, 0, 100, user, db, domain=domain)
+
+
+def test_get_email_domains(benchmark, db, user):
+    assert benchmark(repository_contacts.get_email_domains, user, db)
+
+
+def test_get_contact_stats(benchmark, db, user):
+    assert benchmark(repository_contacts.get_contact_stats, user, db)["contacts"]
+
+
+def test_get_upcoming_birthdays(benchmark, db, user):
+    benchmark(repository_contacts.get_upcoming_birthdays, 7, user, db)
+
+
+def test_get_contacts_by_phone(benchmark, db, user, contact_id):
+    phone_number = db.get(Contact, contact_id).phone_number
+    assert benchmark(repository_contacts.get_contacts_by_phone, phone_number, False, user, db)
+
+
+def test_get_contacts_by_phone_suffix(benchmark, db, user, contact_id):
+    phone_number = db.get(Contact, contact_id).phone_number
+    assert benchmark(repository_contacts.get_contacts_by_phone, phone_number[-7:], True, user, db)
+
+
+def test_get_contact(benchmark, db, user, contact_id):
+    assert benchmark(repository_contacts.get_contact, contact_id, user, db) is not None
+
+
+def test_create_contact(benchmark, db, user):
+    benchmark.pedantic(repository_contacts.create_contact, setup=lambda: (BODY, user, db), rounds=50)
+
+
+def test_update_contact(benchmark, db, user, contact_id):
+    assert benchmark(repository_contacts.update_contact, contact_id, BODY, user, db) is not None
+
+
+def test_remove_contact(benchmark, loop, db, user):
+    def setup():
+        contact = loop.run_until_complete(repository_contacts.create_contact(BODY, user, db))
+        return contact.id, user, db
+
+    assert benchmark.pedantic(repository_contacts.remove_contact, setup=setup, rounds=50) is not None
+
+
+def test_get_user_by_email(benchmark, db):
+    assert benchmark(repository_users.get_user_by_email, BENCH_EMAIL, db) is not None
+
+
+def test_create_user(benchmark, db):
+    numbers = count()
+
+    def setup():
+        n = next(numbers)
+        return UserModel(username=f"bench{n}", email=f"bench{n}@example.org", password="password123"), db
+
+    benchmark.pedantic(repository_users.create_user, setup=setup, rounds=50)
+
+
+def test_update_token(benchmark, db):
+    user = db.query(User).filter_by(email=BENCH_EMAIL).one()
+
+    benchmark(repository_users.update_token, user, "refresh-token", db)
+
+
+def test_confirmed_email(benchmark, db):
+    benchmark(repository_users.confirmed_email, BENCH_EMAIL, db)
@@ -0,0 +1,301 @@
+"""
+Benchmark suite
+===============
+
+Timing benchmarks for token handling, password hashing, the repository
+functions and full requests through ``TestClient``, run against seeded
+SQLite databases.
+
+Usage::
+
+    python -m pytest benchmarks/suite
+
+Configuration (environment variables):
+
+- ``BENCH_SIZES``: comma separated numbers of seeded contacts, default ``1000``
+  (e.g. ``1000,100000,1000000``). Seeded databases are cached in ``benchmarks/.data``
+  until the schema changes.
+- ``BENCH_BASELINE``: baseline file name in ``benchmarks/baselines``, default ``local``
+  (not committed). ``default`` is the committed reference run, see its ``machine``.
+- ``BENCH_SAVE``: ``true`` to write the results to the baseline file instead of comparing.
+- ``BENCH_COMPARE``: statistic compared with the baseline, ``min`` (default, least noisy) or ``median``.
+- ``BENCH_THRESHOLD``: allowed slowdown against the baseline, default ``0.5``.
+- ``BENCH_ROUNDS``: timed rounds per benchmark, default ``7``.
+
+Without a baseline file the results are only reported. With one, a
+benchmark that exceeds the baseline by more than the threshold fails.
+Baselines are only comparable on the machine that recorded them, so record
+a local one first::
+
+    BENCH_SAVE=true python -m pytest benchmarks/suite
+
+"""
+
+import asyncio
+import hashlib
+import inspect
+import json
+import os
+import platform
+import shutil
+import statistics
+from pathlib import Path
+from time import perf_counter
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("CONTACTS_RATE_LIMIT", "1000000000/1")
+os.environ.setdefault("LOGIN_RATE_LIMIT_IP", "1000000000/1")
+os.environ.setdefault("LOGIN_RATE_LIMIT_EMAIL", "1000000000/1")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateTable
+
+from main import app
+from models import Base, Contact, User
+from database.connection import LazySession, get_db
+from database.seed import seed_database
+from services.audit import audit_log
+from services.auth import auth_service
+
+SUITE = Path(__file__).resolve().parent
+DATA_DIR = SUITE.parent / ".data"
+BASELINE_DIR = SUITE.parent / "baselines"
+
+SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "1000").split(",")]
+BASELINE = BASELINE_DIR / f"{os.getenv('BENCH_BASELINE', 'local')}.json"
+SAVE = os.getenv("BENCH_SAVE", "false").lower() == "true"
+COMPARE = os.getenv("BENCH_COMPARE", "min")
+THRESHOLD = float(os.getenv("BENCH_THRESHOLD", "0.5"))
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "7"))
+MIN_ROUND_TIME = 0.05
+
+BENCH_EMAIL = "user0@example.com"
+BENCH_PASSWORD = "password123"
+
+results = {}
+
+
+def _schema_version() -> str:
+    """Short hash of the table definitions, so cached databases are seeded again after schema changes."""
+    ddl = [str(CreateTable(table)) for table in Base.metadata.sorted_tables]
+    ddl += sorted(index.name for table in Base.metadata.sorted_tables for index in table.indexes)
+    return hashlib.blake2b("\n".join(ddl).encode(), digest_size=4).hexdigest()
+
+
+def pytest_collect_file(file_path, parent):
+    # Only collect bench_*.py when the suite was selected explicitly, not with the unit tests.
+    # Files named on the command line are already collected by pytest itself.
+    if (file_path.suffix == ".py" and file_path.name.startswith("bench_") and _selected(parent.config)
+            and not parent.session.isinitpath(file_path)):
+        return pytest.Module.from_parent(parent, path=file_path)
+
+
+def _selected(config) -> bool:
+    for arg in config.args:
+        path = Path(arg.split("::")[0]).resolve()
+        if path == SUITE or SUITE in path.parents:
+            return True
+    return False
+
+
+def _load_baseline() -> dict:
+    if BASELINE.exists():
+        return json.loads(BASELINE.read_text())["benchmarks"]
+    return {}
+
+
+baseline = _load_baseline()
+
+
+class Benchmark:
+    """
+    Times a callable, in the spirit of the pytest-benchmark fixture.
+
+    Coroutine functions are run to completion on the suite's event loop.
+
+    Args:
+        name (str): Benchmark name, used as the baseline key.
+        loop (asyncio.AbstractEventLoop): Event loop for coroutine functions.
+
+    """
+
+    def __init__(self, name: str, loop: asyncio.AbstractEventLoop):
+        self.name = name
+        self.loop = loop
+
+    def _sync(self, func):
+        if inspect.iscoroutinefunction(func):
+            return lambda *args, **kwargs: self.loop.run_until_complete(func(*args, **kwargs))
+        return func
+
+    def __call__(self, func, *args, **kwargs):
+        """
+        Benchmark ``func(*args, **kwargs)``, calling it as many times per round as fit in 50 ms.
+
+        Returns:
+            The result of the last call.
+
+        """
+        func = self._sync(func)
+        start = perf_counter()
+        result = func(*args, **kwargs)
+        iterations = max(1, int(MIN_ROUND_TIME / max(perf_counter() - start, 1e-9)))
+        times = []
+        for _ in range(ROUNDS):
+            start = perf_counter()
+            for _ in range(iterations):
+                result = func(*args, **kwargs)
+            times.append((perf_counter() - start) / iterations)
+        self._record(times, iterations)
+        return result
+
+    def pedantic(self, func, setup, rounds: int = ROUNDS):
+        """
+        Benchmark one call per round with fresh arguments from ``setup``, which is not timed.
+
+        Args:
+            func: The function to benchmark.
+            setup: Returns the ``args`` tuple for the next call.
+            rounds (int): Number of rounds.
+
+        Returns:
+            The result of the last call.
+
+        """
+        func = self._sync(func)
+        times = []
+        result = None
+        for _ in range(rounds):
+            args = setup()
+            start = perf_counter()
+            result = func(*args)
+            times.append(perf_counter() - start)
+        self._record(times, 1)
+        return result
+
+    def _record(self, times: list[float], iterations: int) -> None:
+        stats = {
+            "median": statistics.median(times),
+            "min": min(times),
+            "mean": statistics.fmean(times),
+            "stddev": statistics.stdev(times) if len(times) > 1 else 0.0,
+            "rounds": len(times),
+            "iterations": iterations,
+        }
+        results[self.name] = stats
+        reference = baseline.get(self.name)
+        if SAVE or reference is None:
+            return
+        change = stats[COMPARE] / reference[COMPARE] - 1
+        if change > THRESHOLD:
+            pytest.fail(f"{self.name} regressed: {COMPARE} {stats[COMPARE] * 1000:.3f} ms vs baseline "
+                        f"{reference[COMPARE] * 1000:.3f} ms ({change:+.0%}, threshold {THRESHOLD:.0%})",
+                        pytrace=False)
+
+
+def seed(path: Path, size: int) -> None:
+    """
+    Create a database with ``size`` contacts and one user per thousand contacts.
+
+    ``user0@example.com`` is one of the heavy users of :mod:`database.seed`, so
+    per-user benchmarks see a large address book.
+
+    """
+    seed_database(f"sqlite:///{path}", users=max(1, size // 1000), contacts=size, password=BENCH_PASSWORD)
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def benchmark(request, loop):
+    return Benchmark(f"{request.node.module.__name__}.{request.node.name}", loop)
+
+
+@pytest.fixture(scope="session", params=SIZES, ids=lambda size: f"{size}")
+def session_factory(request, tmp_path_factory):
+    """Session factory for a private copy of the cached database with ``size`` contacts."""
+    DATA_DIR.mkdir(exist_ok=True)
+    cached = DATA_DIR / f"seed-{request.param}-{_schema_version()}.db"
+    if not cached.exists():
+        cached.with_suffix(".tmp").unlink(missing_ok=True)
+        seed(cached.with_suffix(".tmp"), request.param)
+        cached.with_suffix(".tmp").rename(cached)
+    path = tmp_path_factory.mktemp("bench") / cached.name
+    shutil.copyfile(cached, path)
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # Audit the benchmark's writes into its own copy, flushing only at the end so flushes aren't timed.
+    audit_log.session_factory = factory
+    audit_log.directory = tmp_path_factory.mktemp("audit")
+    audit_log.flush_interval = audit_log.batch_size = 10 ** 9
+    yield factory
+    audit_log.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    db = LazySession(session_factory)
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def user(session_factory):
+    with session_factory() as db:
+        return db.query(User).filter(User.email == BENCH_EMAIL).one()
+
+
+@pytest.fixture
+def contact_id(session_factory, user):
+    with session_factory() as db:
+        return db.query(Contact.id).filter(Contact.user_id == user.id).order_by(Contact.id).limit(1).scalar()
+
+
+@pytest.fixture
+def client(session_factory):
+    def override_get_db():
+        db = LazySession(session_factory)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def headers(loop):
+    token = loop.run_until_complete(auth_service.create_access_token(data={"sub": BENCH_EMAIL}, expires_delta=3600))
+    return {"Authorization": f"Bearer {token}"}
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not results:
+        return
+    terminalreporter.section("benchmarks")
+    terminalreporter.write_line(f"{'name':<56}{'median ms':>12}{'min ms':>10}{'baseline':>10}")
+    for name, stats in sorted(results.items()):
+        reference = baseline.get(name)
+        change = f"{stats[COMPARE] / reference[COMPARE] - 1:+.0%}" if reference else "-"
+        terminalreporter.write_line(f"{name:<56}{stats['median'] * 1000:>12.3f}{stats['min'] * 1000:>10.3f}"
+                                    f"{change:>10}")
+    if SAVE:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        saved = {**baseline, **results}
+        BASELINE.write_text(json.dumps({
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor() or platform.machine()},
+            "benchmarks": dict(sorted(saved.items())),
+        }, indent=2) + "\n")
+        terminalreporter.write_line(f"baseline written to {BASELINE}")
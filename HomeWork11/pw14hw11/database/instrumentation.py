@@ -0,0 +1,111 @@
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload
+
+from env import SLOW_QUERY_MS
+
+logger = logging.getLogger("sql.slow")
+
+
+@dataclass
+class QueryStats:
+    """SQL statistics collected for a single request."""
+
+    count: int = 0
+    total_time: float = 0.0
+    slowest_time: float = 0.0
+    slowest_statement: str | None = None
+    statements: Counter = field(default_factory=Counter)
+
+    def record(self, statement: str, elapsed: float) -> None:
+        """
+        Record one executed statement.
+
+        Args:
+            statement (str): The SQL statement.
+            elapsed (float): Execution time in seconds.
+
+        """
+        self.count += 1
+        self.total_time += elapsed
+        self.statements[statement] += 1
+        if elapsed >= self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def repeated_statements(self, threshold: int) -> list[tuple[str, int]]:
+        """
+        Get statements executed at least ``threshold`` times, a typical N+1 symptom.
+
+        Args:
+            threshold (int): Minimum number of executions.
+
+        Returns:
+            list[tuple[str, int]]: Statements with their execution counts.
+
+        """
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append((context, perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_start_time"].pop()[1]
+    stats = query_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; drop its start time so the stack doesn't grow.
+    conn = exception_context.connection
+    started = conn.info.get("query_start_time") if conn is not None else None
+    if started and started[-1][0] is exception_context.execution_context:
+        started.pop()
+
+
+def instrument_engine(engine) -> None:
+    """
+    Attach query timing hooks to an engine.
+
+    Every statement is added to the :data:`query_stats` of the current request
+    (if any) and statements slower than ``SLOW_QUERY_MS`` are logged.
+
+    Args:
+        engine (Engine): The engine to instrument.
+
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _raiseload_lazy(orm_execute_state):
+    if orm_execute_state.is_select and not (orm_execute_state.is_column_load or orm_execute_state.is_relationship_load):
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload("*"))
+
+
+def enable_strict_loading(session_factory) -> None:
+    """
+    Make lazy relationship loads raise instead of silently issuing a query.
+
+    Meant for tests, so that N+1 access patterns such as ``contact.user``
+    in a loop fail loudly.
+
+    Args:
+        session_factory (sessionmaker): The session factory to apply strict loading to.
+
+    """
+    event.listen(session_factory, "do_orm_execute", _raiseload_lazy)
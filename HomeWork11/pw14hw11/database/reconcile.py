@@ -0,0 +1,45 @@
+"""
+Contact counter reconciliation
+==============================
+
+Recounts the ``user_contact_stats`` counters from the contacts and repairs
+the ones that drifted, in the main database or, with ``SHARD_URLS``, on every
+shard. Run it periodically, e.g. nightly from cron.
+
+Usage::
+
+    python -m database.reconcile [--user USER_ID] [--batch-size N]
+
+"""
+
+import argparse
+import logging
+
+from database.connection import SessionLocal, init_engine
+from database.sharding import shard_router
+from repository.contacts import reconcile_contact_stats
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", type=int, help="only reconcile this user")
+    parser.add_argument("--batch-size", type=int, default=1000, help="users per transaction")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if shard_router.enabled:
+        factories = {shard: shard_router.session_factory(shard) for shard in shard_router.urls}
+    else:
+        init_engine()
+        factories = {"main": SessionLocal}
+    for name, factory in factories.items():
+        with factory() as db:
+            repaired = reconcile_contact_stats(db, args.user, args.batch_size)
+        logger.info("%s: repaired %s counters", name, repaired)
+    shard_router.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+Synthetic data generator
+========================
+
+Fills a database with users and contacts for scale testing. The data only
+depends on the arguments and ``--seed``, not on the number of processes:
+
+- Contacts are spread over users with a Zipf distribution, except for the first
+  ``--heavy-users`` users who get about ``--heavy-contacts`` contacts each.
+- Names, email domains, phone formats and birthdates vary like real address books.
+- ``--duplicate-rate`` of the contacts repeat an earlier contact of the same user,
+  sometimes with a differently formatted phone number or email.
+- User ``n`` (id ``n + 1``) has the email ``user<n>@example.com`` and the
+  password given with ``--password``.
+
+Contacts are generated in chunks by a process pool. On PostgreSQL every
+worker loads its chunks with COPY; other databases get Core ``insert``
+executemany batches from the main process.
+
+Usage::
+
+    python -m database.seed --users 10000 --contacts 3000000 [--url URL] [--seed N] [--processes N]
+
+"""
+
+import argparse
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import string
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from random import Random
+from time import perf_counter
+
+from passlib.hash import bcrypt
+from sqlalchemy import create_engine, delete, extract, func, insert, select, text
+
+from models import Base, Contact, ContactDedupKey, User, UserContactStats
+from services.email_address import email_domain
+from services.phone import to_e164
+from env import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 50_000
+CONTACT_COLUMNS = ["id", "first_name", "last_name", "phone_number", "phone_e164", "email", "email_domain", "birthdate",
+                   "user_id"]
+
+FIRST_NAMES = [
+    "Olena", "Anna", "Maria", "Iryna", "Sofia", "Oksana", "Natalia", "Tetiana", "Yulia", "Kateryna",
+    "Viktoria", "Daria", "Alina", "Svitlana", "Halyna", "Emma", "Olivia", "Sarah", "Laura", "Julia",
+    "Oleksandr", "Andrii", "Ivan", "Dmytro", "Serhii", "Mykola", "Petro", "Taras", "Yurii", "Volodymyr",
+    "Maksym", "Bohdan", "Vasyl", "Roman", "Artem", "John", "Michael", "David", "James", "Thomas",
+]
+LAST_NAMES = [
+    "Melnyk", "Shevchenko", "Boyko", "Kovalenko", "Bondarenko", "Tkachenko", "Kovalchuk", "Kravchenko",
+    "Oliinyk", "Shevchuk", "Koval", "Polishchuk", "Bondar", "Tkachuk", "Moroz", "Marchenko", "Lysenko",
+    "Rudenko", "Savchenko", "Petrenko", "Smith", "Johnson", "Brown", "Miller", "Wilson", "Taylor",
+]
+# Most people use a handful of providers; weights roughly follow real address books.
+EMAIL_DOMAINS = ["gmail.com", "ukr.net", "i.ua", "meta.ua", "outlook.com", "yahoo.com", "icloud.com",
+                 "proton.me", "example.com"]
+EMAIL_DOMAIN_WEIGHTS = [45, 20, 8, 4, 8, 5, 5, 2, 3]
+PHONE_PREFIXES = ["50", "63", "66", "67", "68", "73", "93", "95", "96", "97", "98", "99"]
+
+# Set in each pool worker by _init_worker().
+_state = {}
+
+
+def user_weights(users: int, contacts: int, heavy_users: int, heavy_contacts: int,
+                 zipf_s: float = 1.1) -> list[float]:
+    """
+    Probability of each user owning a contact.
+
+    The first ``heavy_users`` users get ``heavy_contacts`` contacts each on
+    average, capped at 90% of all contacts together; the rest follow Zipf's law.
+
+    Args:
+        users (int): Number of users.
+        contacts (int): Number of contacts.
+        heavy_users (int): Number of users with a very large address book.
+        heavy_contacts (int): Target contacts per heavy user.
+        zipf_s (float, optional): Zipf exponent for the other users. Defaults to 1.1.
+
+    Returns:
+        list[float]: Weights summing to 1, indexed by user number.
+
+    """
+    heavy_users = min(heavy_users, users)
+    heavy_share = 0.0
+    if heavy_users and contacts:
+        heavy_share = min(heavy_contacts * heavy_users / contacts, 0.9 if heavy_users < users else 1.0)
+    others = [1 / (rank ** zipf_s) for rank in range(1, users - heavy_users + 1)]
+    total = sum(others)
+    heavy = [heavy_share / heavy_users] * heavy_users if heavy_users else []
+    return heavy + [(1 - heavy_share) * weight / total for weight in others]
+
+
+def bcrypt_hash(password: str, rng: Random) -> str:
+    """Hash ``password`` with a salt drawn from ``rng``, so seeded users are reproducible."""
+    alphabet = "./" + string.ascii_uppercase + string.ascii_lowercase + string.digits
+    # The last salt character only carries 2 bits; bcrypt accepts ".Oeu" there.
+    salt = "".join(rng.choice(alphabet) for _ in range(21)) + rng.choice(".Oeu")
+    return bcrypt.using(salt=salt, rounds=12).hash(password)
+
+
+def generate_users(users: int, seed: int, password: str) -> list[dict]:
+    """
+    Generate user rows.
+
+    Args:
+        users (int): Number of users.
+        seed (int): Random seed.
+        password (str): Password of every user.
+
+    Returns:
+        list[dict]: User rows with ids ``1..users``.
+
+    """
+    rng = Random(f"{seed}:users")
+    password_hash = bcrypt_hash(password, rng)
+    start = datetime(2020, 1, 1)
+    return [{
+        "id": n + 1,
+        "username": f"{rng.choice(FIRST_NAMES).lower()}{n}",
+        "email": f"user{n}@example.com",
+        "password": password_hash,
+        "created_at": start + timedelta(seconds=rng.randrange(3 * 365 * 24 * 3600)),
+        "confirmed": True,
+    } for n in range(users)]
+
+
+def _phone(rng: Random) -> str:
+    prefix, number = rng.choice(PHONE_PREFIXES), f"{rng.randrange(10 ** 7):07d}"
+    return _format_phone(prefix, number, rng.randrange(5))
+
+
+def _format_phone(prefix: str, number: str, style: int) -> str:
+    return [
+        f"+380{prefix}{number}",
+        f"0{prefix}{number}",
+        f"+380 {prefix} {number[:3]} {number[3:5]} {number[5:]}",
+        f"(0{prefix}) {number[:3]}-{number[3:5]}-{number[5:]}",
+        f"380{prefix}{number}",
+    ][style]
+
+
+def _reformat_phone(phone: str, rng: Random) -> str:
+    digits = "".join(ch for ch in phone if ch.isdigit())[-9:]
+    return _format_phone(digits[:2], digits[2:], rng.randrange(5))
+
+
+def _duplicate(original: dict, rng: Random) -> dict:
+    """Copy a contact the way people re-enter one: same person, slightly different formatting."""
+    row = dict(original)
+    variant = rng.randrange(4)
+    if variant == 1:
+        row["phone_number"] = _reformat_phone(row["phone_number"], rng)
+    elif variant == 2:
+        row["email"] = row["email"].upper() if rng.random() < 0.5 else row["email"].capitalize()
+    elif variant == 3:
+        row["first_name"] = row["first_name"].lower()
+    return row
+
+
+def generate_contacts(chunk: int, start: int, count: int, seed: int, cum_weights: list[float],
+                      duplicate_rate: float) -> list[dict]:
+    """
+    Generate one chunk of contact rows.
+
+    Each chunk has its own random generator, so the result doesn't depend on
+    which process generates it.
+
+    Args:
+        chunk (int): Chunk number.
+        start (int): Index of the first contact; its id is ``start + 1``.
+        count (int): Number of contacts.
+        seed (int): Random seed.
+        cum_weights (list[float]): Cumulative :func:`user_weights`.
+        duplicate_rate (float): Share of contacts that repeat an earlier contact of the same user.
+
+    Returns:
+        list[dict]: Contact rows.
+
+    """
+    rng = Random(f"{seed}:contacts:{chunk}")
+    total = cum_weights[-1]
+    last_by_user = {}
+    rows = []
+    for n in range(start, start + count):
+        user_id = min(bisect_right(cum_weights, rng.random() * total), len(cum_weights) - 1) + 1
+        previous = last_by_user.get(user_id)
+        if previous is not None and rng.random() < duplicate_rate:
+            row = _duplicate(previous, rng)
+        else:
+            first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            domain = rng.choices(EMAIL_DOMAINS, weights=EMAIL_DOMAIN_WEIGHTS)[0]
+            separator = rng.choice([".", "_", ""])
+            row = {
+                "first_name": first_name,
+                "last_name": last_name,
+                "phone_number": _phone(rng),
+                "email": f"{first_name}{separator}{last_name}{rng.randrange(1000)}@{domain}".lower(),
+                # Ages between 16 and 90, as of 2024.
+                "birthdate": date(1934, 1, 1) + timedelta(days=rng.randrange(74 * 365)),
+                "user_id": user_id,
+            }
+        row["id"] = n + 1
+        row["phone_e164"] = to_e164(row["phone_number"])
+        row["email_domain"] = email_domain(row["email"])
+        last_by_user[user_id] = row
+        rows.append(row)
+    return rows
+
+
+def _init_worker(url, seed, cum_weights, duplicate_rate):
+    _state.update(url=url, seed=seed, cum_weights=cum_weights, duplicate_rate=duplicate_rate)
+
+
+def _generate_chunk(task):
+    chunk, start, count = task
+    return generate_contacts(chunk, start, count, _state["seed"], _state["cum_weights"], _state["duplicate_rate"])
+
+
+def _copy_chunk(task) -> int:
+    """Generate a chunk and load it with PostgreSQL COPY from a pool worker."""
+    rows = _generate_chunk(task)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in CONTACT_COLUMNS])
+    buffer.seek(0)
+    engine = _state.get("engine")
+    if engine is None:
+        engine = _state["engine"] = create_engine(_state["url"])
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY contacts ({', '.join(CONTACT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        connection.commit()
+    finally:
+        connection.close()
+    return len(rows)
+
+
+def seed_database(url: str = DATABASE_URL, users: int = 1000, contacts: int = 100_000, seed: int = 0,
+                  heavy_users: int = 2, heavy_contacts: int = 500_000, duplicate_rate: float = 0.05,
+                  password: str = "password123", processes: int | None = None, chunk_size: int = CHUNK_SIZE,
+                  truncate: bool = False) -> None:
+    """
+    Create missing tables and load generated users and contacts, and count the
+    contacts in ``user_contact_stats``.
+
+    Args:
+        url (str): Database URL.
+        users (int): Number of users.
+        contacts (int): Number of contacts.
+        seed (int): Random seed.
+        heavy_users (int): Number of users with a very large address book.
+        heavy_contacts (int): Target contacts per heavy user.
+        duplicate_rate (float): Share of duplicated contacts.
+        password (str): Password of every user.
+        processes (int | None): Worker processes, defaults to the number of CPUs.
+        chunk_size (int): Contacts generated per task.
+        truncate (bool): Delete existing users and contacts first.
+
+    Raises:
+        ValueError: If the tables already contain data and ``truncate`` is False.
+
+    """
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        if truncate:
+            for model in (ContactDedupKey, UserContactStats, Contact, User):
+                connection.execute(delete(model))
+        elif connection.scalar(select(func.count()).select_from(User)):
+            raise ValueError("the users table is not empty, use truncate to replace its rows")
+        rows = generate_users(users, seed, password)
+        for batch_start in range(0, users, chunk_size):
+            connection.execute(insert(User), rows[batch_start:batch_start + chunk_size])
+
+    cum_weights = list(accumulate(user_weights(users, contacts, heavy_users, heavy_contacts)))
+    tasks = [(chunk, start, min(chunk_size, contacts - start))
+             for chunk, start in enumerate(range(0, contacts, chunk_size))]
+    processes = processes or os.cpu_count() or 1
+    postgres = engine.dialect.name == "postgresql"
+    initargs = (url, seed, cum_weights, duplicate_rate)
+
+    started = perf_counter()
+    loaded = 0
+    if processes == 1 and not postgres:
+        _init_worker(*initargs)
+        chunks = map(_generate_chunk, tasks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=initargs)
+        chunks = pool.imap_unordered(_copy_chunk if postgres else _generate_chunk, tasks)
+    try:
+        for result in chunks:
+            if postgres:
+                loaded += result
+            else:
+                with engine.begin() as connection:
+                    connection.execute(insert(Contact), result)
+                loaded += len(result)
+            logger.info("Loaded %d/%d contacts (%.0f rows/s)", loaded, contacts, loaded / (perf_counter() - started))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    with engine.begin() as connection:
+        month = func.coalesce(extract("month", Contact.birthdate), 0)
+        connection.execute(insert(UserContactStats).from_select(
+            ["user_id", "month", "contacts"],
+            select(Contact.user_id, month, func.count()).group_by(Contact.user_id, month)))
+
+    if postgres:
+        # Rows were inserted with explicit ids, so move the sequences past them.
+        with engine.begin() as connection:
+            for table in ("users", "contacts"):
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                        f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"))
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DATABASE_URL)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--contacts", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--heavy-users", type=int, default=2)
+    parser.add_argument("--heavy-contacts", type=int, default=500_000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--truncate", action="store_true", help="delete existing users and contacts first")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    started = perf_counter()
+    seed_database(args.url, args.users, args.contacts, args.seed, args.heavy_users, args.heavy_contacts,
+                  args.duplicate_rate, args.password, args.processes, truncate=args.truncate)
+    print(f"seeded {args.users} users and {args.contacts} contacts in {perf_counter() - started:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,501 @@
+"""
+Contact sharding
+================
+
+Contacts can be spread over several databases ("shards") by user id, since
+every contact query is scoped by the user. Users, tokens and the shard
+directory stay in the main database (``DATABASE_URL``).
+
+A user's shard is the one a consistent hash ring picks for their id, unless
+the ``shard_directory`` table pins them elsewhere. Adding a shard to
+``SHARD_URLS`` only re-maps about 1/N of the users, and those can be pinned to
+their old shard in the directory first, then moved one by one.
+
+Shards are configured with ``SHARD_URLS`` (``name=url`` pairs); without it
+contacts stay in the main database and :func:`get_shard_db` hands out the
+request's normal session. Contact ids are only unique within a shard, so a
+moved user's contacts get new ids and the user's shard generation goes up.
+Audit events (``audit_events``, in the main database) keep the generation and
+contact id of when they happened, which stay right for events stored late,
+and ``contact_id_moves`` maps each moved contact's old id to its new one.
+
+Usage::
+
+    python -m database.sharding create-schema
+    python -m database.sharding upgrade-schema [--batch-size N]
+    python -m database.sharding locate <user_id>
+    python -m database.sharding move <user_id> <shard> [--batch-size N] [--grace S]
+
+"""
+
+import argparse
+import bisect
+import functools
+import hashlib
+import logging
+import time
+from typing import Iterable
+
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy import Column, Index, MetaData, Table, bindparam, delete, insert, inspect, select, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session, sessionmaker
+
+from models import (Contact, ContactDedupKey, ContactIdMove, ShardAssignment, ShardMove, ShardMoveId, User,
+                    UserContactStats)
+from database.connection import LazySession, SessionLocal, create_db_engine, get_db, init_engine, release
+from database.instrumentation import enable_strict_loading
+from repository.contacts import rebuild_dedup_keys, reconcile_contact_stats
+from services.auth import auth_service
+from services.email_address import email_domain
+from services.phone import to_e164
+from services.events import GENERATION_KEY
+from env import SHARD_URLS, SHARD_VNODES, SQL_STRICT_LOADING
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+MOVE_RETRY_AFTER = 5
+# Contact columns added after shards could exist, with the column and function they are computed from.
+DERIVED_COLUMNS = {"phone_e164": ("phone_number", to_e164), "email_domain": ("email", email_domain)}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to shard names.
+
+    Every shard is placed on the ring ``vnodes`` times; a key belongs to the
+    first shard point at or after its hash. Adding or removing a shard only
+    re-maps the keys next to that shard's points.
+
+    Args:
+        shards (Iterable[str]): Shard names.
+        vnodes (int, optional): Points per shard. Defaults to ``SHARD_VNODES``.
+
+    """
+
+    def __init__(self, shards: Iterable[str], vnodes: int = SHARD_VNODES):
+        points = sorted((_hash(f"{shard}#{n}"), shard) for shard in shards for n in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def lookup(self, key) -> str:
+        """
+        Get the shard of a key.
+
+        Args:
+            key: The key, e.g. a user id.
+
+        Returns:
+            str: The shard name.
+
+        Raises:
+            LookupError: If the ring has no shards.
+
+        """
+        if not self._hashes:
+            raise LookupError("the hash ring has no shards")
+        return self._shards[bisect.bisect_left(self._hashes, _hash(str(key))) % len(self._hashes)]
+
+
+def parse_shard_urls(spec: str) -> dict[str, str]:
+    """
+    Parse ``SHARD_URLS``.
+
+    Args:
+        spec (str): Comma separated ``name=url`` pairs.
+
+    Returns:
+        dict[str, str]: URL per shard name.
+
+    Raises:
+        ValueError: If a pair has no name or URL.
+
+    """
+    urls = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, url = part.partition("=")
+        if not name or not url:
+            raise ValueError(f"expected name=url, got {part!r}")
+        urls[name.strip()] = url.strip()
+    return urls
+
+
+def shard_metadata() -> MetaData:
+    """
+    Tables of a shard database: ``contacts`` and ``user_contact_stats``
+    without their foreign keys to ``users``, which live in the main database,
+    ``contact_dedup_keys``, ``shard_moves`` and ``shard_move_ids``.
+
+    Returns:
+        MetaData: The shard tables.
+
+    """
+    metadata = MetaData()
+    for table in (Contact.__table__, ContactDedupKey.__table__, UserContactStats.__table__, ShardMove.__table__,
+                  ShardMoveId.__table__):
+        copy = Table(table.name, metadata, *(
+            Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+            for column in table.columns))
+        for index in table.indexes:
+            Index(index.name, *(copy.c[column.name] for column in index.columns), unique=index.unique)
+    return metadata
+
+
+class ShardRouter:
+    """
+    Maps user ids to shards and hands out sessions for them.
+
+    Engines are created on first use of a shard.
+
+    Args:
+        urls (dict[str, str]): Database URL per shard name; empty disables sharding.
+        vnodes (int, optional): Hash ring points per shard. Defaults to ``SHARD_VNODES``.
+
+    """
+
+    def __init__(self, urls: dict[str, str], vnodes: int = SHARD_VNODES):
+        self.urls = dict(urls)
+        self.ring = HashRing(self.urls, vnodes)
+        self._factories = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.urls)
+
+    def session_factory(self, shard: str) -> sessionmaker:
+        """
+        Get the session factory of a shard.
+
+        Args:
+            shard (str): The shard name.
+
+        Returns:
+            sessionmaker: Factory bound to the shard's engine.
+
+        Raises:
+            KeyError: If the shard is not configured.
+
+        """
+        factory = self._factories.get(shard)
+        if factory is None:
+            if shard not in self.urls:
+                raise KeyError(f"unknown shard {shard!r}")
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=create_db_engine(self.urls[shard]))
+            if SQL_STRICT_LOADING:
+                enable_strict_loading(factory)
+            self._factories[shard] = factory
+        return factory
+
+    def locate(self, user_id: int, db: Session) -> ShardAssignment:
+        """
+        Find a user's shard, from the directory or else from the hash ring.
+
+        Args:
+            user_id (int): The user id.
+            db (Session): Session of the main database.
+
+        Returns:
+            ShardAssignment: The directory entry, or an unsaved one with the hash ring's shard.
+
+        """
+        assignment = db.get(ShardAssignment, user_id)
+        if assignment is None:
+            assignment = ShardAssignment(user_id=user_id, shard=self.ring.lookup(user_id), generation=0)
+        return assignment
+
+    def create_schemas(self) -> None:
+        """Create missing shard tables on every shard; on startup only when ``CREATE_SCHEMA_ON_STARTUP`` is set."""
+        metadata = shard_metadata()
+        for shard in self.urls:
+            engine = self.session_factory(shard).kw["bind"]
+            try:
+                metadata.create_all(bind=engine)
+            except (OperationalError, ProgrammingError):
+                # Another worker created a table between the existence check and CREATE TABLE.
+                metadata.create_all(bind=engine)
+
+    def upgrade_schemas(self, batch_size: int = 10000) -> None:
+        """
+        Bring every shard up to the current schema, the shard counterpart of
+        ``alembic upgrade head``, which only runs on ``DATABASE_URL``.
+
+        Missing tables are created, contact columns added since a shard was
+        created are added and filled in, and missing indexes are created
+        after that.
+
+        Args:
+            batch_size (int, optional): Contacts filled in per statement. Defaults to 10000.
+
+        """
+        self.create_schemas()
+        metadata = shard_metadata()
+        contacts = metadata.tables["contacts"]
+        for shard in self.urls:
+            engine = self.session_factory(shard).kw["bind"]
+            with engine.begin() as connection:
+                existing = {column["name"] for column in inspect(connection).get_columns("contacts")}
+                added = [name for name in DERIVED_COLUMNS if name not in existing]
+                for name in added:
+                    column_type = contacts.c[name].type.compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE contacts ADD COLUMN {name} {column_type}"))
+            if added:
+                _fill_columns(engine, contacts, added, batch_size)
+            for table in metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(engine, checkfirst=True)
+            logger.info("shard %s: up to date, added %s", shard, ", ".join(added) or "nothing")
+
+    def dispose(self) -> None:
+        """Close all pooled shard connections and forget the engines."""
+        for factory in self._factories.values():
+            factory.kw["bind"].dispose()
+        self._factories.clear()
+
+
+def _fill_columns(engine, contacts: Table, names: list[str], batch_size: int) -> None:
+    # In id ranges like the migrations, so every batch is a short statement.
+    sources = [contacts.c[DERIVED_COLUMNS[name][0]] for name in names]
+    statement = (contacts.update().where(contacts.c.id == bindparam("contact_id"))
+                 .values({name: bindparam(name) for name in names}))
+    last_id = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select(contacts.c.id, *sources).where(contacts.c.id > last_id)
+                                      .order_by(contacts.c.id).limit(batch_size)).all()
+            if not rows:
+                return
+            connection.execute(statement, [{"contact_id": row.id, **{
+                name: DERIVED_COLUMNS[name][1](value) for name, value in zip(names, row[1:])}} for row in rows])
+        last_id = rows[-1].id
+
+
+shard_router = ShardRouter(parse_shard_urls(SHARD_URLS))
+
+
+async def get_shard_db(request: Request, db: Session = Depends(get_db),
+                       current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get a session of the database holding the current user's contacts.
+
+    Without sharding this is the request's normal session. While the user's
+    contacts are being moved, reads go to the old shard and writes are
+    refused with 503.
+
+    Args:
+        request (Request): The incoming request object.
+        db (Session): Session of the main database.
+        current_user (User): Authenticated user.
+
+    Raises:
+        HTTPException: If the user's contacts are being moved and the request may write.
+
+    """
+    if not shard_router.enabled:
+        yield db
+        return
+    assignment = shard_router.locate(current_user.id, db)
+    release(db)
+    if assignment.moving_to is not None and request.method not in READ_METHODS:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Contacts are being moved, try again later",
+                            headers={"Retry-After": str(MOVE_RETRY_AFTER)})
+    shard_db = LazySession(functools.partial(shard_router.session_factory(assignment.shard),
+                                             info={GENERATION_KEY: assignment.generation}))
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+def _default_main_session():
+    init_engine()
+    return SessionLocal()
+
+
+def move_user(user_id: int, target: str, router: ShardRouter = shard_router, session_factory=None,
+              batch_size: int = 1000, grace: float = MOVE_RETRY_AFTER) -> int:
+    """
+    Move a user's contacts to another shard.
+
+    1. The directory marks the user as moving, which makes :func:`get_shard_db`
+       refuse their writes; requests already running get ``grace`` seconds.
+    2. Contacts are copied in id order. Every batch is committed on the target
+       together with the copy position in ``shard_moves`` and the new ids in
+       ``shard_move_ids``; then their duplicate detection keys and contact
+       counters are built.
+    3. The directory points the user at the target and starts their next
+       generation, in the transaction storing the new ids in ``contact_id_moves``.
+    4. After another ``grace`` seconds for requests still reading the old
+       shard, the old rows are deleted in batches and the position removed.
+
+    Every step can be interrupted; calling ``move_user`` again with the same
+    arguments continues where it stopped.
+
+    Args:
+        user_id (int): The user id.
+        target (str): The target shard name.
+        router (ShardRouter, optional): The shard router. Defaults to ``shard_router``.
+        session_factory (optional): Session factory of the main database. Defaults to ``SessionLocal``.
+        batch_size (int, optional): Contacts per batch. Defaults to 1000.
+        grace (float, optional): Seconds to wait for running requests. Defaults to ``MOVE_RETRY_AFTER``.
+
+    Returns:
+        int: Number of contacts copied by this call.
+
+    Raises:
+        KeyError: If the target shard is not configured.
+        ValueError: If the user is being moved elsewhere or the target already holds contacts of theirs.
+
+    """
+    session_factory = session_factory or _default_main_session
+    target_factory = router.session_factory(target)
+    with session_factory() as db:
+        assignment = router.locate(user_id, db)
+        if assignment.moving_to not in (None, target):
+            raise ValueError(f"user {user_id} is being moved to {assignment.moving_to}")
+        source = assignment.shard
+        # Finish deleting what an earlier move onto the current shard left behind.
+        _finish_move(router, user_id, source, batch_size)
+        if source == target:
+            return 0
+
+        if assignment.moving_to is None:
+            _check_target(target_factory, user_id, source)
+            assignment.moving_to = target
+            db.merge(assignment)
+            db.commit()
+            logger.info("user %s: moving contacts from %s to %s", user_id, source, target)
+            time.sleep(grace)
+
+        copied = _copy_contacts(router.session_factory(source), target_factory, user_id, source, batch_size)
+        with target_factory() as shard_db:
+            rebuild_dedup_keys(user_id, shard_db, batch_size)
+            shard_db.commit()
+            reconcile_contact_stats(shard_db, user_id)
+
+        assignment = db.get(ShardAssignment, user_id)
+        generation = assignment.generation
+        _store_id_moves(db, target_factory, user_id, generation, batch_size)
+        assignment.shard, assignment.moving_to = target, None
+        assignment.generation = generation + 1
+        db.commit()
+    logger.info("user %s: copied %s contacts, now served from %s; their old ids are in contact_id_moves "
+                "with generation %s", user_id, copied, target, generation)
+    time.sleep(grace)
+    _finish_move(router, user_id, target, batch_size)
+    return copied
+
+
+def _check_target(target_factory: sessionmaker, user_id: int, source: str) -> None:
+    with target_factory() as shard_db:
+        move = shard_db.get(ShardMove, user_id)
+        if move is not None and move.source != source:
+            raise ValueError(f"shard holds an unfinished move of user {user_id} from {move.source}")
+        if move is None and shard_db.scalar(select(Contact.id).where(Contact.user_id == user_id).limit(1)):
+            raise ValueError(f"shard already holds contacts of user {user_id}")
+
+
+def _copy_contacts(source_factory: sessionmaker, target_factory: sessionmaker, user_id: int, source: str,
+                   batch_size: int) -> int:
+    columns = [column for column in Contact.__table__.columns if column.name != "id"]
+    copied = 0
+    with source_factory() as source_db, target_factory() as shard_db:
+        move = shard_db.get(ShardMove, user_id)
+        if move is None:
+            move = ShardMove(user_id=user_id, source=source, last_id=0, copied=0)
+            shard_db.add(move)
+            shard_db.commit()
+        while True:
+            rows = source_db.execute(select(Contact.id, *columns)
+                                     .where(Contact.user_id == user_id, Contact.id > move.last_id)
+                                     .order_by(Contact.id).limit(batch_size)).all()
+            source_db.commit()
+            if not rows:
+                return copied
+            new_ids = shard_db.scalars(
+                insert(Contact.__table__).returning(Contact.__table__.c.id, sort_by_parameter_order=True),
+                [{column.name: getattr(row, column.name) for column in columns} for row in rows]).all()
+            shard_db.execute(insert(ShardMoveId.__table__), [{"user_id": user_id, "old_id": row.id, "new_id": new_id}
+                                                             for row, new_id in zip(rows, new_ids)])
+            move.last_id = rows[-1].id
+            move.copied += len(rows)
+            shard_db.commit()
+            copied += len(rows)
+            logger.info("user %s: copied %s contacts", user_id, move.copied)
+
+
+def _store_id_moves(db: Session, target_factory: sessionmaker, user_id: int, generation: int,
+                    batch_size: int) -> None:
+    with target_factory() as shard_db:
+        last_id = 0
+        while True:
+            ids = shard_db.execute(select(ShardMoveId.old_id, ShardMoveId.new_id)
+                                   .where(ShardMoveId.user_id == user_id, ShardMoveId.old_id > last_id)
+                                   .order_by(ShardMoveId.old_id).limit(batch_size)).all()
+            if not ids:
+                return
+            db.execute(insert(ContactIdMove.__table__), [{"user_id": user_id, "generation": generation,
+                                                          "old_id": old_id, "new_id": new_id}
+                                                         for old_id, new_id in ids])
+            logger.info("user %s: new contact ids %s", user_id,
+                        ", ".join(f"{old_id}->{new_id}" for old_id, new_id in ids))
+            last_id = ids[-1].old_id
+
+
+def _finish_move(router: ShardRouter, user_id: int, shard: str, batch_size: int) -> None:
+    with router.session_factory(shard)() as shard_db:
+        move = shard_db.get(ShardMove, user_id)
+        if move is None:
+            return
+        with router.session_factory(move.source)() as source_db:
+            source_db.execute(delete(ContactDedupKey).where(ContactDedupKey.user_id == user_id))
+            source_db.execute(delete(UserContactStats).where(UserContactStats.user_id == user_id))
+            batch = select(Contact.id).where(Contact.user_id == user_id).limit(batch_size)
+            while source_db.execute(delete(Contact.__table__).where(Contact.id.in_(batch))).rowcount:
+                source_db.commit()
+            source_db.commit()
+        shard_db.execute(delete(ShardMoveId).where(ShardMoveId.user_id == user_id))
+        shard_db.delete(move)
+        shard_db.commit()
+    logger.info("user %s: deleted contacts from %s", user_id, move.source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create-schema", help="create missing tables on every shard")
+    upgrade = commands.add_parser("upgrade-schema", help="add and fill in missing columns and indexes on every shard")
+    upgrade.add_argument("--batch-size", type=int, default=10000)
+    locate = commands.add_parser("locate", help="print the shard of a user")
+    locate.add_argument("user_id", type=int)
+    move = commands.add_parser("move", help="move a user's contacts to another shard, or resume a move")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard")
+    move.add_argument("--batch-size", type=int, default=1000)
+    move.add_argument("--grace", type=float, default=MOVE_RETRY_AFTER,
+                      help="seconds to wait for running requests before copying and before deleting")
+    args = parser.parse_args()
+
+    if not shard_router.enabled:
+        parser.error("SHARD_URLS is not set")
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "create-schema":
+        shard_router.create_schemas()
+    elif args.command == "upgrade-schema":
+        shard_router.upgrade_schemas(args.batch_size)
+    elif args.command == "locate":
+        with _default_main_session() as db:
+            assignment = shard_router.locate(args.user_id, db)
+        moving = f" (moving to {assignment.moving_to})" if assignment.moving_to else ""
+        print(f"user {args.user_id}: {assignment.shard}{moving}")
+    else:
+        move_user(args.user_id, args.shard, batch_size=args.batch_size, grace=args.grace)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,4 +6,97 @@ load_dotenv()
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 EMAIL_USERNAME = os.getenv("EMAIL_USERNAME")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-EMAIL_FROM = os.getenv("EMAIL_FROM")
\ No newline at end of file
+EMAIL_FROM = os.getenv("EMAIL_FROM")
+
+DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+SQL_STRICT_LOADING = os.getenv("SQL_STRICT_LOADING", "false").lower() == "true"
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+PROFILE_SECRET = os.getenv("PROFILE_SECRET")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1"))
+
+ADMISSION_AUTH_CONCURRENCY = int(os.getenv("ADMISSION_AUTH_CONCURRENCY", "8"))
+ADMISSION_AUTH_QUEUE = int(os.getenv("ADMISSION_AUTH_QUEUE", "32"))
+ADMISSION_READ_CONCURRENCY = int(os.getenv("ADMISSION_READ_CONCURRENCY", "32"))
+ADMISSION_READ_QUEUE = int(os.getenv("ADMISSION_READ_QUEUE", "128"))
+ADMISSION_DEFAULT_CONCURRENCY = int(os.getenv("ADMISSION_DEFAULT_CONCURRENCY", "32"))
+ADMISSION_DEFAULT_QUEUE = int(os.getenv("ADMISSION_DEFAULT_QUEUE", "128"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+LOGIN_RATE_LIMIT_IP = os.getenv("LOGIN_RATE_LIMIT_IP", "20/60")
+LOGIN_RATE_LIMIT_EMAIL = os.getenv("LOGIN_RATE_LIMIT_EMAIL", "5/60")
+CONTACTS_RATE_LIMIT = os.getenv("CONTACTS_RATE_LIMIT", "300/60")
+TOKEN_STORE_BACKEND = os.getenv("TOKEN_STORE_BACKEND", "memory")
+REVOCATION_REFRESH_INTERVAL = float(os.getenv("REVOCATION_REFRESH_INTERVAL", "1"))
+REVOCATION_FILTER_CAPACITY = int(os.getenv("REVOCATION_FILTER_CAPACITY", "100000"))
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+# Opt-in, e.g. in the .env of a local SQLite database; other databases are migrated with Alembic.
+CREATE_SCHEMA_ON_STARTUP = os.getenv("CREATE_SCHEMA_ON_STARTUP", "false").lower() == "true"
+
+# 0 starts one worker per available CPU.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+KEEP_ALIVE_TIMEOUT = int(os.getenv("KEEP_ALIVE_TIMEOUT", "75"))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", "2048"))
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+PRELOAD_APP = os.getenv("PRELOAD_APP", "false").lower() == "true"
+
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "100"))
+# Seconds to reuse read results after concurrent identical reads were coalesced; 0 only shares in-flight reads.
+# Writes only invalidate results on the worker handling them, so other workers may serve older ones until then.
+SINGLEFLIGHT_WINDOW = float(os.getenv("SINGLEFLIGHT_WINDOW", "0"))
+
+# Comma separated name=url pairs of the databases holding contacts, e.g.
+# "shard0=postgresql://...,shard1=postgresql://..."; empty keeps contacts in DATABASE_URL.
+SHARD_URLS = os.getenv("SHARD_URLS", "")
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+
+# Lowest score of a pair reported as duplicates, see services/dedup.py.
+DEDUP_MIN_SCORE = float(os.getenv("DEDUP_MIN_SCORE", "0.5"))
+DEDUP_MAX_BLOCK = int(os.getenv("DEDUP_MAX_BLOCK", "50"))
+
+# Contact change event streams, see services/events.py.
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+EVENTS_HISTORY = int(os.getenv("EVENTS_HISTORY", "1000"))
+EVENTS_MAX_USERS = int(os.getenv("EVENTS_MAX_USERS", "10000"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_MAX_STREAM = float(os.getenv("EVENTS_MAX_STREAM", "300"))
+
+# Idempotency-Key handling, see services/idempotency.py.
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TTL = float(os.getenv("IDEMPOTENCY_LOCK_TTL", "60"))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "10"))
+
+# Uploaded avatars, see services/avatars.py; 0 workers resizes in a thread instead of processes.
+AVATAR_DIR = os.getenv("AVATAR_DIR", "avatars")
+AVATAR_WORKERS = int(os.getenv("AVATAR_WORKERS", "2"))
+AVATAR_MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", str(5 * 1024 * 1024)))
+AVATAR_MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", str(40_000_000)))
+AVATAR_CACHE_BYTES = int(os.getenv("AVATAR_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+# Audit log of contact changes, see services/audit.py.
+AUDIT_DIR = os.getenv("AUDIT_DIR", "audit")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))
+AUDIT_FSYNC = os.getenv("AUDIT_FSYNC", "false").lower() == "true"
+
+# Country calling code of phone numbers entered without one.
+PHONE_COUNTRY_CODE = os.getenv("PHONE_COUNTRY_CODE", "380")
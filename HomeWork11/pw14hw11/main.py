@@ -9,25 +9,89 @@ updating, and deleting contacts.
 
 """
 
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from datetime import date, timedelta
 
-from fastapi import FastAPI, HTTPException, status, Depends, Query, Security
+from fastapi import FastAPI, HTTPException, status, Depends, Query, Security, Response, Request
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import delete
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import Session
-import uvicorn
 
-from models import Contact, User
-from database.connection import get_db
+from models import Contact, ContactDedupKey, User
+from database.connection import get_db, pool_status, is_statement_timeout, init_engine, create_schema, dispose_engine
+from database.sharding import shard_router
 from schemas import ContactCreate, Contact as ContactSchema, UserModel
-from routes.auth import auth_service
-from routes import auth, contact
+from routes.auth import auth_service, issue_tokens, rotate_tokens
+from routes import auth, contact, batch, users
+from middleware.sql_stats import SQLStatsMiddleware
+from middleware.metrics import MetricsMiddleware
+from middleware.profiling import ProfilingMiddleware
+from middleware.access_log import AccessLogMiddleware
+from middleware.admission import AdmissionControlMiddleware, overloaded_response
+from services.metrics import registry, db_pool_connections
+from services.logs import setup_logging
+from services.email import drain_email_queue
+from services.events import contact_broker
+from services.avatars import avatar_store
+from services.audit import audit_log
+from services.idempotency import idempotent_requests
+from services.rate_limit import limit_login, limit_contacts
+from env import (PROFILE_SECRET, PROFILE_SAMPLE_RATE, LOG_LEVEL, DB_POOL_TIMEOUT, CREATE_SCHEMA_ON_STARTUP,
+                 GRACEFUL_SHUTDOWN_TIMEOUT)
+
+setup_logging(LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application Lifespan
+
+    Create the database engine (and, if ``CREATE_SCHEMA_ON_STARTUP`` is set,
+    missing tables, also on the contact shards) when a server starts instead of at import time, so tests,
+    tools and Alembic importing the app don't pay for it.
+
+    On shutdown, verification emails still being sent are given up to
+    ``GRACEFUL_SHUTDOWN_TIMEOUT`` seconds and buffered audit events are written
+    before connections are closed.
 
-app = FastAPI()
+    """
+    init_engine()
+    if CREATE_SCHEMA_ON_STARTUP:
+        create_schema()
+        if shard_router.enabled:
+            shard_router.create_schemas()
+    registry.start_flusher()
+    audit_log.start()
+    yield
+    await drain_email_queue(GRACEFUL_SHUTDOWN_TIMEOUT)
+    await contact_broker.close()
+    await idempotent_requests.store.close()
+    avatar_store.close()
+    await asyncio.to_thread(audit_log.close)
+    shard_router.dispose()
+    dispose_engine()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(SQLStatsMiddleware)
+app.add_middleware(AccessLogMiddleware)
+app.add_middleware(AdmissionControlMiddleware)
+app.add_middleware(MetricsMiddleware)
+if PROFILE_SECRET or PROFILE_SAMPLE_RATE:
+    app.add_middleware(ProfilingMiddleware)
 security = HTTPBearer()
 
 # Include routers
 app.include_router(auth.router, prefix='/api')
 app.include_router(contact.router, prefix='/api')
+app.include_router(batch.router, prefix='/api')
+app.include_router(users.router, prefix='/api')
 
 
 @app.post("/signup")
@@ -57,7 +121,7 @@ async def signup(body: UserModel, db: Session = Depends(get_db)):
     return {"new_user": new_user.email}
 
 
-@app.post("/login")
+@app.post("/login", dependencies=[Depends(limit_login)])
 async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
     Login Endpoint
@@ -79,15 +143,11 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    user.refresh_token = refresh_token
-    db.commit()
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    return await issue_tokens(user.email)
 
 
 @app.get('/refresh_token')
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     """
     Refresh Token Endpoint
 
@@ -103,19 +163,44 @@ async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(sec
         HTTPException: If the refresh token is invalid.
 
     """
-    token = credentials.credentials
-    email = await auth_service.create_refresh_token(token)
-    user = db.query(User).filter(User.email == email).first()
-    if user.refresh_token != token:
-        user.refresh_token = None
-        db.commit()
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
-
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    user.refresh_token = refresh_token
-    db.commit()
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    return await rotate_tokens(credentials.credentials)
+
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    """Answer with a fast 503 when no pooled database connection became free in time."""
+    return overloaded_response(DB_POOL_TIMEOUT)
+
+
+@app.exception_handler(OperationalError)
+async def operational_error_handler(request: Request, exc: OperationalError):
+    """Answer with 503 when a statement hit the statement timeout, log other database errors."""
+    if is_statement_timeout(exc):
+        return overloaded_response(1)
+    logger.exception("Database error on %s %s", request.method, request.url.path, exc_info=exc)
+    return JSONResponse({"detail": "Internal Server Error"}, status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def collect_pool_stats():
+    for state, value in pool_status().items():
+        db_pool_connections.set(value, state=state)
+
+
+registry.register_collector(collect_pool_stats)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """
+    Metrics Endpoint
+
+    Expose application metrics in the Prometheus text format.
+
+    Returns:
+        Response: Metrics of all workers.
+
+    """
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/")
@@ -149,7 +234,7 @@ async def read_item(current_user: User = Depends(auth_service.get_current_user))
     return {"message": 'secret router', "owner": current_user.email}
 
 
-@app.post("/contacts/", response_model=ContactSchema)
+@app.post("/contacts/", response_model=ContactSchema, dependencies=[Depends(limit_contacts)])
 def create_contact(contact: ContactCreate, db: Session = Depends(get_db)):
     """
     Create Contact Endpoint
@@ -170,7 +255,7 @@ def create_contact(contact: ContactCreate, db: Session = Depends(get_db)):
     return db_contact
 
 
-@app.get("/contacts/", response_model=list[ContactSchema])
+@app.get("/contacts/", response_model=list[ContactSchema], dependencies=[Depends(limit_contacts)])
 def get_contacts(search_name: str = Query(None), search_email: str = Query(None), db: Session = Depends(get_db)):
     """
     Get Contacts Endpoint
@@ -194,7 +279,7 @@ def get_contacts(search_name: str = Query(None), search_email: str = Query(None)
     return query.all()
 
 
-@app.get("/contacts/{contact_id}", response_model=ContactSchema)
+@app.get("/contacts/{contact_id}", response_model=ContactSchema, dependencies=[Depends(limit_contacts)])
 def get_contact(contact_id: int, db: Session = Depends(get_db)):
     """
     Get Contact by ID Endpoint
@@ -218,7 +303,7 @@ def get_contact(contact_id: int, db: Session = Depends(get_db)):
     return contact
 
 
-@app.put("/contacts/{contact_id}", response_model=ContactSchema)
+@app.put("/contacts/{contact_id}", response_model=ContactSchema, dependencies=[Depends(limit_contacts)])
 def update_contact(contact_id: int, contact: ContactCreate, db: Session = Depends(get_db)):
     """
     Update Contact by ID Endpoint
@@ -247,7 +332,7 @@ def update_contact(contact_id: int, contact: ContactCreate, db: Session = Depend
     return db_contact
 
 
-@app.delete("/contacts/{contact_id}", response_model=ContactSchema)
+@app.delete("/contacts/{contact_id}", response_model=ContactSchema, dependencies=[Depends(limit_contacts)])
 def delete_contact(contact_id: int, db: Session = Depends(get_db)):
     """
     Delete Contact by ID Endpoint
@@ -268,6 +353,8 @@ def delete_contact(contact_id: int, db: Session = Depends(get_db)):
     contact = db.query(Contact).filter(Contact.id == contact_id).first()
     if contact is None:
         raise HTTPException(status_code=404, detail="Contact not found")
+    # SQLite doesn't enforce the cascade, and reuses the id.
+    db.execute(delete(ContactDedupKey).where(ContactDedupKey.contact_id == contact.id))
     db.delete(contact)
     db.commit()
     return contact
@@ -295,4 +382,6 @@ def get_upcoming_birthdays(db: Session = Depends(get_db)):
 
 
 if __name__ == '__main__':
+    import uvicorn
+
     uvicorn.run('main:app', port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,50 @@
+import logging
+import random
+from time import perf_counter
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from env import ACCESS_LOG_SAMPLE_RATE
+
+logger = logging.getLogger("access")
+
+
+class AccessLogMiddleware(BaseHTTPMiddleware):
+    """
+    Writes one structured access log record per request.
+
+    Successful (2xx) requests are sampled at ``ACCESS_LOG_SAMPLE_RATE``;
+    everything else is always logged. Sampled records carry ``sample_rate``
+    so counts can be scaled back up.
+    """
+
+    async def dispatch(self, request, call_next):
+        start = perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            if not (200 <= status_code < 300 and ACCESS_LOG_SAMPLE_RATE < 1
+                    and random.random() >= ACCESS_LOG_SAMPLE_RATE):
+                self.log(request, status_code, perf_counter() - start)
+
+    @staticmethod
+    def log(request, status_code: int, duration: float) -> None:
+        route = request.scope.get("route")
+        stats = getattr(request.state, "query_stats", None)
+        sample_rate = ACCESS_LOG_SAMPLE_RATE if 200 <= status_code < 300 else 1.0
+        logger.info("%s %s %d", request.method, request.url.path, status_code, extra={
+            "method": request.method,
+            "path": request.url.path,
+            "route": route.path if route is not None else None,
+            "status": status_code,
+            "duration_ms": round(duration * 1000, 2),
+            "db_time_ms": round(stats.total_time * 1000, 2) if stats else None,
+            "db_queries": stats.count if stats else None,
+            "user_id": getattr(request.state, "user_id", None),
+            "profile_id": getattr(request.state, "profile_id", None),
+            "client": request.client.host if request.client else None,
+            "sample_rate": sample_rate,
+        })
@@ -0,0 +1,121 @@
+import asyncio
+import math
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from env import (ADMISSION_AUTH_CONCURRENCY, ADMISSION_AUTH_QUEUE, ADMISSION_READ_CONCURRENCY,
+                 ADMISSION_READ_QUEUE, ADMISSION_DEFAULT_CONCURRENCY, ADMISSION_DEFAULT_QUEUE,
+                 ADMISSION_QUEUE_TIMEOUT)
+
+
+class LimitPool:
+    """
+    Concurrency limit with a bounded wait queue.
+
+    At most ``max_concurrency`` holders run at once; up to ``max_queue`` more
+    wait for at most ``queue_timeout`` seconds. Anything beyond that is
+    rejected immediately instead of piling up.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def acquire(self) -> bool:
+        """
+        Try to get a slot.
+
+        Returns:
+            bool: True if a slot was acquired, False if the request should be shed.
+
+        """
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return True
+        if self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        acquired = False
+        try:
+            # Not wait_for: on 3.11 it can drop a slot acquired just as the wait is cancelled.
+            async with asyncio.timeout(self.queue_timeout):
+                await self._semaphore.acquire()
+                acquired = True
+            return True
+        except TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            if acquired:
+                self.release()
+            raise
+        finally:
+            self.waiting -= 1
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+
+def _is_auth(method: str, path: str) -> bool:
+    return path.startswith("/api/auth/") or path in ("/login", "/signup", "/refresh_token")
+
+
+def _is_contact_read(method: str, path: str) -> bool:
+    return method == "GET" and (path.startswith("/api/contacts") or path.startswith("/contacts"))
+
+
+class AdmissionControlMiddleware(BaseHTTPMiddleware):
+    """
+    Sheds load with a fast ``503 Service Unavailable`` when a route's limit pool is full.
+
+    Auth endpoints (bcrypt heavy), contact reads and everything else use
+    separate pools, so a login storm can't starve contact reads.
+    """
+
+    def __init__(self, app, exempt_paths: tuple = ("/metrics",)):
+        super().__init__(app)
+        self.exempt_paths = exempt_paths
+        self.pools = [
+            (_is_auth, LimitPool("auth", ADMISSION_AUTH_CONCURRENCY, ADMISSION_AUTH_QUEUE, ADMISSION_QUEUE_TIMEOUT)),
+            (_is_contact_read, LimitPool("contacts_read", ADMISSION_READ_CONCURRENCY, ADMISSION_READ_QUEUE,
+                                         ADMISSION_QUEUE_TIMEOUT)),
+        ]
+        self.default_pool = LimitPool("default", ADMISSION_DEFAULT_CONCURRENCY, ADMISSION_DEFAULT_QUEUE,
+                                      ADMISSION_QUEUE_TIMEOUT)
+
+    def pool_for(self, method: str, path: str) -> LimitPool:
+        for matches, pool in self.pools:
+            if matches(method, path):
+                return pool
+        return self.default_pool
+
+    async def dispatch(self, request, call_next):
+        path = request.url.path
+        if path in self.exempt_paths:
+            return await call_next(request)
+        pool = self.pool_for(request.method, path)
+        if not await pool.acquire():
+            return overloaded_response(pool.queue_timeout)
+        try:
+            return await call_next(request)
+        finally:
+            pool.release()
+
+
+def overloaded_response(retry_after: float) -> JSONResponse:
+    """
+    Build the response sent when a request is shed.
+
+    Args:
+        retry_after (float): Seconds the client should wait before retrying.
+
+    Returns:
+        JSONResponse: A 503 response with a ``Retry-After`` header.
+
+    """
+    return JSONResponse({"detail": "Server is overloaded, try again later"}, status_code=503,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
@@ -0,0 +1,25 @@
+from time import perf_counter
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from services.metrics import http_requests_total, http_request_duration_seconds, http_requests_in_flight
+
+
+class MetricsMiddleware(BaseHTTPMiddleware):
+    """Records request counts, latency and in-flight requests per route."""
+
+    async def dispatch(self, request, call_next):
+        http_requests_in_flight.inc()
+        start = perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            http_requests_in_flight.dec()
+            # Use the route template, not the raw path, to keep label cardinality bounded.
+            route = request.scope.get("route")
+            path = route.path if route is not None else "<unmatched>"
+            http_request_duration_seconds.observe(perf_counter() - start, method=request.method, route=path)
+            http_requests_total.inc(method=request.method, route=path, status=status_code)
@@ -0,0 +1,175 @@
+import argparse
+import hashlib
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from env import PROFILE_SECRET, PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_MAX_FILES, PROFILE_INTERVAL
+
+logger = logging.getLogger("profiling")
+
+PROFILE_HEADER = "X-Profile-Token"
+
+
+def sign_profile_token(expires: int, secret: str = PROFILE_SECRET) -> str:
+    """
+    Create a token that enables profiling of a request until ``expires``.
+
+    Args:
+        expires (int): Unix timestamp after which the token is rejected.
+        secret (str): The admin profiling secret.
+
+    Returns:
+        str: The token to send in the ``X-Profile-Token`` header.
+
+    """
+    signature = hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify_profile_token(token: str, secret: str = PROFILE_SECRET) -> bool:
+    """
+    Check a profiling token signature and expiry.
+
+    Args:
+        token (str): The token from the request header.
+        secret (str): The admin profiling secret.
+
+    Returns:
+        bool: True if the token is valid and not expired.
+
+    """
+    if not secret:
+        return False
+    expires = token.partition(".")[0]
+    # isdigit() alone accepts digits like "²" that int() rejects.
+    if not (expires.isascii() and expires.isdigit()) or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(sign_profile_token(int(expires), secret), token)
+
+
+class StackSampler:
+    """
+    Statistical profiler sampling the call stacks of all threads at a fixed interval.
+
+    Samples are aggregated as collapsed stacks (``thread;root;caller;callee count``),
+    the input format of flamegraph.pl, speedscope and inferno. Sync endpoints and
+    dependencies run in the threadpool, so every thread is sampled; stacks of
+    requests running at the same time are included too.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread {thread_id}"))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """
+        Render the samples in the collapsed stack format.
+
+        Returns:
+            str: One ``stack count`` line per distinct stack.
+
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def write_profile(directory: str, profile_id: str, data: str, max_files: int) -> str:
+    """
+    Write a profile and delete the oldest ones beyond ``max_files``.
+
+    Args:
+        directory (str): The profile directory.
+        profile_id (str): The profile identifier, used as the file name.
+        data (str): Collapsed stacks.
+        max_files (int): Number of profiles to keep.
+
+    Returns:
+        str: Path of the written file.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{profile_id}.folded")
+    with open(path, "w") as f:
+        f.write(data)
+    profiles = sorted((entry for entry in os.scandir(directory) if entry.name.endswith(".folded")),
+                      key=lambda entry: entry.stat().st_mtime)
+    for entry in profiles[:-max_files]:
+        os.remove(entry.path)
+    return path
+
+
+class ProfilingMiddleware(BaseHTTPMiddleware):
+    """
+    Profiles requests carrying a valid admin-signed ``X-Profile-Token`` header,
+    plus a random ``PROFILE_SAMPLE_RATE`` fraction of all requests.
+
+    Only added to the app when profiling is configured, so it costs nothing otherwise.
+    The profile id is returned in the ``X-Profile-Id`` header and stored in
+    ``request.state.profile_id`` for the access log.
+    """
+
+    async def dispatch(self, request, call_next):
+        token = request.headers.get(PROFILE_HEADER)
+        sampled = PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE
+        if not sampled and not (token and verify_profile_token(token)):
+            return await call_next(request)
+
+        profile_id = uuid.uuid4().hex
+        request.state.profile_id = profile_id
+        sampler = StackSampler(PROFILE_INTERVAL)
+        sampler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            sampler.stop()
+            path = await run_in_threadpool(write_profile, PROFILE_DIR, profile_id, sampler.collapsed(),
+                                           PROFILE_MAX_FILES)
+            logger.info("Profile of %s %s written to %s", request.method, request.url.path, path)
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a token that enables profiling of requests.")
+    parser.add_argument("ttl", type=int, nargs="?", default=3600, help="seconds the token is valid (default: 3600)")
+    args = parser.parse_args()
+    if not PROFILE_SECRET:
+        parser.error("PROFILE_SECRET is not set; set it to the server's profiling secret")
+    print(sign_profile_token(int(time.time()) + args.ttl))
+
+
+if __name__ == '__main__':
+    main()
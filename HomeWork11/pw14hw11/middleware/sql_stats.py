@@ -0,0 +1,36 @@
+import logging
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from database.instrumentation import QueryStats, query_stats
+from env import DEBUG, SLOW_QUERY_MS, N_PLUS_ONE_THRESHOLD
+
+logger = logging.getLogger("sql.slow")
+
+
+class SQLStatsMiddleware(BaseHTTPMiddleware):
+    """Collects per-request SQL statistics and reports slow or chatty requests."""
+
+    async def dispatch(self, request, call_next):
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        try:
+            response = await call_next(request)
+        finally:
+            query_stats.reset(token)
+        request.state.query_stats = stats
+
+        if stats.total_time * 1000 >= SLOW_QUERY_MS:
+            logger.warning("Slow request %s %s: %d queries, %.1f ms in DB, slowest (%.1f ms): %s",
+                           request.method, request.url.path, stats.count, stats.total_time * 1000,
+                           stats.slowest_time * 1000, stats.slowest_statement)
+        for statement, n in stats.repeated_statements(N_PLUS_ONE_THRESHOLD):
+            logger.warning("Possible N+1 in %s %s: statement executed %d times: %s",
+                           request.method, request.url.path, n, statement)
+
+        if DEBUG:
+            response.headers["X-DB-Query-Count"] = str(stats.count)
+            response.headers["X-DB-Time-Ms"] = f"{stats.total_time * 1000:.2f}"
+            if stats.slowest_statement:
+                response.headers["X-DB-Slowest-Query"] = " ".join(stats.slowest_statement.split())[:200]
+        return response
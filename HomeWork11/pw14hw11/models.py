@@ -1,8 +1,11 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, DateTime, Boolean
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, DateTime, Boolean, Index, JSON
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql.functions import func
 from sqlalchemy.ext.declarative import declarative_base
 
+from services.email_address import email_domain
+from services.phone import to_e164
+
 
 Base = declarative_base()
 
@@ -14,11 +17,70 @@ class Contact(Base):
     first_name = Column(String)
     last_name = Column(String)
     phone_number = Column(String)
+    # E.164 form of phone_number, kept in sync by set_phone_number.
+    phone_e164 = Column(String(16))
     email = Column(String, index=True)
+    # Lower-cased domain of email, kept in sync by set_email.
+    email_domain = Column(String(255))
     birthdate = Column(Date)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="contacts")
 
+    __table_args__ = (Index('ix_contacts_user_id_phone_e164', 'user_id', 'phone_e164'),
+                      Index('ix_contacts_user_id_email_domain', 'user_id', 'email_domain'))
+
+    @validates('phone_number')
+    def set_phone_number(self, key, phone_number):
+        self.phone_e164 = to_e164(phone_number)
+        return phone_number
+
+    @validates('email')
+    def set_email(self, key, email):
+        self.email_domain = email_domain(email)
+        return email
+
+
+class ContactDedupKey(Base):
+    """Blocking key of a contact for duplicate detection, see ``services.dedup``."""
+    __tablename__ = 'contact_dedup_keys'
+    contact_id = Column(Integer, ForeignKey('contacts.id', ondelete='CASCADE'), primary_key=True)
+    kind = Column(String(10), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    value = Column(String(255), nullable=False)
+
+    __table_args__ = (Index('ix_contact_dedup_keys_block', 'user_id', 'kind', 'value'),)
+
+
+class UserContactStats(Base):
+    """
+    Number of a user's contacts born in a month (0: without birthdate), kept
+    up to date by ``repository.contacts`` and repaired by ``database.reconcile``.
+    """
+    __tablename__ = 'user_contact_stats'
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    month = Column(Integer, primary_key=True)
+    contacts = Column(Integer, nullable=False, default=0)
+
+
+class AuditEvent(Base):
+    """A committed contact change, written in batches by ``services.audit``."""
+    __tablename__ = 'audit_events'
+    id = Column(Integer, primary_key=True)
+    # Makes replaying the audit log after a crash idempotent.
+    event_id = Column(String(32), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    # No foreign key: the history outlives the contact, which may live on a shard.
+    contact_id = Column(Integer, nullable=False)
+    # The user's shard generation when the change was made; contact ids are only unique within one.
+    generation = Column(Integer, nullable=False, default=0, server_default='0')
+    action = Column(String(10), nullable=False)
+    changes = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index('ix_audit_events_user_id_created_at', 'user_id', 'created_at', 'id'),
+                      Index('ix_audit_events_user_id_contact', 'user_id', 'generation', 'contact_id', 'created_at',
+                            'id'))
+
 
 class User(Base):
     __tablename__ = "users"
@@ -29,4 +91,44 @@ class User(Base):
     created_at = Column(DateTime, default=func.now())
     avatar = Column(String(255), nullable=True)
     refresh_token = Column(String(255), nullable=True)
-    confirmed = Column(Boolean, default=False)
\ No newline at end of file
+    confirmed = Column(Boolean, default=False)
+
+
+class ShardAssignment(Base):
+    """Directory entry pinning a user's contacts to a shard instead of the hash ring's choice."""
+    __tablename__ = "shard_directory"
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    shard = Column(String(50), nullable=False)
+    # Set while the user's contacts are being copied to another shard; their writes are refused until then.
+    moving_to = Column(String(50), nullable=True)
+    # Number of times the user's contacts were moved, which gave them new ids.
+    generation = Column(Integer, nullable=False, default=0, server_default='0')
+
+
+class ShardMove(Base):
+    """Progress of a user's contacts being moved onto the shard database holding this row."""
+    __tablename__ = "shard_moves"
+    user_id = Column(Integer, primary_key=True)
+    source = Column(String(50), nullable=False)
+    last_id = Column(Integer, nullable=False, default=0)
+    copied = Column(Integer, nullable=False, default=0)
+
+
+class ShardMoveId(Base):
+    """New id of a contact copied by an unfinished move, until it is stored in ``contact_id_moves``."""
+    __tablename__ = "shard_move_ids"
+    user_id = Column(Integer, primary_key=True)
+    old_id = Column(Integer, primary_key=True)
+    new_id = Column(Integer, nullable=False)
+
+
+class ContactIdMove(Base):
+    """New id a contact got when its user was moved to another shard, for following its audit history."""
+    __tablename__ = "contact_id_moves"
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    # Generation the old id belongs to; the new id belongs to the next one.
+    generation = Column(Integer, primary_key=True)
+    old_id = Column(Integer, primary_key=True)
+    new_id = Column(Integer, nullable=False)
+
+    __table_args__ = (Index('ix_contact_id_moves_new_id', 'user_id', 'generation', 'new_id'),)
\ No newline at end of file
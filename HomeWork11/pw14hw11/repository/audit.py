@@ -0,0 +1,66 @@
+from typing import List
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from models import AuditEvent, ContactIdMove, ShardAssignment, User
+from database.connection import release
+
+
+async def get_audit_events(user: User, db: Session, contact_id: int | None = None, before: int | None = None,
+                           limit: int = 50) -> dict:
+    """
+    Get a page of a user's contact history, newest first.
+
+    Events are ordered by when they happened, not by when they were stored,
+    since a crashed process's audit log is replayed later. Pages follow the
+    last event instead of an offset, so a page costs the same however far
+    back it is, and new events don't shift later pages.
+
+    A contact's history includes its events from before its user was moved
+    to another shard, when it had another id.
+
+    Args:
+        user (User): The user.
+        db (Session): The database session.
+        contact_id (int | None, optional): Only the history of this contact.
+        before (int | None, optional): Only events older than this event id, the ``next_before`` of the previous page.
+        limit (int, optional): Maximum number of events. Defaults to 50.
+
+    Returns:
+        dict: ``items``, the audit events, and ``next_before`` for the next page, None on the last page.
+
+    """
+    query = select(AuditEvent).where(AuditEvent.user_id == user.id)
+    if contact_id is not None:
+        query = query.where(or_(*(and_(AuditEvent.generation == generation, AuditEvent.contact_id == old_id)
+                                  for generation, old_id in _contact_ids(user.id, contact_id, db))))
+    if before is not None:
+        last = db.get(AuditEvent, before)
+        if last is None:
+            query = query.where(AuditEvent.id < before)
+        else:
+            query = query.where(or_(AuditEvent.created_at < last.created_at,
+                                    and_(AuditEvent.created_at == last.created_at, AuditEvent.id < last.id)))
+    # One more than requested tells whether there is a next page.
+    events: List[AuditEvent] = db.scalars(query.order_by(AuditEvent.created_at.desc(), AuditEvent.id.desc())
+                                          .limit(limit + 1)).all()
+    release(db)
+    has_more = len(events) > limit
+    events = events[:limit]
+    return {"items": events, "next_before": events[-1].id if has_more else None}
+
+
+def _contact_ids(user_id: int, contact_id: int, db: Session) -> list[tuple[int, int]]:
+    # The contact's id in the current generation and every earlier one it was moved from.
+    generation = db.scalar(select(ShardAssignment.generation).where(ShardAssignment.user_id == user_id)) or 0
+    ids = [(generation, contact_id)]
+    while generation > 0:
+        generation -= 1
+        contact_id = db.scalar(select(ContactIdMove.old_id).where(ContactIdMove.user_id == user_id,
+                                                                  ContactIdMove.generation == generation,
+                                                                  ContactIdMove.new_id == contact_id))
+        if contact_id is None:
+            break
+        ids.append((generation, contact_id))
+    return ids
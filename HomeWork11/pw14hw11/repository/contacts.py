@@ -1,26 +1,116 @@
+import asyncio
+from collections import defaultdict
+from datetime import date, timedelta
 from typing import List
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import and_, delete, extract, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
 
-from models import Contact, User
-from schemas import Contact as ContactModel
+from models import Contact, ContactDedupKey, User, UserContactStats
+from database.connection import release
+from schemas import Contact as ContactModel, ContactCreate
+from services.dedup import SIGNAL_WEIGHTS, dedup_keys, score
+from services.phone import MIN_SUFFIX_DIGITS, phone_digits, to_e164
+from services.events import publish_events, record_event
+from services.singleflight import contacts_flight
+from env import DEDUP_MAX_BLOCK, DEDUP_MIN_SCORE
 
+MERGED_FIELDS = ("first_name", "last_name", "phone_number", "email", "birthdate")
 
-async def get_contacts(skip: int, limit: int, user: User, db: Session) -> List[Contact]:
+
+def _detached_read(db: Session, query) -> List[Contact]:
+    """
+    Run a read in a session of its own and detach the rows, so other requests can share them.
+
+    The caller's session is only used to find the database; the read may
+    outlive the request that started it.
+    """
+    with Session(bind=db.get_bind(), autoflush=False) as own:
+        return query.with_session(own).all()
+
+
+async def get_contacts(skip: int, limit: int, user: User, db: Session, domain: str | None = None) -> List[Contact]:
     """
     Get a list of contacts for a specific user.
 
+    Concurrent identical calls on this worker share one query, see
+    :class:`services.singleflight.SingleFlight`.
+
     Args:
         skip (int): Number of contacts to skip.
         limit (int): Maximum number of contacts to return.
         user (User): The user for whom to retrieve contacts.
         db (Session): The database session.
+        domain (str | None, optional): Only contacts with an email address at this domain,
+            looked up with the ``(user_id, email_domain)`` index. Defaults to None.
 
     Returns:
         List[Contact]: A list of Contact objects.
 
     """
-    return db.query(Contact).filter(Contact.user_id == user.id).offset(skip).limit(limit).all()
+    query = db.query(Contact).filter(Contact.user_id == user.id)
+    if domain is not None:
+        domain = domain.strip().lstrip("@").lower()
+        query = query.filter(Contact.email_domain == domain)
+    query = query.offset(skip).limit(limit)
+    return await contacts_flight.do(user.id, ("contacts", skip, limit, domain),
+                                    lambda: asyncio.to_thread(_detached_read, db, query))
+
+
+async def get_email_domains(user: User, db: Session, limit: int = 100) -> List[dict]:
+    """
+    Count a user's contacts per email domain.
+
+    The counts come from a GROUP BY over the user's part of the
+    ``(user_id, email_domain)`` index, without reading the contacts.
+
+    Args:
+        user (User): The user whose contacts to count.
+        db (Session): The database session.
+        limit (int, optional): Maximum number of domains to return. Defaults to 100.
+
+    Returns:
+        List[dict]: ``domain`` and ``contacts`` count, most frequent first.
+
+    """
+    contacts = func.count().label("contacts")
+    rows = db.execute(select(Contact.email_domain, contacts)
+                      .where(Contact.user_id == user.id, Contact.email_domain.isnot(None))
+                      .group_by(Contact.email_domain)
+                      .order_by(contacts.desc(), Contact.email_domain).limit(limit)).all()
+    release(db)
+    return [{"domain": domain, "contacts": count} for domain, count in rows]
+
+
+async def get_upcoming_birthdays(days: int, user: User, db: Session) -> List[Contact]:
+    """
+    Get a user's contacts with a birthday in the next ``days`` days, including today.
+
+    Concurrent identical calls on this worker share one query, see
+    :class:`services.singleflight.SingleFlight`.
+
+    Args:
+        days (int): Number of days to look ahead.
+        user (User): The user for whom to retrieve contacts.
+        db (Session): The database session.
+
+    Returns:
+        List[Contact]: Contacts ordered by upcoming birthday.
+
+    """
+    today = date.today()
+    month_days = [(day.month, day.day) for day in (today + timedelta(days=n) for n in range(days + 1))]
+    month_day = extract("month", Contact.birthdate) * 100 + extract("day", Contact.birthdate)
+    query = db.query(Contact).filter(Contact.user_id == user.id,
+                                     month_day.in_([month * 100 + day for month, day in month_days]))
+
+    def upcoming():
+        order = {month_day: n for n, month_day in enumerate(month_days)}
+        contacts = _detached_read(db, query)
+        return sorted(contacts, key=lambda contact: order[(contact.birthdate.month, contact.birthdate.day)])
+
+    return await contacts_flight.do(user.id, ("birthdays", today, days), lambda: asyncio.to_thread(upcoming))
+
 
 async def get_contact(contact_id: int, user: User, db: Session) -> Contact:
     """
@@ -35,10 +125,47 @@ async def get_contact(contact_id: int, user: User, db: Session) -> Contact:
         Contact: The Contact object.
 
     """
-    return db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
+    contact = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
+    release(db)
+    return contact
 
 
-async def create_contact(body: ContactModel, user: User, db: Session) -> Contact:
+async def get_contacts_by_phone(number: str, suffix: bool, user: User, db: Session,
+                                limit: int = 100) -> List[Contact] | None:
+    """
+    Get a user's contacts with a phone number, for caller ID style lookups.
+
+    Both lookups use the ``(user_id, phone_e164)`` index: an exact match seeks
+    it, a suffix match scans only the user's entries of it.
+
+    Args:
+        number (str): The phone number in any format, or its last digits with ``suffix``.
+        suffix (bool): Match numbers ending with the digits of ``number`` instead of the whole number.
+        user (User): The user for whom to retrieve contacts.
+        db (Session): The database session.
+        limit (int, optional): Maximum number of contacts to return. Defaults to 100.
+
+    Returns:
+        List[Contact] | None: The matching contacts, or None if ``number`` is not a phone
+        number or, with ``suffix``, has fewer than ``MIN_SUFFIX_DIGITS`` digits.
+
+    """
+    if suffix:
+        digits = phone_digits(number)
+        if len(digits) < MIN_SUFFIX_DIGITS:
+            return None
+        condition = Contact.phone_e164.like(f"%{digits}")
+    else:
+        e164 = to_e164(number)
+        if e164 is None:
+            return None
+        condition = Contact.phone_e164 == e164
+    contacts = db.query(Contact).filter(Contact.user_id == user.id, condition).order_by(Contact.id).limit(limit).all()
+    release(db)
+    return contacts
+
+
+async def create_contact(body: ContactModel, user: User, db: Session, commit: bool = True) -> Contact:
     """
     Create a new contact for a user.
 
@@ -46,6 +173,8 @@ async def create_contact(body: ContactModel, user: User, db: Session) -> Contact
         body (ContactModel): The contact information.
         user (User): The user for whom to create the contact.
         db (Session): The database session.
+        commit (bool, optional): Commit the transaction; if False only flush it and leave committing,
+            ``contacts_flight.invalidate(user.id)`` and ``publish_events(db)`` to the caller. Defaults to True.
 
     Returns:
         Contact: The created Contact object.
@@ -60,12 +189,20 @@ async def create_contact(body: ContactModel, user: User, db: Session) -> Contact
         user_id=user.id
     )
     db.add(contact)
-    db.commit()
-    db.refresh(contact)
+    db.flush()
+    _index_contact(contact, db)
+    _count_contacts(user.id, {_birth_month(contact.birthdate): 1}, db)
+    _record_contact_event(db, user.id, "created", contact)
+    if commit:
+        db.commit()
+        contacts_flight.invalidate(user.id)
+        await publish_events(db)
+        db.refresh(contact)
     return contact
 
 
-async def update_contact(contact_id: int, body: ContactModel, user: User, db: Session) -> Contact | None:
+async def update_contact(contact_id: int, body: ContactModel, user: User, db: Session,
+                         commit: bool = True) -> Contact | None:
     """
     Update an existing contact for a user.
 
@@ -74,6 +211,8 @@ async def update_contact(contact_id: int, body: ContactModel, user: User, db: Se
         body (ContactModel): The updated contact information.
         user (User): The user for whom the contact belongs.
         db (Session): The database session.
+        commit (bool, optional): Commit the transaction; if False only flush it and leave committing,
+            ``contacts_flight.invalidate(user.id)`` and ``publish_events(db)`` to the caller. Defaults to True.
 
     Returns:
         Contact | None: The updated Contact object, or None if the contact was not found.
@@ -81,16 +220,28 @@ async def update_contact(contact_id: int, body: ContactModel, user: User, db: Se
     """
     contact = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
     if contact:
+        previous = dedup_keys(contact)
+        previous_month = _birth_month(contact.birthdate)
+        before = _audited_fields(contact)
         contact.first_name = body.first_name
         contact.last_name = body.last_name
         contact.phone_number = body.phone_number
         contact.email = body.email
         contact.birthdate = body.birthdate
-        db.commit()
+        db.flush()
+        _index_contact(contact, db, previous)
+        months = defaultdict(int, {previous_month: -1})
+        months[_birth_month(contact.birthdate)] += 1
+        _count_contacts(user.id, months, db)
+        _record_contact_event(db, user.id, "updated", contact, before)
+        if commit:
+            db.commit()
+            contacts_flight.invalidate(user.id)
+            await publish_events(db)
     return contact
 
 
-async def remove_contact(contact_id: int, user: User, db: Session) -> Contact | None:
+async def remove_contact(contact_id: int, user: User, db: Session, commit: bool = True) -> Contact | None:
     """
     Remove a contact for a user.
 
@@ -98,6 +249,8 @@ async def remove_contact(contact_id: int, user: User, db: Session) -> Contact |
         contact_id (int): The ID of the contact to remove.
         user (User): The user for whom the contact belongs.
         db (Session): The database session.
+        commit (bool, optional): Commit the transaction; if False only flush it and leave committing,
+            ``contacts_flight.invalidate(user.id)`` and ``publish_events(db)`` to the caller. Defaults to True.
 
     Returns:
         Contact | None: The removed Contact object, or None if the contact was not found.
@@ -105,6 +258,303 @@ async def remove_contact(contact_id: int, user: User, db: Session) -> Contact |
     """
     contact = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
     if contact:
+        db.execute(delete(ContactDedupKey).where(ContactDedupKey.contact_id == contact.id))
         db.delete(contact)
+        db.flush()
+        _count_contacts(user.id, {_birth_month(contact.birthdate): -1}, db)
+        _record_contact_event(db, user.id, "deleted", contact)
+        if commit:
+            db.commit()
+            contacts_flight.invalidate(user.id)
+            await publish_events(db)
+    return contact
+
+
+def _index_contact(contact: Contact, db: Session, previous: dict | None = None) -> None:
+    """
+    Replace the duplicate detection keys of a flushed contact.
+
+    ``previous`` are its stored keys if known; nothing is written when they
+    are unchanged. Otherwise stored keys are always deleted first, also for a
+    new contact: a reused id may still have keys of a contact deleted without
+    this module.
+    """
+    keys = dedup_keys(contact)
+    if keys == previous:
+        return
+    db.execute(delete(ContactDedupKey).where(ContactDedupKey.contact_id == contact.id))
+    if keys:
+        db.execute(insert(ContactDedupKey), [{"contact_id": contact.id, "user_id": contact.user_id, "kind": kind,
+                                              "value": value} for kind, value in keys.items()])
+
+
+def rebuild_dedup_keys(user_id: int, db: Session, batch_size: int = 1000) -> int:
+    """
+    Recompute the duplicate detection keys of all of a user's contacts, e.g.
+    for contacts imported or moved without going through this module.
+
+    Args:
+        user_id (int): The user id.
+        db (Session): The database session; committing is left to the caller.
+        batch_size (int, optional): Contacts loaded at a time. Defaults to 1000.
+
+    Returns:
+        int: Number of contacts indexed.
+
+    """
+    db.execute(delete(ContactDedupKey).where(ContactDedupKey.user_id == user_id))
+    count = 0
+    last_id = 0
+    while True:
+        contacts = db.execute(select(Contact.id, Contact.first_name, Contact.last_name, Contact.phone_number,
+                                     Contact.email)
+                              .where(Contact.user_id == user_id, Contact.id > last_id)
+                              .order_by(Contact.id).limit(batch_size)).all()
+        if not contacts:
+            return count
+        keys = [{"contact_id": contact.id, "user_id": user_id, "kind": kind, "value": value}
+                for contact in contacts for kind, value in dedup_keys(contact).items()]
+        if keys:
+            db.execute(insert(ContactDedupKey), keys)
+        count += len(contacts)
+        last_id = contacts[-1].id
+
+
+async def get_duplicates(user: User, db: Session, contact_id: int | None = None, min_score: float = DEDUP_MIN_SCORE,
+                         limit: int = 100) -> List[dict]:
+    """
+    Find likely duplicate pairs among a user's contacts.
+
+    Only contacts sharing a blocking key are compared, see :mod:`services.dedup`.
+    Blocks larger than ``DEDUP_MAX_BLOCK`` are skipped unless ``contact_id`` is given.
+
+    Args:
+        user (User): The user whose contacts to check.
+        db (Session): The database session.
+        contact_id (int | None, optional): Only find duplicates of this contact. Defaults to None.
+        min_score (float, optional): Lowest reported score. Defaults to ``DEDUP_MIN_SCORE``.
+        limit (int, optional): Maximum number of pairs. Defaults to 100.
+
+    Returns:
+        List[dict]: Pairs with ``score``, matching ``signals`` and the two ``contacts``, best first.
+
+    """
+    first, second = aliased(ContactDedupKey), aliased(ContactDedupKey)
+    query = select(first.contact_id, second.contact_id, first.kind) \
+        .join(second, and_(second.user_id == first.user_id, second.kind == first.kind, second.value == first.value)) \
+        .where(first.user_id == user.id)
+    if contact_id is None:
+        blocks = select(ContactDedupKey.kind, ContactDedupKey.value) \
+            .where(ContactDedupKey.user_id == user.id) \
+            .group_by(ContactDedupKey.kind, ContactDedupKey.value) \
+            .having(func.count() <= DEDUP_MAX_BLOCK).subquery()
+        query = query.join(blocks, and_(blocks.c.kind == first.kind, blocks.c.value == first.value)) \
+            .where(first.contact_id < second.contact_id)
+    else:
+        query = query.where(first.contact_id == contact_id, second.contact_id != contact_id)
+
+    signals = defaultdict(set)
+    for first_id, second_id, kind in db.execute(query):
+        signals[(first_id, second_id)].add(kind)
+    ids = {contact_id for pair in signals for contact_id in pair}
+    contacts = {contact.id: contact for contact in
+                db.query(Contact).filter(Contact.user_id == user.id, Contact.id.in_(ids))} if ids else {}
+    release(db)
+
+    pairs = []
+    for (first_id, second_id), kinds in signals.items():
+        if first_id not in contacts or second_id not in contacts:
+            continue
+        pair = contacts[first_id], contacts[second_id]
+        if pair[0].birthdate is not None and pair[0].birthdate == pair[1].birthdate:
+            kinds.add("birthdate")
+        pair_score = score(kinds)
+        if pair_score >= min_score:
+            pairs.append({"score": pair_score, "signals": [signal for signal in SIGNAL_WEIGHTS if signal in kinds],
+                          "contacts": list(pair)})
+    pairs.sort(key=lambda pair: (-pair["score"], pair["contacts"][0].id, pair["contacts"][1].id))
+    return pairs[:limit]
+
+
+async def merge_contacts(keep_id: int, merge_ids: List[int], body: ContactCreate | None, user: User,
+                         db: Session) -> Contact | None:
+    """
+    Merge duplicate contacts into one, in one transaction.
+
+    The kept contact gets the fields of ``body`` if given; otherwise its empty
+    fields are filled from the merged contacts, in order. The merged contacts
+    are deleted.
+
+    Args:
+        keep_id (int): The ID of the contact to keep.
+        merge_ids (List[int]): The IDs of the contacts to merge into it.
+        body (ContactCreate | None): Final contact details, or None to keep the existing ones.
+        user (User): The user the contacts belong to.
+        db (Session): The database session.
+
+    Returns:
+        Contact | None: The kept contact, or None if any of the contacts was not found.
+
+    """
+    contacts = {contact.id: contact for contact in
+                db.query(Contact).filter(Contact.user_id == user.id, Contact.id.in_([keep_id, *merge_ids]))}
+    if len(contacts) != len({keep_id, *merge_ids}):
+        return None
+    kept = contacts[keep_id]
+    before = _audited_fields(kept)
+    months = defaultdict(int, {_birth_month(kept.birthdate): -1})
+    for contact_id in merge_ids:
+        months[_birth_month(contacts[contact_id].birthdate)] -= 1
+    for field in MERGED_FIELDS:
+        if body is not None:
+            setattr(kept, field, getattr(body, field))
+            continue
+        for contact_id in merge_ids:
+            if getattr(kept, field) not in (None, ""):
+                break
+            setattr(kept, field, getattr(contacts[contact_id], field))
+    db.execute(delete(ContactDedupKey).where(ContactDedupKey.contact_id.in_(merge_ids)))
+    for contact_id in merge_ids:
+        db.delete(contacts[contact_id])
+    db.flush()
+    _index_contact(kept, db)
+    months[_birth_month(kept.birthdate)] += 1
+    _count_contacts(user.id, months, db)
+    _record_contact_event(db, user.id, "updated", kept, before)
+    for contact_id in merge_ids:
+        _record_contact_event(db, user.id, "deleted", contacts[contact_id])
+    db.commit()
+    contacts_flight.invalidate(user.id)
+    await publish_events(db)
+    db.refresh(kept)
+    return kept
+
+
+def _audited_fields(contact: Contact) -> dict:
+    return {field: value.isoformat() if isinstance(value, date) else value
+            for field in MERGED_FIELDS for value in [getattr(contact, field)]}
+
+
+def _record_contact_event(db: Session, user_id: int, event_type: str, contact: Contact,
+                          before: dict | None = None) -> None:
+    """
+    Record a contact change for the event streams and the audit log, see ``services.events``.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The user the contact belongs to.
+        event_type (str): ``"created"``, ``"updated"`` or ``"deleted"``.
+        contact (Contact): The flushed contact.
+        before (dict | None, optional): Its fields before an update, from ``_audited_fields``.
+
+    """
+    if event_type == "deleted":
+        before, after, data = _audited_fields(contact), {}, {"id": contact.id}
+    else:
+        after = _audited_fields(contact)
+        data = ContactModel.model_validate(contact, from_attributes=True).model_dump(mode="json")
+    before = before or {}
+    changes = {field: [before.get(field), after.get(field)] for field in MERGED_FIELDS
+               if before.get(field) != after.get(field)}
+    record_event(db, user_id, event_type, data, changes)
+
+
+def _birth_month(birthdate: date | None) -> int:
+    return birthdate.month if birthdate else 0
+
+
+def _count_contacts(user_id: int, changes: dict[int, int], db: Session) -> None:
+    """
+    Add to a user's per-month contact counters, in the caller's transaction.
+
+    Args:
+        user_id (int): The user id.
+        changes (dict[int, int]): Change per birth month, 0 for contacts without birthdate.
+        db (Session): The database session.
+
+    """
+    changes = {month: change for month, change in changes.items() if change}
+    if not changes:
+        return
+    stats = UserContactStats.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        upsert = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(stats)
+        upsert = upsert.on_conflict_do_update(index_elements=[stats.c.user_id, stats.c.month],
+                                              set_={"contacts": stats.c.contacts + upsert.excluded.contacts})
+        db.execute(upsert, [{"user_id": user_id, "month": month, "contacts": change}
+                            for month, change in changes.items()])
+        return
+    for month, change in changes.items():
+        updated = db.execute(update(stats).where(stats.c.user_id == user_id, stats.c.month == month)
+                             .values(contacts=stats.c.contacts + change))
+        if not updated.rowcount:
+            db.execute(insert(stats).values(user_id=user_id, month=month, contacts=change))
+
+
+async def get_contact_stats(user: User, db: Session) -> dict:
+    """
+    Get a user's number of contacts and birthdays per month from the maintained counters.
+
+    Args:
+        user (User): The user.
+        db (Session): The database session.
+
+    Returns:
+        dict: ``contacts`` in total, ``birthdays_per_month`` (January first) and ``without_birthdate``.
+
+    """
+    counts = dict(db.execute(select(UserContactStats.month, UserContactStats.contacts)
+                             .where(UserContactStats.user_id == user.id)).all())
+    release(db)
+    return {
+        "contacts": sum(counts.values()),
+        "birthdays_per_month": [counts.get(month, 0) for month in range(1, 13)],
+        "without_birthdate": counts.get(0, 0),
+    }
+
+
+def reconcile_contact_stats(db: Session, user_id: int | None = None, batch_size: int = 1000) -> int:
+    """
+    Recount contacts per user and birth month and repair counters that drifted,
+    e.g. after writes that bypassed this module.
+
+    Every batch of users is committed on its own, with their counter rows
+    locked while they are recounted where the database supports it. Repairs
+    are added to the counters with the same upsert as writes, so a counter
+    row created meanwhile by a write is added to instead of conflicting.
+
+    Args:
+        db (Session): The database session.
+        user_id (int | None, optional): Only reconcile this user. Defaults to all users.
+        batch_size (int, optional): Users per transaction. Defaults to 1000.
+
+    Returns:
+        int: Number of repaired counters.
+
+    """
+    if user_id is not None:
+        user_ids = [user_id]
+    else:
+        user_ids = sorted(set(db.scalars(select(Contact.user_id).where(Contact.user_id.isnot(None)).distinct()))
+                          | set(db.scalars(select(UserContactStats.user_id).distinct())))
+    month = func.coalesce(extract("month", Contact.birthdate), 0)
+    repaired = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        stored = {(user, month): count for user, month, count in
+                  db.execute(select(UserContactStats.user_id, UserContactStats.month, UserContactStats.contacts)
+                             .where(UserContactStats.user_id.in_(batch)).with_for_update())}
+        actual = {(user, int(month)): count for user, month, count in
+                  db.execute(select(Contact.user_id, month, func.count()).where(Contact.user_id.in_(batch))
+                             .group_by(Contact.user_id, month))}
+        changes = defaultdict(dict)
+        for user, month in stored.keys() | actual.keys():
+            change = actual.get((user, month), 0) - stored.get((user, month), 0)
+            if change:
+                changes[user][month] = change
+                repaired += 1
+        for user, user_changes in changes.items():
+            _count_contacts(user, user_changes, db)
         db.commit()
-    return contact
\ No newline at end of file
+    return repaired
@@ -1,9 +1,12 @@
-from libgravatar import Gravatar
+import logging
+
 from sqlalchemy.orm import Session
 
 from models import User
+from database.connection import release
 from schemas import UserModel
 
+logger = logging.getLogger(__name__)
 
 async def get_user_by_email(email: str, db: Session) -> User:
     """
@@ -17,7 +20,9 @@ async def get_user_by_email(email: str, db: Session) -> User:
         User: The User object if found, otherwise None.
 
     """
-    return db.query(User).filter(User.email == email).first()
+    user = db.query(User).filter(User.email == email).first()
+    release(db)
+    return user
 
 
 async def create_user(body: UserModel, db: Session) -> User:
@@ -32,12 +37,14 @@ async def create_user(body: UserModel, db: Session) -> User:
         User: The created User object.
 
     """
+    from libgravatar import Gravatar
+
     avatar = None
     try:
         g = Gravatar(body.email)
         avatar = g.get_image()
     except Exception as e:
-        print(e)
+        logger.warning("Gravatar lookup failed for %s: %s", body.email, e)
     new_user = User(**body.dict(), avatar=avatar)
     db.add(new_user)
     db.commit()
@@ -59,6 +66,24 @@ async def update_token(user: User, token: str | None, db: Session) -> None:
     db.commit()
 
 
+async def update_avatar(user: User, url: str, db: Session) -> User:
+    """
+    Set a user's avatar URL.
+
+    Args:
+        user (User): The user object.
+        url (str): The avatar URL.
+        db (Session): The database session.
+
+    Returns:
+        User: The updated User object.
+
+    """
+    user.avatar = url
+    db.commit()
+    return user
+
+
 async def confirmed_email(email: str, db: Session) -> None:
     """
     Mark a user's email as confirmed.
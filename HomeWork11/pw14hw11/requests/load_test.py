@@ -0,0 +1,291 @@
+"""
+Load test
+=========
+
+Async load generator for a running instance of the app. It signs up, confirms
+and logs in ``--users`` users once, reuses their access tokens and then runs a
+weighted mix of contact operations for ``--duration`` seconds, either with a
+fixed number of concurrent workers (``--concurrency``) or at a target request
+rate (``--rps``, open loop: requests are started on schedule whether or not
+earlier ones have finished, up to ``--max-in-flight``).
+
+Operations: ``create``, ``read`` (one contact), ``list``, ``update``,
+``delete`` and ``search`` (``/contacts/?search_name=``).
+
+Users are confirmed with a token signed by ``services.auth``, so the app must
+use the same secret. The app's rate limits apply to the load as well; start it
+with higher limits to measure the app itself, e.g.::
+
+    LOGIN_RATE_LIMIT_IP=100000/1 CONTACTS_RATE_LIMIT=100000/1 python server.py
+
+Usage::
+
+    python requests/load_test.py [--base-url URL] [--users N] [--concurrency N | --rps R]
+                                 [--duration S] [--mix create=2,read=5,list=2,update=1,delete=1,search=1]
+
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+DEFAULT_MIX = "create=2,read=5,list=2,update=1,delete=1,search=1"
+FIRST_NAMES = ["Anna", "Olena", "Ivan", "Petro", "Maria", "Andrii", "Sofia", "Taras", "Iryna", "Dmytro"]
+LAST_NAMES = ["Shevchenko", "Kovalenko", "Bondarenko", "Tkachenko", "Kravchenko", "Melnyk", "Boyko", "Koval"]
+
+
+@dataclass
+class LoadUser:
+    email: str
+    headers: dict
+    contact_ids: list[int] = field(default_factory=list)
+
+
+@dataclass
+class OperationStats:
+    latencies: list[float] = field(default_factory=list)
+    statuses: dict[int | str, int] = field(default_factory=lambda: defaultdict(int))
+    errors: int = 0
+
+    def record(self, latency: float, status: int | str) -> None:
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        if status == "error" or status >= 400:
+            self.errors += 1
+
+
+def parse_mix(spec: str) -> dict[str, float]:
+    """
+    Parse an operation mix like ``create=2,read=5``.
+
+    Args:
+        spec (str): Comma separated ``operation=weight`` pairs.
+
+    Returns:
+        dict[str, float]: Weight per operation.
+
+    Raises:
+        ValueError: If an operation is unknown or no weight is positive.
+
+    """
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("the mix needs at least one operation with a positive weight")
+    return mix
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+def random_contact(rng: random.Random) -> dict:
+    first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        # The /api/contacts body schema requires an id, which the routes ignore.
+        "id": 0,
+        "first_name": first_name,
+        "last_name": last_name,
+        "phone_number": f"+380{rng.randrange(10 ** 9):09d}",
+        "email": f"{first_name}.{last_name}{rng.randrange(10 ** 6)}@example.com".lower(),
+        "birthdate": f"{rng.randint(1950, 2005)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+    }
+
+
+async def op_create(client: httpx.AsyncClient, user: LoadUser, rng: random.Random) -> httpx.Response:
+    response = await client.post("/api/contacts/", json=random_contact(rng), headers=user.headers)
+    if response.status_code == 200:
+        user.contact_ids.append(response.json()["id"])
+    return response
+
+
+async def op_read(client: httpx.AsyncClient, user: LoadUser, rng: random.Random) -> httpx.Response:
+    if not user.contact_ids:
+        return await op_create(client, user, rng)
+    return await client.get(f"/api/contacts/{rng.choice(user.contact_ids)}", headers=user.headers)
+
+
+async def op_list(client: httpx.AsyncClient, user: LoadUser, rng: random.Random) -> httpx.Response:
+    return await client.get("/api/contacts/", params={"limit": 100}, headers=user.headers)
+
+
+async def op_update(client: httpx.AsyncClient, user: LoadUser, rng: random.Random) -> httpx.Response:
+    if not user.contact_ids:
+        return await op_create(client, user, rng)
+    contact_id = rng.choice(user.contact_ids)
+    return await client.put(f"/api/contacts/{contact_id}", json=random_contact(rng), headers=user.headers)
+
+
+async def op_delete(client: httpx.AsyncClient, user: LoadUser, rng: random.Random) -> httpx.Response:
+    if not user.contact_ids:
+        return await op_create(client, user, rng)
+    contact_id = user.contact_ids.pop(rng.randrange(len(user.contact_ids)))
+    return await client.delete(f"/api/contacts/{contact_id}", headers=user.headers)
+
+
+async def op_search(client: httpx.AsyncClient, user: LoadUser, rng: random.Random) -> httpx.Response:
+    return await client.get("/contacts/", params={"search_name": rng.choice(FIRST_NAMES)})
+
+
+OPERATIONS = {
+    "create": op_create,
+    "read": op_read,
+    "list": op_list,
+    "update": op_update,
+    "delete": op_delete,
+    "search": op_search,
+}
+
+
+async def _retrying(send) -> httpx.Response:
+    """Send a setup request, waiting out rate limits."""
+    while True:
+        response = await send()
+        if response.status_code != 429:
+            return response
+        await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+
+async def prepare_user(client: httpx.AsyncClient, n: int, prefix: str, password: str,
+                       contacts: int, rng: random.Random) -> LoadUser:
+    """Sign up, confirm and log in one user and give them ``contacts`` contacts."""
+    from services.auth import auth_service
+
+    email = f"{prefix}{n}@example.com"
+    response = await _retrying(lambda: client.post("/api/auth/signup", json={
+        "username": f"{prefix}{n}", "email": email, "password": password}))
+    if response.status_code not in (201, 409):
+        response.raise_for_status()
+    await client.get(f"/api/auth/confirmed_email/{auth_service.create_email_token({'sub': email})}")
+    response = await _retrying(lambda: client.post("/api/auth/login",
+                                                   data={"username": email, "password": password}))
+    response.raise_for_status()
+    user = LoadUser(email, {"Authorization": f"Bearer {response.json()['access_token']}"})
+    for _ in range(contacts):
+        await _retrying(lambda: op_create(client, user, rng))
+    return user
+
+
+async def run_operation(client, users, mix, rng, stats) -> None:
+    name = rng.choices(list(mix), weights=list(mix.values()))[0]
+    start = time.perf_counter()
+    try:
+        response = await OPERATIONS[name](client, rng.choice(users), rng)
+        status = response.status_code
+    except httpx.HTTPError:
+        status = "error"
+    stats[name].record(time.perf_counter() - start, status)
+
+
+async def closed_loop(client, users, mix, rng, stats, concurrency: int, duration: float) -> None:
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            await run_operation(client, users, mix, rng, stats)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def open_loop(client, users, mix, rng, stats, rps: float, duration: float, max_in_flight: int) -> int:
+    """Start requests at ``rps``; returns how many were skipped because ``max_in_flight`` were running."""
+    in_flight = set()
+    skipped = 0
+    start = time.perf_counter()
+    for n in range(int(rps * duration)):
+        delay = start + n / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= max_in_flight:
+            skipped += 1
+            continue
+        task = asyncio.create_task(run_operation(client, users, mix, rng, stats))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.wait(in_flight)
+    return skipped
+
+
+def report(stats: dict[str, OperationStats], elapsed: float) -> None:
+    print(f"{'operation':<10}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}  statuses")
+    total = OperationStats()
+    for name, op in sorted(stats.items()):
+        _report_line(name, op, elapsed)
+        total.latencies.extend(op.latencies)
+        total.errors += op.errors
+        for status, count in op.statuses.items():
+            total.statuses[status] += count
+    _report_line("total", total, elapsed)
+
+
+def _report_line(name: str, op: OperationStats, elapsed: float) -> None:
+    latencies = sorted(op.latencies)
+    statuses = " ".join(f"{status}:{count}" for status, count in sorted(op.statuses.items(), key=str))
+    print(f"{name:<10}{len(latencies):>10}{len(latencies) / elapsed:>9.1f}"
+          f"{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 95) * 1000:>9.1f}"
+          f"{percentile(latencies, 99) * 1000:>9.1f}{op.errors:>8}  {statuses}")
+
+
+async def main_async(args) -> None:
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.max_in_flight if args.rps else args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        print(f"preparing {args.users} users")
+        users = await asyncio.gather(*(prepare_user(client, n, args.user_prefix, args.password, args.contacts, rng)
+                                       for n in range(args.users)))
+
+        stats = defaultdict(OperationStats)
+        mode = f"{args.rps} req/s" if args.rps else f"concurrency {args.concurrency}"
+        print(f"running {mode} for {args.duration:g} s")
+        start = time.perf_counter()
+        if args.rps:
+            skipped = await open_loop(client, users, mix, rng, stats, args.rps, args.duration, args.max_in_flight)
+        else:
+            skipped = 0
+            await closed_loop(client, users, mix, rng, stats, args.concurrency, args.duration)
+        report(stats, time.perf_counter() - start)
+        if skipped:
+            print(f"{skipped} requests not started: --max-in-flight {args.max_in_flight} reached")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--user-prefix", default="loadtest")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--contacts", type=int, default=5, help="contacts created per user before the run")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--concurrency", type=int, default=10)
+    group.add_argument("--rps", type=float)
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Run as a script from requests/, so make the app packages importable for services.auth.
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
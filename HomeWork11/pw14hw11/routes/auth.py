@@ -1,18 +1,70 @@
+from uuid import uuid4
+
 from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy.orm import Session
 
 from database.connection import get_db
-from schemas import UserModel, UserResponse, TokenModel
+from models import User
+from schemas import UserModel, UserResponse, TokenModel, TokenRevokeModel
 from repository import users as repository_users
 from services.auth import auth_service
 from services.email import send_email
+from services.metrics import email_queue_depth
+from services.rate_limit import limit_login
+from services.token_store import refresh_token_store, Rotation
+from services.revocation import revocation_filter
 
 
 router = APIRouter(prefix='/auth', tags=["auth"])
 security = HTTPBearer()
 
 
+async def issue_tokens(email: str) -> dict:
+    """
+    Start a new session for a user and create its first token pair.
+
+    Args:
+        email (str): The user's email.
+
+    Returns:
+        dict: Access and refresh tokens along with the token type.
+
+    """
+    sid, jti = uuid4().hex, uuid4().hex
+    access_token = await auth_service.create_access_token(data={"sub": email, "sid": sid})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": email, "sid": sid, "jti": jti})
+    await refresh_token_store.create_session(email, sid, jti, auth_service.REFRESH_TOKEN_EXPIRE_SECONDS)
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
+async def rotate_tokens(token: str) -> dict:
+    """
+    Exchange a refresh token for a new token pair of the same session.
+
+    Reusing an already rotated refresh token revokes the whole session.
+
+    Args:
+        token (str): The refresh token.
+
+    Returns:
+        dict: Access and refresh tokens along with the token type.
+
+    Raises:
+        HTTPException: If the refresh token is invalid, expired or reused.
+
+    """
+    payload = await auth_service.decode_refresh_token_payload(token)
+    email, sid, jti = payload["sub"], payload.get("sid"), payload.get("jti")
+    new_jti = uuid4().hex
+    ttl = auth_service.REFRESH_TOKEN_EXPIRE_SECONDS
+    if sid is None or await refresh_token_store.rotate(email, sid, jti, new_jti, ttl) is not Rotation.OK:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    access_token = await auth_service.create_access_token(data={"sub": email, "sid": sid})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": email, "sid": sid, "jti": new_jti})
+    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
     """
@@ -38,11 +90,12 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
     body.password = auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
+    email_queue_depth.inc()
     background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
     return {"user": new_user, "detail": "User successfully created"}
 
 
-@router.post("/login", response_model=TokenModel)
+@router.post("/login", response_model=TokenModel, dependencies=[Depends(limit_login)])
 async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """
     User Login
@@ -67,42 +120,75 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
     if not auth_service.verify_password(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
-    # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+    return await issue_tokens(user.email)
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     """
     Refresh Token
 
-    Get a new access and refresh token pair.
+    Get a new access and refresh token pair. The presented refresh token is
+    rotated in the refresh token store; the users table is not touched.
 
     Args:
         credentials (HTTPAuthorizationCredentials): Authorization credentials with refresh token.
-        db (Session): Database session.
 
     Returns:
         dict: Response containing new access and refresh tokens.
 
     Raises:
-        HTTPException: If the refresh token is invalid.
+        HTTPException: If the refresh token is invalid or was already used.
 
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    return await rotate_tokens(credentials.credentials)
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
-    return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
+
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: str = Depends(auth_service.oauth2_scheme),
+                 current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Logout
+
+    Revoke the presented access token and end its session, so the session's
+    refresh token can't be used anymore either. Tokens issued without a ``jti``
+    can't be revoked; they only end their session.
+
+    Args:
+        token (str): The access token.
+        current_user (User): Authenticated user.
+
+    """
+    payload = auth_service.decode_token(token)
+    if payload.get("jti"):
+        await revocation_filter.revoke(payload["jti"], payload["exp"])
+    if payload.get("sid"):
+        await refresh_token_store.revoke_session(current_user.email, payload["sid"])
+
+
+@router.post('/revoke', status_code=status.HTTP_204_NO_CONTENT)
+async def revoke(body: TokenRevokeModel, current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Revoke Token
+
+    Revoke an access or refresh token of the authenticated user before it expires.
+    Revoking a refresh token ends its session.
+
+    Args:
+        body (TokenRevokeModel): The token to revoke.
+        current_user (User): Authenticated user.
+
+    Raises:
+        HTTPException: If the token is invalid or belongs to another user.
+
+    """
+    payload = auth_service.decode_token(body.token)
+    if payload.get("sub") != current_user.email:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Token belongs to another user")
+    if payload.get("jti"):
+        await revocation_filter.revoke(payload["jti"], payload["exp"])
+    if payload.get("scope") == "refresh_token" and payload.get("sid"):
+        await refresh_token_store.revoke_session(current_user.email, payload["sid"])
 
 
 @router.get('/confirmed_email/{token}')
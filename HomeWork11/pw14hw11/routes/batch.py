@@ -0,0 +1,140 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from database.connection import release
+from database.sharding import get_shard_db
+from models import User
+from schemas import BatchRequest, BatchResponse, BatchResult, BatchOperation, Contact as ContactSchema
+from routes.auth import auth_service
+from repository import contacts as repository_contacts
+from services.rate_limit import backend, client_ip, contacts_limit
+from services.events import publish_events
+from services.idempotency import idempotent_requests
+from services.singleflight import contacts_flight
+
+
+router = APIRouter(prefix='/batch', tags=['batch'])
+
+
+async def run_operation(operation: BatchOperation, user: User, db: Session) -> BatchResult:
+    """
+    Run one batch operation without committing it.
+
+    Args:
+        operation (BatchOperation): The operation.
+        user (User): Authenticated user.
+        db (Session): Database session.
+
+    Returns:
+        BatchResult: Status and contact of the operation.
+
+    Raises:
+        HTTPException: If the contact is not found.
+
+    """
+    if operation.op == "get":
+        contact = await repository_contacts.get_contact(operation.id, user, db)
+    elif operation.op == "create":
+        contact = await repository_contacts.create_contact(operation.body, user, db, commit=False)
+    elif operation.op == "update":
+        contact = await repository_contacts.update_contact(operation.id, operation.body, user, db, commit=False)
+    else:
+        contact = await repository_contacts.remove_contact(operation.id, user, db, commit=False)
+    if contact is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+    return BatchResult(status=status.HTTP_201_CREATED if operation.op == "create" else status.HTTP_200_OK,
+                       contact=ContactSchema.model_validate(contact, from_attributes=True))
+
+
+def failed_result(error: Exception) -> BatchResult:
+    if isinstance(error, HTTPException):
+        return BatchResult(status=error.status_code, detail=error.detail)
+    return BatchResult(status=status.HTTP_409_CONFLICT, detail="Operation conflicts with stored data")
+
+
+@router.post("/", response_model=BatchResponse)
+async def run_batch(body: BatchRequest, request: Request, idempotency_key: str | None = Header(None, max_length=255),
+                    db: Session = Depends(get_shard_db),
+                    current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Batch Contact Operations
+
+    Run a list of get/create/update/delete contact operations in order, in one
+    request and one database session.
+
+    With ``atomic`` (the default) all operations are committed together, and if
+    one fails nothing is stored: the failing operation reports its error and
+    the others 424. Otherwise every operation runs in its own savepoint, so a
+    failing one is rolled back alone and the rest are committed.
+
+    Each operation counts against the contacts rate limit.
+
+    With an ``Idempotency-Key`` header, a retry of the batch gets the stored
+    response instead of running again, see ``services/idempotency.py``.
+
+    Args:
+        body (BatchRequest): The operations and transaction mode.
+        request (Request): The incoming request object.
+        idempotency_key (str, optional): ``Idempotency-Key`` header.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        BatchResponse: Per-operation results in request order, and whether anything was committed.
+
+    """
+    if idempotency_key is None:
+        return await apply_batch(body, request, db, current_user)
+    # Don't hold a connection while waiting for an earlier request with the key.
+    release(db)
+    return await idempotent_requests.run(f"{current_user.id}:batch", idempotency_key, body.model_dump(mode="json"),
+                                         lambda: apply_batch(body, request, db, current_user))
+
+
+async def apply_batch(body: BatchRequest, request: Request, db: Session, current_user: User) -> BatchResponse:
+    """
+    Run a batch, see :func:`run_batch`.
+
+    Args:
+        body (BatchRequest): The operations and transaction mode.
+        request (Request): The incoming request object.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        BatchResponse: Per-operation results in request order, and whether anything was committed.
+
+    """
+    await contacts_limit.check(backend, f"contacts:ip:{client_ip(request)}", cost=len(body.operations))
+
+    results = []
+    if body.atomic:
+        for n, operation in enumerate(body.operations):
+            try:
+                results.append(await run_operation(operation, current_user, db))
+            except (HTTPException, SQLAlchemyError) as e:
+                db.rollback()
+                failed = failed_result(e)
+                skipped = BatchResult(status=status.HTTP_424_FAILED_DEPENDENCY,
+                                      detail=f"Not applied: operation {n} failed")
+                return BatchResponse(committed=False,
+                                     results=[skipped] * n + [failed] + [skipped] * (len(body.operations) - n - 1))
+        db.commit()
+        contacts_flight.invalidate(current_user.id)
+        await publish_events(db)
+        return BatchResponse(committed=True, results=results)
+
+    for operation in body.operations:
+        savepoint = db.begin_nested()
+        try:
+            result = await run_operation(operation, current_user, db)
+            savepoint.commit()
+        except (HTTPException, SQLAlchemyError) as e:
+            savepoint.rollback()
+            result = failed_result(e)
+        results.append(result)
+    db.commit()
+    contacts_flight.invalidate(current_user.id)
+    await publish_events(db)
+    return BatchResponse(committed=any(result.status < 400 for result in results), results=results)
@@ -1,18 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from database.connection import get_db
+from database.connection import get_db, release
+from database.sharding import get_shard_db
 from models import User
-from schemas import Contact as ContactModel
+from schemas import AuditPage, Contact as ContactModel, ContactStats, DomainCount, DuplicatePair, MergeRequest
 from routes.auth import auth_service
-from repository import contacts as repository_contacts
+from repository import audit as repository_audit, contacts as repository_contacts
+from services.events import contact_broker
+from services.idempotency import idempotent_requests
+from services.rate_limit import limit_contacts
+from env import DEDUP_MIN_SCORE
 
 
-router = APIRouter(prefix='/contacts', tags=['contacts'])
+router = APIRouter(prefix='/contacts', tags=['contacts'], dependencies=[Depends(limit_contacts)])
 
 
 @router.get("/")
-async def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
+async def read_contacts(skip: int = 0, limit: int = 100, domain: str | None = Query(None, max_length=255),
+                        db: Session = Depends(get_shard_db),
                         current_user: User = Depends(auth_service.get_current_user)):
     """
     Get Contacts
@@ -22,6 +31,7 @@ async def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(g
     Args:
         skip (int, optional): Number of items to skip. Defaults to 0.
         limit (int, optional): Maximum number of items to retrieve. Defaults to 100.
+        domain (str, optional): Only contacts with an email address at this domain, e.g. ``company.com``.
         db (Session): Database session.
         current_user (User): Authenticated user.
 
@@ -29,12 +39,222 @@ async def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(g
         List[ContactModel]: List of contact models.
 
     """
-    contacts = await repository_contacts.get_contacts(skip, limit, current_user, db)
+    contacts = await repository_contacts.get_contacts(skip, limit, current_user, db, domain=domain)
+    return contacts
+
+
+@router.get("/domains", response_model=list[DomainCount])
+async def read_email_domains(limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_shard_db),
+                             current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Email Domains
+
+    Count the authenticated user's contacts per email domain.
+
+    Args:
+        limit (int, optional): Maximum number of domains to retrieve. Defaults to 100.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        List[DomainCount]: Domains with their number of contacts, most frequent first.
+
+    """
+    return await repository_contacts.get_email_domains(current_user, db, limit)
+
+
+@router.get("/stats", response_model=ContactStats)
+async def read_contact_stats(db: Session = Depends(get_shard_db),
+                             current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Contact Stats
+
+    Retrieve the authenticated user's number of contacts and birthdays per month.
+
+    Args:
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        ContactStats: Total contacts, birthdays per month from January and contacts without birthdate.
+
+    """
+    return await repository_contacts.get_contact_stats(current_user, db)
+
+
+@router.get("/events", response_class=StreamingResponse)
+async def stream_contact_events(last_event_id: str | None = Header(None, max_length=64),
+                                db: Session = Depends(get_db),
+                                current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Stream Contact Events
+
+    Push the authenticated user's contact changes as server-sent events
+    (``created``, ``updated`` and ``deleted``), instead of polling the contact list.
+
+    Args:
+        last_event_id (str, optional): ``Last-Event-ID`` header, id of the last event received before reconnecting.
+        db (Session): Database session, only used for authentication.
+        current_user (User): Authenticated user.
+
+    Returns:
+        StreamingResponse: A ``text/event-stream`` of events; a ``reset`` event means missed events are
+        lost and contacts should be reloaded.
+
+    """
+    release(db)
+    return StreamingResponse(contact_broker.stream(current_user.id, last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/history", response_model=AuditPage)
+async def read_contacts_history(before: int | None = Query(None, ge=1), limit: int = Query(50, ge=1, le=500),
+                                db: Session = Depends(get_db),
+                                current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Contacts History
+
+    Retrieve the changes to the authenticated user's contacts, newest first. Changes
+    appear after up to ``AUDIT_FLUSH_INTERVAL`` seconds.
+
+    Args:
+        before (int, optional): ``next_before`` of the previous page.
+        limit (int, optional): Maximum number of changes to retrieve. Defaults to 50.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        AuditPage: The changes and the ``before`` of the next page.
+
+    """
+    return await repository_audit.get_audit_events(current_user, db, before=before, limit=limit)
+
+
+@router.get("/birthdays")
+async def read_upcoming_birthdays(days: int = Query(7, ge=0, le=365), db: Session = Depends(get_shard_db),
+                                  current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Upcoming Birthdays
+
+    Retrieve the authenticated user's contacts with a birthday in the next days.
+
+    Args:
+        days (int, optional): Number of days to look ahead. Defaults to 7.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        List[ContactModel]: Contacts ordered by upcoming birthday.
+
+    """
+    return await repository_contacts.get_upcoming_birthdays(days, current_user, db)
+
+
+@router.get("/duplicates", response_model=list[DuplicatePair])
+async def read_duplicates(min_score: float = Query(DEDUP_MIN_SCORE, ge=0, le=1), limit: int = Query(100, ge=1, le=1000),
+                          db: Session = Depends(get_shard_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Duplicate Contacts
+
+    Retrieve pairs of the authenticated user's contacts that are likely the same person.
+
+    Args:
+        min_score (float, optional): Lowest score of a reported pair. Defaults to ``DEDUP_MIN_SCORE``.
+        limit (int, optional): Maximum number of pairs to retrieve. Defaults to 100.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        List[DuplicatePair]: Pairs with their score and matching signals, best first.
+
+    """
+    return await repository_contacts.get_duplicates(current_user, db, min_score=min_score, limit=limit)
+
+
+@router.post("/duplicates/scan", response_model=list[DuplicatePair])
+async def scan_duplicates(min_score: float = Query(DEDUP_MIN_SCORE, ge=0, le=1),
+                          limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_shard_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Scan for Duplicate Contacts
+
+    Recompute the duplicate detection keys of all of the authenticated user's
+    contacts, e.g. after a bulk import, and retrieve the duplicate pairs.
+
+    Args:
+        min_score (float, optional): Lowest score of a reported pair. Defaults to ``DEDUP_MIN_SCORE``.
+        limit (int, optional): Maximum number of pairs to retrieve. Defaults to 100.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        List[DuplicatePair]: Pairs with their score and matching signals, best first.
+
+    """
+    repository_contacts.rebuild_dedup_keys(current_user.id, db)
+    db.commit()
+    return await repository_contacts.get_duplicates(current_user, db, min_score=min_score, limit=limit)
+
+
+@router.post("/merge")
+async def merge_contacts(body: MergeRequest, db: Session = Depends(get_shard_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Merge Contacts
+
+    Merge duplicate contacts of the authenticated user into one and delete the others.
+
+    Args:
+        body (MergeRequest): The contact to keep, the contacts to merge into it and optional final details.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        ContactModel: The kept contact.
+
+    Raises:
+        HTTPException: If any of the contacts is not found.
+
+    """
+    contact = await repository_contacts.merge_contacts(body.keep, body.merge, body.body, current_user, db)
+    if contact is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+    return contact
+
+
+@router.get("/by-phone/{number}", response_model=list[ContactModel])
+async def read_contacts_by_phone(number: str, match: Literal["exact", "suffix"] = "exact",
+                                 limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_shard_db),
+                                 current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Contacts by Phone Number
+
+    Retrieve the authenticated user's contacts with a phone number, in any
+    format, or with ``match=suffix`` ending with the given digits.
+
+    Args:
+        number (str): The phone number, or at least its last four digits with ``match=suffix``.
+        match (str, optional): ``exact`` or ``suffix``. Defaults to ``exact``.
+        limit (int, optional): Maximum number of contacts to retrieve. Defaults to 100.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        List[ContactModel]: The matching contacts.
+
+    Raises:
+        HTTPException: If the number is not a phone number or the suffix is too short.
+
+    """
+    contacts = await repository_contacts.get_contacts_by_phone(number, match == "suffix", current_user, db, limit)
+    if contacts is None:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid phone number")
     return contacts
 
 
 @router.get("/{contact_id}")
-async def read_contact(contact_id: int, db: Session = Depends(get_db),
+async def read_contact(contact_id: int, db: Session = Depends(get_shard_db),
                        current_user: User = Depends(auth_service.get_current_user)):
     """
     Get Contact by ID
@@ -59,16 +279,70 @@ async def read_contact(contact_id: int, db: Session = Depends(get_db),
     return contact
 
 
+@router.get("/{contact_id}/duplicates", response_model=list[DuplicatePair])
+async def read_contact_duplicates(contact_id: int, min_score: float = Query(DEDUP_MIN_SCORE, ge=0, le=1),
+                                  limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_shard_db),
+                                  current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Duplicates of a Contact
+
+    Retrieve the authenticated user's contacts that are likely the same person as a contact.
+
+    Args:
+        contact_id (int): The ID of the contact.
+        min_score (float, optional): Lowest score of a reported pair. Defaults to ``DEDUP_MIN_SCORE``.
+        limit (int, optional): Maximum number of pairs to retrieve. Defaults to 100.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        List[DuplicatePair]: Pairs of the contact and a likely duplicate, best first.
+
+    """
+    return await repository_contacts.get_duplicates(current_user, db, contact_id=contact_id, min_score=min_score,
+                                                    limit=limit)
+
+
+@router.get("/{contact_id}/history", response_model=AuditPage)
+async def read_contact_history(contact_id: int, before: int | None = Query(None, ge=1),
+                               limit: int = Query(50, ge=1, le=500), db: Session = Depends(get_db),
+                               current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Get Contact History
+
+    Retrieve the changes to one of the authenticated user's contacts, newest first,
+    also after the contact was deleted.
+
+    Args:
+        contact_id (int): The ID of the contact.
+        before (int, optional): ``next_before`` of the previous page.
+        limit (int, optional): Maximum number of changes to retrieve. Defaults to 50.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        AuditPage: The changes and the ``before`` of the next page.
+
+    """
+    return await repository_audit.get_audit_events(current_user, db, contact_id=contact_id, before=before,
+                                                   limit=limit)
+
+
 @router.post("/")
-async def create_contact(body: ContactModel, db: Session = Depends(get_db),
+async def create_contact(body: ContactModel, idempotency_key: str | None = Header(None, max_length=255),
+                         db: Session = Depends(get_shard_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     Create Contact
 
     Create a new contact for the authenticated user.
 
+    With an ``Idempotency-Key`` header, a retry gets the contact created by
+    the first request instead of a duplicate, see ``services/idempotency.py``.
+
     Args:
         body (ContactModel): Contact details.
+        idempotency_key (str, optional): ``Idempotency-Key`` header.
         db (Session): Database session.
         current_user (User): Authenticated user.
 
@@ -76,11 +350,16 @@ async def create_contact(body: ContactModel, db: Session = Depends(get_db),
         ContactModel: The created contact model.
 
     """
-    return await repository_contacts.create_contact(body, current_user, db)
+    if idempotency_key is None:
+        return await repository_contacts.create_contact(body, current_user, db)
+    # Don't hold a connection while waiting for an earlier request with the key.
+    release(db)
+    return await idempotent_requests.run(f"{current_user.id}:contacts", idempotency_key, body.model_dump(mode="json"),
+                                         lambda: repository_contacts.create_contact(body, current_user, db))
 
 
 @router.put("/{contact_id}")
-async def update_contact(contact_id: int, body: ContactModel, db: Session = Depends(get_db),
+async def update_contact(contact_id: int, body: ContactModel, db: Session = Depends(get_shard_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     Update Contact
@@ -107,7 +386,7 @@ async def update_contact(contact_id: int, body: ContactModel, db: Session = Depe
 
 
 @router.delete("/{contact_id}")
-async def remove_contact(contact_id: int, db: Session = Depends(get_db),
+async def remove_contact(contact_id: int, db: Session = Depends(get_shard_db),
                          current_user: User = Depends(auth_service.get_current_user)):
     """
     Remove Contact
@@ -0,0 +1,155 @@
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Request, status
+from fastapi.responses import FileResponse, Response
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+
+from database.connection import get_db
+from models import User
+from schemas import AvatarResponse
+from repository import users as repository_users
+from services.auth import auth_service
+from services.avatars import MEDIA_TYPE, VARIANTS, InvalidImage, avatar_store
+from env import AVATAR_MAX_BYTES
+
+
+router = APIRouter(prefix='/users', tags=['users'])
+
+# Avatar URLs change with their content, so clients and proxies may keep them forever.
+IMMUTABLE = "public, max-age=31536000, immutable"
+READ_CHUNK = 64 * 1024
+# Room for the multipart boundaries and part headers around the file.
+FORM_OVERHEAD = 16 * 1024
+AVATAR_FORM = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}}}}}}
+
+
+def avatar_url(request: Request, key: str, variant: str) -> str:
+    return str(request.url_for("read_avatar", key=key, variant=variant).path)
+
+
+def too_large() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Avatar is too large")
+
+
+async def read_limited_form(request: Request, max_bytes: int):
+    """
+    Parse a multipart body, refusing it as soon as it's larger than ``max_bytes``.
+
+    A ``File()`` parameter would have the whole body spooled before the
+    handler could look at its size, so the form is parsed here: bodies that
+    announce a larger ``Content-Length`` are refused unread, and chunked ones
+    once they pass the limit.
+
+    Args:
+        request (Request): The incoming request object.
+        max_bytes (int): Largest accepted body.
+
+    Returns:
+        FormData: The parsed form.
+
+    Raises:
+        HTTPException: 413 if the body is too large.
+
+    """
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > max_bytes:
+        raise too_large()
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get("body", b""))
+        if received > max_bytes:
+            raise too_large()
+        return message
+
+    return await Request(request.scope, receive).form()
+
+
+@router.put("/me/avatar", response_model=AvatarResponse, openapi_extra=AVATAR_FORM)
+async def upload_avatar(request: Request, db: Session = Depends(get_db),
+                        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    Upload Avatar
+
+    Replace the authenticated user's avatar with an uploaded JPEG, PNG, GIF
+    or WebP image, resized into square variants.
+
+    Args:
+        request (Request): The incoming request object, a form with the image as ``file``,
+            at most ``AVATAR_MAX_BYTES``.
+        db (Session): Database session.
+        current_user (User): Authenticated user.
+
+    Returns:
+        AvatarResponse: URL of the medium avatar, now the user's ``avatar``, and URLs of all variants.
+
+    Raises:
+        HTTPException: 413 if the file is too large, 415 if it isn't an accepted image,
+            422 if there is no file, 503 if image processing isn't installed.
+
+    """
+    form = await read_limited_form(request, AVATAR_MAX_BYTES + FORM_OVERHEAD)
+    try:
+        file = form.get("file")
+        if not isinstance(file, UploadFile):
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Avatar file is missing")
+        data = bytearray()
+        while chunk := await file.read(READ_CHUNK):
+            data += chunk
+            if len(data) > AVATAR_MAX_BYTES:
+                raise too_large()
+    finally:
+        await form.close()
+    try:
+        key = await avatar_store.save(bytes(data))
+    except InvalidImage:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Avatar must be a JPEG, PNG, GIF or WebP image")
+    except RuntimeError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Avatar uploads are not available")
+    variants = {variant: avatar_url(request, key, variant) for variant in VARIANTS}
+    await repository_users.update_avatar(current_user, variants["medium"], db)
+    return {"avatar": variants["medium"], "variants": variants}
+
+
+@router.get("/avatars/{key}/{variant}", name="read_avatar", response_class=FileResponse)
+async def read_avatar(key: str = Path(pattern="^[0-9a-f]{32}$"), variant: Literal[tuple(VARIANTS)] = Path(),
+                      if_none_match: str | None = Header(None)):
+    """
+    Get Avatar
+
+    Serve an avatar variant. Avatar URLs are content-addressed, so responses
+    may be cached forever and revalidations are answered with 304.
+
+    Args:
+        key (str): The avatar key.
+        variant (str): ``small``, ``medium`` or ``large``.
+        if_none_match (str, optional): ``If-None-Match`` header, one or more ETags or ``*``.
+
+    Returns:
+        Response: The JPEG image.
+
+    Raises:
+        HTTPException: If the avatar doesn't exist.
+
+    """
+    headers = {"Cache-Control": IMMUTABLE, "ETag": f'"{key}-{variant}"'}
+    # If-None-Match compares weakly, so W/ tags match too.
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")} if if_none_match else set()
+    not_modified = Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if headers["ETag"] in tags:
+        return not_modified
+    content = await avatar_store.cached(key, variant)
+    if content is not None:
+        return not_modified if "*" in tags else Response(content, media_type=MEDIA_TYPE, headers=headers)
+    path = avatar_store.path(key, variant)
+    if not await run_in_threadpool(path.is_file):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar not found")
+    # "*" matches any existing avatar, but not a missing one.
+    return not_modified if "*" in tags else FileResponse(path, media_type=MEDIA_TYPE, headers=headers)
@@ -1,6 +1,10 @@
-from pydantic import BaseModel, Field
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
 from datetime import datetime, date
 
+from env import BATCH_MAX_OPERATIONS
+
 
 class ContactCreate(BaseModel):
     first_name: str
@@ -12,6 +16,7 @@ class ContactCreate(BaseModel):
 
 class Contact(ContactCreate):
     id: int
+    phone_e164: str | None = None
     
     class Config:
         orm_mode = True
@@ -39,7 +44,94 @@ class UserResponse(BaseModel):
     detail: str = "User successfully created"
 
 
+class AvatarResponse(BaseModel):
+    avatar: str
+    variants: dict[str, str]
+
+
+class TokenRevokeModel(BaseModel):
+    token: str
+
+
 class TokenModel(BaseModel):
     access_token: str
     refresh_token: str
-    token_type: str = "bearer"
\ No newline at end of file
+    token_type: str = "bearer"
+
+
+class BatchOperation(BaseModel):
+    op: Literal["get", "create", "update", "delete"]
+    id: int | None = None
+    body: ContactCreate | None = None
+
+    @model_validator(mode="after")
+    def check_arguments(self):
+        if self.op != "create" and self.id is None:
+            raise ValueError(f"{self.op} needs an id")
+        if self.op in ("create", "update") and self.body is None:
+            raise ValueError(f"{self.op} needs a body")
+        return self
+
+
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(min_length=1, max_length=BATCH_MAX_OPERATIONS)
+    atomic: bool = True
+
+
+class BatchResult(BaseModel):
+    status: int
+    contact: Contact | None = None
+    detail: str | None = None
+
+
+class BatchResponse(BaseModel):
+    committed: bool
+    results: list[BatchResult]
+
+
+class DomainCount(BaseModel):
+    domain: str
+    contacts: int
+
+
+class ContactStats(BaseModel):
+    contacts: int
+    birthdays_per_month: list[int] = Field(min_length=12, max_length=12)
+    without_birthdate: int
+
+
+class AuditEntry(BaseModel):
+    id: int
+    # The contact's id in that shard generation, which changes when its user is moved to another shard.
+    contact_id: int
+    generation: int
+    action: Literal["created", "updated", "deleted"]
+    # Changed fields as ``[old, new]``.
+    changes: dict[str, list]
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class AuditPage(BaseModel):
+    items: list[AuditEntry]
+    next_before: int | None = None
+
+
+class DuplicatePair(BaseModel):
+    score: float
+    signals: list[Literal["email", "phone", "name", "birthdate"]]
+    contacts: list[Contact]
+
+
+class MergeRequest(BaseModel):
+    keep: int
+    merge: list[int] = Field(min_length=1, max_length=BATCH_MAX_OPERATIONS)
+    body: ContactCreate | None = None
+
+    @model_validator(mode="after")
+    def check_ids(self):
+        if self.keep in self.merge or len(set(self.merge)) != len(self.merge):
+            raise ValueError("merge needs distinct ids other than keep")
+        return self
@@ -0,0 +1,133 @@
+"""
+Production Server
+=================
+
+Runs the application with several worker processes. ``python main.py`` is a
+single-process development server that reloads on file changes; this is the
+entry point for deployments.
+
+- One worker per available CPU unless ``--workers``/``WEB_CONCURRENCY`` is set.
+- uvloop and httptools are used when installed.
+- Idle keep-alive connections are kept for ``KEEP_ALIVE_TIMEOUT`` seconds, which
+  should be longer than the idle timeout of the load balancer in front.
+- On SIGTERM workers stop accepting connections, finish in-flight requests and
+  pending verification emails for up to ``GRACEFUL_SHUTDOWN_TIMEOUT`` seconds.
+- With ``--preload`` (``PRELOAD_APP``) the app is served by gunicorn with uvicorn
+  workers and imported once before forking, so workers share its memory
+  copy-on-write. Database connections and the metrics flusher are created per
+  worker by the application lifespan, after the fork.
+
+Usage::
+
+    python server.py [--workers N] [--preload] [--host HOST] [--port PORT]
+
+"""
+
+import argparse
+import os
+from importlib.util import find_spec
+
+from env import (WEB_CONCURRENCY, SERVER_HOST, SERVER_PORT, KEEP_ALIVE_TIMEOUT, SERVER_BACKLOG,
+                 GRACEFUL_SHUTDOWN_TIMEOUT, PRELOAD_APP, LOG_LEVEL)
+
+
+def default_workers() -> int:
+    """
+    Number of CPUs this process may run on, respecting container CPU affinity.
+
+    Returns:
+        int: The default number of workers.
+
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def resolve_loop(loop: str) -> str:
+    if loop == "auto":
+        return "uvloop" if find_spec("uvloop") else "asyncio"
+    return loop
+
+
+def resolve_http(http: str) -> str:
+    if http == "auto":
+        return "httptools" if find_spec("httptools") else "h11"
+    return http
+
+
+def run_uvicorn(args) -> None:
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=resolve_loop(args.loop),
+        http=resolve_http(args.http),
+        timeout_keep_alive=args.keep_alive,
+        backlog=args.backlog,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        proxy_headers=True,
+        # Requests are logged by AccessLogMiddleware.
+        access_log=False,
+        log_level=LOG_LEVEL.lower(),
+    )
+
+
+def run_gunicorn(args) -> None:
+    from gunicorn.app.base import BaseApplication
+    from uvicorn.workers import UvicornWorker
+
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {"loop": resolve_loop(args.loop), "http": resolve_http(args.http),
+                         "proxy_headers": True, "access_log": False}
+
+    class Application(BaseApplication):
+
+        def load_config(self):
+            options = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "worker_class": Worker,
+                "keepalive": args.keep_alive,
+                "backlog": args.backlog,
+                "graceful_timeout": args.graceful_timeout,
+                "preload_app": True,
+                "loglevel": LOG_LEVEL.lower(),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+
+            return app
+
+    Application().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY or default_workers())
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default="auto")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default="auto")
+    parser.add_argument("--keep-alive", type=int, default=KEEP_ALIVE_TIMEOUT)
+    parser.add_argument("--backlog", type=int, default=SERVER_BACKLOG)
+    parser.add_argument("--graceful-timeout", type=int, default=GRACEFUL_SHUTDOWN_TIMEOUT)
+    parser.add_argument("--preload", action="store_true", default=PRELOAD_APP,
+                        help="import the app before forking workers (requires gunicorn)")
+    args = parser.parse_args()
+
+    if args.preload:
+        run_gunicorn(args)
+    else:
+        run_uvicorn(args)
+
+
+if __name__ == '__main__':
+    main()
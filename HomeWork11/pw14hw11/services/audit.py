@@ -0,0 +1,242 @@
+"""
+Audit log
+=========
+
+Committed contact changes are recorded in ``audit_events`` without adding a
+write to the request's transaction: :meth:`AuditLog.add` appends them to a
+local log file and an in-memory buffer, and a background thread inserts the
+buffer with multi-row inserts every ``AUDIT_FLUSH_INTERVAL`` seconds, or as
+soon as ``AUDIT_BATCH_SIZE`` changes are waiting.
+
+Appending runs in a worker thread, so disk writes (and ``AUDIT_FSYNC``)
+don't block the event loop.
+
+The log file makes the buffer crash-safe. Every worker process appends to
+its own segment in ``AUDIT_DIR`` and holds a lock on it; a flush starts a new
+segment and deletes the old ones once their changes are stored. When the
+flusher starts, segments no process holds a lock on, left behind by a
+crashed worker, are replayed. Every change has a unique ``event_id``, so
+changes stored right before a crash aren't inserted twice.
+
+Changes reach the file before the response is sent (``AUDIT_FSYNC`` also
+syncs it to disk); the stored history lags behind by up to a flush interval.
+
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: segments of other processes can't be told apart from orphaned ones.
+    fcntl = None
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import AuditEvent
+from database.connection import SessionLocal, init_engine
+from env import AUDIT_DIR, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_FSYNC
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT statement, well below SQLite's bound parameter limit.
+INSERT_ROWS = 500
+
+
+def _lock(file) -> bool:
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class AuditLog:
+    """
+    Buffers audit events and writes them to the database in batches.
+
+    Args:
+        directory (str | Path): Directory of the log segments.
+        batch_size (int): Buffered events that trigger a flush.
+        flush_interval (float): Seconds between flushes.
+        fsync (bool, optional): Sync every append to disk. Defaults to False.
+        session_factory (optional): Session factory of the database. Defaults to ``SessionLocal``.
+
+    """
+
+    def __init__(self, directory, batch_size: int, flush_interval: float, fsync: bool = False, session_factory=None):
+        self.directory = Path(directory)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.session_factory = session_factory
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.buffer = []
+        self.segment = None
+        self.flushed_segments = []
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopping = False
+
+    async def add(self, events: list[dict]) -> None:
+        """
+        Record committed contact changes, once they are appended to the log file.
+
+        Args:
+            events (list[dict]): ``user_id``, ``contact_id``, ``action`` and ``changes`` of every change.
+
+        """
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = [{"event_id": uuid.uuid4().hex, "created_at": now, **event} for event in events]
+        lines = "".join(json.dumps({**row, "created_at": now.isoformat()}) + "\n" for row in rows)
+        await asyncio.to_thread(self._append, rows, lines)
+
+    def _append(self, rows: list[dict], lines: str) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.start()
+            file = self._segment()[1]
+            file.write(lines)
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+            self.buffer.extend(rows)
+            if len(self.buffer) >= self.batch_size:
+                self.wakeup.set()
+
+    def _segment(self):
+        if self.segment is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"audit-{os.getpid()}-{uuid.uuid4().hex[:8]}.log"
+            file = open(path, "a", encoding="utf-8")
+            _lock(file)
+            self.segment = (path, file)
+        return self.segment
+
+    def start(self) -> None:
+        """Start the flusher thread, which first replays segments of crashed processes."""
+        if self.thread is None:
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+            self.thread.start()
+
+    def _run(self) -> None:
+        try:
+            replayed = self.replay()
+            if replayed:
+                logger.info("Replayed %d audit event(s) of crashed processes", replayed)
+        except Exception:
+            logger.exception("Failed to replay the audit log")
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Insert the buffered events and delete the log segments holding them.
+
+        If the insert fails, the events stay buffered for the next flush.
+
+        Returns:
+            int: Number of inserted events.
+
+        """
+        with self.flush_lock:
+            with self.lock:
+                rows, self.buffer = self.buffer, []
+                if self.segment is not None:
+                    self.flushed_segments.append(self.segment)
+                    self.segment = None
+                segments, self.flushed_segments = self.flushed_segments, []
+            try:
+                self._insert(rows)
+            except Exception:
+                logger.exception("Failed to write %d audit event(s), retrying later", len(rows))
+                with self.lock:
+                    self.buffer[:0] = rows
+                    self.flushed_segments[:0] = segments
+                return 0
+            for path, file in segments:
+                # Delete before closing, which releases the lock.
+                path.unlink(missing_ok=True)
+                file.close()
+            return len(rows)
+
+    def replay(self) -> int:
+        """
+        Insert the events of segments left behind by crashed processes, and delete those segments.
+
+        Returns:
+            int: Number of replayed events.
+
+        """
+        replayed = 0
+        with self.lock:
+            own = {segment[0] for segment in [self.segment, *self.flushed_segments] if segment is not None}
+        for path in sorted(self.directory.glob("audit-*.log")):
+            if path in own:
+                continue
+            with open(path, "a+", encoding="utf-8") as file:
+                if not _lock(file):
+                    continue
+                file.seek(0)
+                rows = []
+                for line in file:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        # The last line of a process killed while appending.
+                        continue
+                    # Segments written before shard generations were audited belong to the first one.
+                    rows.append({"generation": 0, **row, "created_at": datetime.fromisoformat(row["created_at"])})
+                self._insert(rows)
+                path.unlink()
+            replayed += len(rows)
+        return replayed
+
+    def _insert(self, rows: list[dict]) -> None:
+        if not rows:
+            return
+        if self.session_factory is None:
+            init_engine()
+            session_factory = SessionLocal
+        else:
+            session_factory = self.session_factory
+        with session_factory() as db:
+            dialect = db.get_bind().dialect.name
+            for start in range(0, len(rows), INSERT_ROWS):
+                chunk = rows[start:start + INSERT_ROWS]
+                if dialect in ("sqlite", "postgresql"):
+                    statement = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(AuditEvent)
+                    db.execute(statement.values(chunk).on_conflict_do_nothing(index_elements=["event_id"]))
+                    continue
+                stored = set(db.scalars(select(AuditEvent.event_id)
+                                        .where(AuditEvent.event_id.in_([row["event_id"] for row in chunk]))))
+                chunk = [row for row in chunk if row["event_id"] not in stored]
+                if chunk:
+                    db.execute(insert(AuditEvent).values(chunk))
+            db.commit()
+
+    def close(self) -> None:
+        """Stop the flusher thread and write the remaining events."""
+        if self.thread is not None:
+            self.stopping = True
+            self.wakeup.set()
+            self.thread.join(timeout=self.flush_interval + 5)
+            self.thread = None
+        self.flush()
+
+
+audit_log = AuditLog(AUDIT_DIR, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_FSYNC)
@@ -1,7 +1,9 @@
+import logging
 from datetime import datetime, timedelta
 from typing import Optional
+from uuid import uuid4
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
@@ -10,6 +12,11 @@ from starlette import status
 
 from models import User
 from database.connection import get_db
+from repository import users as repository_users
+from services.metrics import password_hash_duration_seconds
+from services.revocation import revocation_filter
+
+logger = logging.getLogger(__name__)
 
 
 class Auth:
@@ -18,6 +25,7 @@ class Auth:
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     SECRET_KEY = "secret_key"
     ALGORITHM = "HS256"
+    REFRESH_TOKEN_EXPIRE_SECONDS = 7 * 24 * 3600
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
     def verify_password(self, plain_password, hashed_password):
@@ -31,7 +39,8 @@ class Auth:
         Returns:
             bool: True if the password matches, False otherwise.
         """
-        return self.pwd_context.verify(plain_password, hashed_password)
+        with password_hash_duration_seconds.time(operation="verify"):
+            return self.pwd_context.verify(plain_password, hashed_password)
 
     def get_password_hash(self, password: str):
         """
@@ -43,13 +52,16 @@ class Auth:
         Returns:
             str: The hashed password.
         """
-        return self.pwd_context.hash(password)
+        with password_hash_duration_seconds.time(operation="hash"):
+            return self.pwd_context.hash(password)
 
 
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
         """
         Create an access token.
 
+        Every access token gets a unique ``jti`` so it can be revoked.
+
         Args:
             data (dict): Data to encode into the token.
             expires_delta (Optional[float], optional): Time in seconds for token expiration. Defaults to None.
@@ -62,6 +74,7 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
+        to_encode.setdefault("jti", uuid4().hex)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
         encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_access_token
@@ -82,7 +95,7 @@ class Auth:
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
-            expire = datetime.utcnow() + timedelta(days=7)
+            expire = datetime.utcnow() + timedelta(seconds=self.REFRESH_TOKEN_EXPIRE_SECONDS)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
         encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
@@ -105,6 +118,25 @@ class Auth:
         return token
 
 
+    def decode_token(self, token: str):
+        """
+        Decode and verify a token of any scope.
+
+        Args:
+            token (str): The token.
+
+        Returns:
+            dict: The token claims.
+
+        Raises:
+            HTTPException: If the token is invalid.
+        """
+        try:
+            return jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+        except JWTError:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
+
+
     async def decode_refresh_token(self, refresh_token: str):
         """
         Decode and verify a refresh token.
@@ -115,24 +147,46 @@ class Auth:
         Returns:
             str: The email associated with the token.
 
+        Raises:
+            HTTPException: If the token is invalid.
+        """
+        payload = await self.decode_refresh_token_payload(refresh_token)
+        return payload['sub']
+
+
+    async def decode_refresh_token_payload(self, refresh_token: str):
+        """
+        Decode and verify a refresh token, returning all of its claims.
+
+        Args:
+            refresh_token (str): The refresh token.
+
+        Returns:
+            dict: The token claims, including the session id (``sid``) and token id (``jti``).
+
         Raises:
             HTTPException: If the token is invalid.
         """
         try:
             payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
             if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
+                return payload
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
 
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, request: Request, token: str = Depends(oauth2_scheme),
+                               db: Session = Depends(get_db)):
         """
         Get the current authenticated user.
 
+        Revoked tokens are rejected using the worker's in-memory revocation
+        filter, so the check doesn't query the database. The user id is
+        stored in ``request.state`` for the access log.
+
         Args:
+            request (Request): The incoming request object.
             token (str): The access token.
             db (Session): Database session.
 
@@ -158,10 +212,13 @@ class Auth:
                 raise credentials_exception
         except JWTError as e:
             raise credentials_exception
+        if await revocation_filter.is_revoked(payload.get("jti")):
+            raise credentials_exception
 
-        user = await User.get_user_by_email(email, db)
+        user = await repository_users.get_user_by_email(email, db)
         if user is None:
             raise credentials_exception
+        request.state.user_id = user.id
         return user
     
 
@@ -185,7 +242,7 @@ class Auth:
                 return email
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError as e:
-            print(e)
+            logger.info("Invalid email verification token: %s", e)
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
                                 detail="Invalid token for email verification")
 
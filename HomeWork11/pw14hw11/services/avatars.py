@@ -0,0 +1,230 @@
+"""
+Avatar pipeline
+===============
+
+Uploaded avatars are decoded, square-cropped and resized into the fixed
+``VARIANTS`` in a pool of ``AVATAR_WORKERS`` processes (0 resizes in a
+thread instead), so large images don't block the event loop.
+
+Variants are stored content-addressed under ``AVATAR_DIR``: the key is a hash
+of the uploaded bytes and the pipeline settings, and
+``<key[:2]>/<key>/<variant>.jpg`` never changes once written. Identical
+uploads share their files, and the files can be served with
+``Cache-Control: immutable`` and the key as ETag.
+
+Small variants, the ones rendered in lists, are kept in an in-memory LRU of
+``AVATAR_CACHE_BYTES``; larger ones are sent from disk with ``FileResponse``,
+which uses the server's zero-copy file sending where available.
+
+Decoding needs Pillow, which is optional and installed from
+``requirements-avatars.txt``; without it uploads are refused and stored
+avatars are still served.
+
+"""
+
+import asyncio
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from env import AVATAR_DIR, AVATAR_WORKERS, AVATAR_CACHE_BYTES, AVATAR_MAX_PIXELS
+
+# Square sizes in pixels.
+VARIANTS = {"small": 64, "medium": 256, "large": 512}
+CACHED_VARIANTS = {"small"}
+ACCEPTED_FORMATS = {"JPEG", "PNG", "GIF", "WEBP"}
+JPEG_QUALITY = 85
+# Part of every key, so changing the variants stores new files instead of reusing old ones.
+PIPELINE_VERSION = f"1:{sorted(VARIANTS.items())}:{JPEG_QUALITY}"
+MEDIA_TYPE = "image/jpeg"
+
+AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+
+class InvalidImage(ValueError):
+    """The upload isn't an image in an accepted format, or is too large to decode."""
+
+
+def render_variants(data: bytes, max_pixels: int = AVATAR_MAX_PIXELS) -> dict[str, bytes]:
+    """
+    Decode an image and render every variant as JPEG. Runs in the worker pool.
+
+    Args:
+        data (bytes): The uploaded file.
+        max_pixels (int, optional): Largest accepted image. Defaults to ``AVATAR_MAX_PIXELS``.
+
+    Returns:
+        dict[str, bytes]: JPEG bytes per variant name.
+
+    Raises:
+        InvalidImage: If the data isn't an accepted image.
+
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in ACCEPTED_FORMATS:
+                raise InvalidImage(f"unsupported image format {image.format}")
+            largest = max(VARIANTS.values())
+            # Let the JPEG decoder downscale while decoding, at no quality cost at these sizes.
+            image.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            variants = {}
+            for name, size in VARIANTS.items():
+                output = io.BytesIO()
+                ImageOps.fit(image, (size, size), Image.LANCZOS).save(output, "JPEG", quality=JPEG_QUALITY,
+                                                                      optimize=True)
+                variants[name] = output.getvalue()
+            return variants
+    except (OSError, Image.DecompressionBombError, SyntaxError) as e:
+        raise InvalidImage(str(e)) from None
+
+
+def avatar_key(data: bytes) -> str:
+    """
+    Content address of an upload.
+
+    Args:
+        data (bytes): The uploaded file.
+
+    Returns:
+        str: 32 hex digits.
+
+    """
+    return hashlib.sha256(PIPELINE_VERSION.encode() + b"\0" + data).hexdigest()[:32]
+
+
+class ByteLRU:
+    """
+    Least recently used cache of byte strings, bounded by their total size.
+
+    Args:
+        max_bytes (int): Largest total size of the cached values.
+
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+
+    def get(self, key) -> bytes | None:
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.items[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class AvatarStore:
+    """
+    Renders, stores and reads avatar variants.
+
+    Args:
+        root (str | Path): Directory holding the variants.
+        workers (int): Processes resizing images; 0 resizes in a thread.
+        cache_bytes (int): Size of the in-memory cache of small variants.
+
+    """
+
+    def __init__(self, root, workers: int, cache_bytes: int):
+        self.root = Path(root)
+        self.workers = workers
+        self.cache = ByteLRU(cache_bytes)
+        self.executor = None
+
+    def path(self, key: str, variant: str) -> Path:
+        return self.root / key[:2] / key / f"{variant}.jpg"
+
+    async def save(self, data: bytes) -> str:
+        """
+        Render and store the variants of an upload, unless an identical upload was stored before.
+
+        Args:
+            data (bytes): The uploaded file.
+
+        Returns:
+            str: The avatar key.
+
+        Raises:
+            InvalidImage: If the data isn't an accepted image.
+            RuntimeError: If Pillow isn't installed.
+
+        """
+        if not AVAILABLE:
+            raise RuntimeError("avatar uploads need Pillow")
+        key = avatar_key(data)
+        if all(self.path(key, variant).exists() for variant in VARIANTS):
+            return key
+        if self.workers > 0:
+            if self.executor is None:
+                # Spawned, not forked: the server process runs threads (logging, metrics) forks don't survive.
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            variants = await asyncio.get_running_loop().run_in_executor(self.executor, render_variants, data)
+        else:
+            variants = await asyncio.to_thread(render_variants, data)
+        await asyncio.to_thread(self._write, key, variants)
+        for variant in CACHED_VARIANTS:
+            self.cache.put((key, variant), variants[variant])
+        return key
+
+    def _write(self, key: str, variants: dict[str, bytes]) -> None:
+        directory = self.path(key, "").parent
+        directory.mkdir(parents=True, exist_ok=True)
+        for variant, content in variants.items():
+            # Write to a temporary file first, so a file under its final name is always complete.
+            fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(content)
+            os.replace(temporary, self.path(key, variant))
+
+    async def cached(self, key: str, variant: str) -> bytes | None:
+        """
+        Get a small variant from memory, loading it from disk in a thread on a miss.
+
+        Args:
+            key (str): The avatar key.
+            variant (str): The variant name.
+
+        Returns:
+            bytes | None: The JPEG, or None for variants that aren't cached or don't exist.
+
+        """
+        if variant not in CACHED_VARIANTS:
+            return None
+        content = self.cache.get((key, variant))
+        if content is None:
+            try:
+                content = await asyncio.to_thread(self.path(key, variant).read_bytes)
+            except FileNotFoundError:
+                return None
+            self.cache.put((key, variant), content)
+        return content
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+avatar_store = AvatarStore(AVATAR_DIR, AVATAR_WORKERS, AVATAR_CACHE_BYTES)
@@ -0,0 +1,96 @@
+"""
+Duplicate contact detection
+===========================
+
+Contacts are only compared with contacts sharing a blocking key, instead of
+with every other contact of the user:
+
+- ``email``: the email address, trimmed and lower-cased.
+- ``phone``: the last nine digits of the phone number, so national and
+  international formats of the same number match.
+- ``name``: Soundex codes of the first and last name.
+
+The keys are stored in ``contact_dedup_keys`` when a contact is written. A
+pair sharing keys is scored by the signals it has in common (the keys plus an
+equal birthdate); pairs scoring at least ``DEDUP_MIN_SCORE`` are likely
+duplicates. Blocks with more than ``DEDUP_MAX_BLOCK`` contacts (a very common
+name) are skipped when scanning all of a user's contacts.
+
+"""
+
+import unicodedata
+
+from services.email_address import normalize_email
+
+SIGNAL_WEIGHTS = {"email": 0.5, "phone": 0.4, "name": 0.3, "birthdate": 0.2}
+PHONE_DIGITS = 9
+
+_SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ["aeiouyhw", "bfpv", "cgjkqsxz", "dt", "l", "mn", "r"]) for letter in letters}
+
+
+def soundex(name: str) -> str:
+    """
+    American Soundex code of a name, e.g. ``R163`` for "Robert" and "Rupert".
+
+    Accents are removed first; other non-Latin letters are ignored.
+
+    Args:
+        name (str): The name.
+
+    Returns:
+        str: Letter and three digits, or an empty string if the name has no Latin letters.
+
+    """
+    letters = [ch for ch in unicodedata.normalize("NFKD", name.lower()) if ch in _SOUNDEX_CODES]
+    if not letters:
+        return ""
+    code = letters[0].upper()
+    previous = _SOUNDEX_CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = _SOUNDEX_CODES[letter]
+        if digit != "0" and digit != previous:
+            code += digit
+        # h and w don't separate letters with the same code, vowels do.
+        if letter not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+
+def normalize_phone(phone: str | None) -> str:
+    digits = "".join(ch for ch in phone or "" if ch.isdigit())
+    return digits[-PHONE_DIGITS:] if len(digits) >= PHONE_DIGITS else ""
+
+
+def dedup_keys(contact) -> dict[str, str]:
+    """
+    Blocking keys of a contact.
+
+    Args:
+        contact: Object with ``first_name``, ``last_name``, ``phone_number`` and ``email``.
+
+    Returns:
+        dict[str, str]: Key per kind; kinds without a usable value are left out.
+
+    """
+    first, last = soundex(contact.first_name or ""), soundex(contact.last_name or "")
+    keys = {
+        "email": normalize_email(contact.email),
+        "phone": normalize_phone(contact.phone_number),
+        "name": f"{first}{last}" if first and last else "",
+    }
+    return {kind: value for kind, value in keys.items() if value}
+
+
+def score(signals) -> float:
+    """
+    Likelihood score of a pair of contacts.
+
+    Args:
+        signals: Matching signals, names from ``SIGNAL_WEIGHTS``.
+
+    Returns:
+        float: Sum of the signal weights, at most 1.
+
+    """
+    return min(1.0, round(sum(SIGNAL_WEIGHTS[signal] for signal in signals), 6))
@@ -1,26 +1,49 @@
+import asyncio
+import logging
+from functools import lru_cache
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
 from pydantic import EmailStr
 
 from services.auth import auth_service
+from services.metrics import email_queue_depth
 
 from env import EMAIL_USERNAME, EMAIL_PASSWORD, EMAIL_FROM
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=EMAIL_USERNAME,
-    MAIL_PASSWORD=EMAIL_PASSWORD,
-    MAIL_FROM=EMAIL_FROM,
-    MAIL_PORT=465,
-    MAIL_SERVER="smtp.meta.ua",
-    MAIL_FROM_NAME="Resr API App",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+logger = logging.getLogger(__name__)
+
+# Tasks currently sending an email, awaited by drain_email_queue() on shutdown.
+pending_sends: set[asyncio.Task] = set()
+
+
+@lru_cache
+def get_mail_config():
+    """
+    Build the mail connection settings on first use.
+
+    fastapi_mail is imported here rather than at module level because it is
+    one of the slowest imports of the app and only needed when an email is sent.
+
+    Returns:
+        ConnectionConfig: The mail connection settings.
+
+    """
+    from fastapi_mail import ConnectionConfig
+
+    return ConnectionConfig(
+        MAIL_USERNAME=EMAIL_USERNAME,
+        MAIL_PASSWORD=EMAIL_PASSWORD,
+        MAIL_FROM=EMAIL_FROM,
+        MAIL_PORT=465,
+        MAIL_SERVER="smtp.meta.ua",
+        MAIL_FROM_NAME="Resr API App",
+        MAIL_STARTTLS=False,
+        MAIL_SSL_TLS=True,
+        USE_CREDENTIALS=True,
+        VALIDATE_CERTS=True,
+        TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
+    )
+
 
 async def send_email(email: EmailStr, username: str, host: str):
     """
@@ -34,6 +57,11 @@ async def send_email(email: EmailStr, username: str, host: str):
     Raises:
         ConnectionErrors: If there is an error in establishing a connection to the email server.
     """
+    from fastapi_mail import FastMail, MessageSchema, MessageType
+    from fastapi_mail.errors import ConnectionErrors
+
+    task = asyncio.current_task()
+    pending_sends.add(task)
     try:
         token_verification = auth_service.create_email_token({"sub": email})
         message = MessageSchema(
@@ -43,7 +71,32 @@ async def send_email(email: EmailStr, username: str, host: str):
             subtype=MessageType.html
         )
 
-        fm = FastMail(conf)
+        fm = FastMail(get_mail_config())
         await fm.send_message(message, template_name="email_template.html")
     except ConnectionErrors as err:
-        print(err)
\ No newline at end of file
+        logger.error("Failed to send verification email to %s: %s", email, err)
+    finally:
+        pending_sends.discard(task)
+        email_queue_depth.dec()
+
+
+async def drain_email_queue(timeout: float) -> int:
+    """
+    Wait for emails that are being sent to finish.
+
+    Args:
+        timeout (float): Maximum number of seconds to wait.
+
+    Returns:
+        int: Number of sends still unfinished when the timeout expired.
+
+    """
+    current = asyncio.current_task()
+    tasks = [task for task in pending_sends if task is not current and not task.done()]
+    if not tasks:
+        return 0
+    logger.info("Waiting for %d email(s) to be sent", len(tasks))
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    if pending:
+        logger.warning("Shutting down with %d unsent email(s)", len(pending))
+    return len(pending)
\ No newline at end of file
@@ -0,0 +1,17 @@
+def normalize_email(email: str | None) -> str:
+    return (email or "").strip().lower()
+
+
+def email_domain(email: str | None) -> str | None:
+    """
+    Get the domain of an email address, e.g. ``example.com`` for ``Anna@Example.com``.
+
+    Args:
+        email (str | None): The email address.
+
+    Returns:
+        str | None: The lower-cased domain, or None without an ``@``.
+
+    """
+    local, at, domain = normalize_email(email).rpartition("@")
+    return domain if local and at and domain else None
@@ -0,0 +1,386 @@
+"""
+Contact change events
+=====================
+
+Repository writes record ``created``, ``updated`` and ``deleted`` events in
+the session with :func:`record_event`. :func:`publish_events` publishes them
+once the transaction is committed; events of a rolled back transaction or
+savepoint are dropped with it. ``GET /api/contacts/events`` streams a user's
+events as server-sent events, and ``services.audit`` keeps their history.
+
+The broker fans events out to the streams open on this worker. With
+``EVENTS_BACKEND=redis`` events are appended to a Redis stream per user and
+announced over pub/sub, so every worker sees the writes of all workers;
+otherwise a stream only sees writes handled by its own worker.
+
+- Every event has an id. A client reconnecting with ``Last-Event-ID`` first
+  gets the events it missed, out of the last ``EVENTS_HISTORY`` of the user.
+  Their data only holds the contact ``id``; the client fetches the contacts
+  still there. If some of the events are no longer kept, it gets a ``reset``
+  event instead and should reload its contacts. The memory backend keeps the
+  events of the ``EVENTS_MAX_USERS`` users who changed contacts last.
+- A comment line is sent every ``EVENTS_HEARTBEAT`` seconds, so proxies keep
+  idle streams open and closed connections are noticed.
+- A stream buffers at most ``EVENTS_QUEUE_SIZE`` events. A client too slow to
+  keep up is disconnected instead of buffering without bound, and resumes
+  from its last event when it reconnects.
+- Streams end after ``EVENTS_MAX_STREAM`` seconds, so clients reconnect and
+  spread over the workers.
+
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import OrderedDict, defaultdict, deque
+from typing import AsyncIterator
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from services.audit import audit_log
+from env import (EVENTS_BACKEND, REDIS_URL, EVENTS_HISTORY, EVENTS_MAX_USERS, EVENTS_QUEUE_SIZE, EVENTS_HEARTBEAT,
+                 EVENTS_MAX_STREAM)
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "contact_events"
+# Session info holding the user's shard generation, set by ``database.sharding.get_shard_db``.
+GENERATION_KEY = "shard_generation"
+# Reconnection delay suggested to clients, in milliseconds.
+RETRY_MS = 1000
+
+
+def record_event(db: Session, user_id: int, event_type: str, data: dict, changes: dict) -> None:
+    """
+    Record an event of the current transaction, to be published and audited after it commits.
+
+    Args:
+        db (Session): The database session.
+        user_id (int): The user whose contacts changed.
+        event_type (str): ``"created"``, ``"updated"`` or ``"deleted"``.
+        data (dict): JSON-serializable event data, with the contact ``id``.
+        changes (dict): JSON-serializable changed fields, for the audit log.
+
+    """
+    transaction = db.get_nested_transaction() or db.get_transaction()
+    audit = {"user_id": user_id, "contact_id": data["id"], "generation": db.info.get(GENERATION_KEY, 0),
+             "action": event_type, "changes": changes}
+    db.info.setdefault(PENDING_KEY, []).append((transaction, user_id, {"event": event_type, "data": data}, audit))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_rolled_back_events(session, previous_transaction):
+    pending = session.info.get(PENDING_KEY)
+    if pending:
+        session.info[PENDING_KEY] = [entry for entry in pending if not _inside(entry[0], previous_transaction)]
+
+
+def _inside(transaction, ancestor) -> bool:
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+async def publish_events(db: Session) -> None:
+    """
+    Publish the events recorded in a session and add them to the audit log, after its transaction was committed.
+
+    Args:
+        db (Session): The database session.
+
+    """
+    pending = db.info.pop(PENDING_KEY, None)
+    if not pending:
+        return
+    try:
+        await audit_log.add([entry[3] for entry in pending])
+    except OSError:
+        logger.exception("Failed to add %d contact change(s) to the audit log", len(pending))
+    events = defaultdict(list)
+    for _, user_id, user_event, _ in pending:
+        events[user_id].append(user_event)
+    for user_id, user_events in events.items():
+        try:
+            await contact_broker.publish(user_id, user_events)
+        except Exception:
+            # The writes are committed already; clients catch up with a reset.
+            logger.exception("Failed to publish %d contact event(s) of user %s", len(user_events), user_id)
+
+
+class MemoryEventLog:
+    """
+    Recent events kept in process memory, for tests and single-process runs.
+
+    Ids are ``<process start>-<counter>``, so ids of an earlier process are
+    recognized and answered with a reset. Only the event type and contact id
+    are kept, for at most ``max_users`` users; the user who changed contacts
+    least recently is forgotten first.
+    """
+
+    shared = False
+
+    def __init__(self, history: int, max_users: int = EVENTS_MAX_USERS):
+        self.history = history
+        self.max_users = max_users
+        self.epoch = str(time.time_ns() // 1_000_000)
+        self.counter = itertools.count(1)
+        # user id -> [order of the newest event dropped, deque of (order, event type, contact id)]
+        self.events = OrderedDict()
+        # Order of the newest event of the forgotten users.
+        self.forgotten = 0
+
+    def order(self, event_id: str):
+        epoch, _, n = event_id.partition("-")
+        if epoch != self.epoch or not n.isdigit():
+            return None
+        return int(n)
+
+    async def append(self, user_id: int, events: list[dict]) -> list[dict]:
+        entry = self.events.get(user_id)
+        if entry is None:
+            entry = self.events[user_id] = [self.forgotten, deque()]
+        self.events.move_to_end(user_id)
+        kept = entry[1]
+        stored = []
+        for user_event in events:
+            n = next(self.counter)
+            kept.append((n, user_event["event"], user_event["data"]["id"]))
+            stored.append({"id": f"{self.epoch}-{n}", **user_event})
+        while len(kept) > self.history:
+            entry[0] = kept.popleft()[0]
+        while len(self.events) > self.max_users:
+            _, (dropped, forgotten) = self.events.popitem(last=False)
+            self.forgotten = max(self.forgotten, forgotten[-1][0] if forgotten else dropped)
+        return stored
+
+    async def since(self, user_id: int, event_id: str) -> list[dict] | None:
+        last = self.order(event_id)
+        dropped, kept = self.events.get(user_id, (self.forgotten, ()))
+        if last is None or last < dropped:
+            return None
+        return [{"id": f"{self.epoch}-{n}", "event": event_type, "data": {"id": contact_id}}
+                for n, event_type, contact_id in kept if n > last]
+
+
+class RedisEventLog:
+    """
+    Recent events in a Redis stream per user, announced to all workers over pub/sub.
+
+    ``contact_events:<user id>`` streams are capped at about ``history``
+    entries of event type and contact id; their entry ids are the event ids.
+    """
+
+    shared = True
+    CHANNEL = "contact_events"
+
+    def __init__(self, url: str, history: int):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.history = history
+
+    def order(self, event_id: str):
+        ms, _, seq = event_id.partition("-")
+        if not ms.isdigit() or not seq.isdigit():
+            return None
+        return int(ms), int(seq)
+
+    async def append(self, user_id: int, events: list[dict]) -> list[dict]:
+        key = f"{self.CHANNEL}:{user_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for user_event in events:
+                pipe.xadd(key, {"event": user_event["event"], "contact_id": user_event["data"]["id"]},
+                          maxlen=self.history, approximate=True)
+            ids = await pipe.execute()
+        stored = [{"id": event_id, **user_event} for event_id, user_event in zip(ids, events)]
+        await self.redis.publish(self.CHANNEL, json.dumps({"user_id": user_id, "events": stored}))
+        return stored
+
+    async def since(self, user_id: int, event_id: str) -> list[dict] | None:
+        last = self.order(event_id)
+        if last is None:
+            return None
+        key = f"{self.CHANNEL}:{user_id}"
+        if not await self.redis.exists(key):
+            return []
+        # Redis 7 reports the newest entry removed by trimming.
+        info = await self.redis.xinfo_stream(key)
+        if self.order(info.get("max-deleted-entry-id", "0-0")) > last:
+            return None
+        entries = await self.redis.xrange(key, min=f"({event_id}")
+        return [{"id": entry_id, "event": fields["event"], "data": {"id": int(fields["contact_id"])}}
+                for entry_id, fields in entries]
+
+    async def listen(self, subscribed: asyncio.Event) -> AsyncIterator[tuple[int, list[dict]]]:
+        async with self.redis.pubsub() as pubsub:
+            await pubsub.subscribe(self.CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "subscribe":
+                    subscribed.set()
+                elif message["type"] == "message":
+                    payload = json.loads(message["data"])
+                    yield payload["user_id"], payload["events"]
+
+
+class ContactEventBroker:
+    """
+    Fans contact events out to the event streams open on this worker.
+
+    Args:
+        log (MemoryEventLog | RedisEventLog): Where events are kept for resuming, and shared between workers.
+        queue_size (int): Events buffered per stream before a slow client is disconnected.
+        heartbeat (float): Seconds between heartbeat comments.
+        max_stream (float): Seconds after which a stream ends.
+
+    """
+
+    def __init__(self, log, queue_size: int, heartbeat: float, max_stream: float):
+        self.log = log
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.max_stream = max_stream
+        self.subscribers = defaultdict(set)
+        self.listener = None
+        self.subscribed = asyncio.Event()
+
+    async def publish(self, user_id: int, events: list[dict]) -> None:
+        """
+        Store a user's events and deliver them to the user's streams.
+
+        Args:
+            user_id (int): The user id.
+            events (list[dict]): Events with ``event`` type and ``data``.
+
+        """
+        stored = await self.log.append(user_id, events)
+        if not self.log.shared:
+            self._deliver(user_id, stored)
+
+    def _deliver(self, user_id: int, events: list[dict]) -> None:
+        for queue in list(self.subscribers.get(user_id, ())):
+            for user_event in events:
+                try:
+                    queue.put_nowait(user_event)
+                except asyncio.QueueFull:
+                    # The client is too slow: end its stream, it resumes from its last event.
+                    self._end(user_id, queue)
+                    break
+
+    def _end(self, user_id: int, queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+        self.subscribers[user_id].discard(queue)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for user_id, events in self.log.listen(self.subscribed):
+                    self._deliver(user_id, events)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Contact event subscription failed, reconnecting")
+                self.subscribed.clear()
+                # Events published meanwhile are missed: streams end, and clients resume from their last event.
+                for user_id, queues in list(self.subscribers.items()):
+                    for queue in list(queues):
+                        self._end(user_id, queue)
+                await asyncio.sleep(RETRY_MS / 1000)
+
+    async def stream(self, user_id: int, last_event_id: str | None = None) -> AsyncIterator[str]:
+        """
+        Stream a user's events in the ``text/event-stream`` format.
+
+        Args:
+            user_id (int): The user id.
+            last_event_id (str | None, optional): Id of the last event the client got, to resume after it.
+
+        Yields:
+            str: Events and heartbeat comments.
+
+        """
+        if self.log.shared and (self.listener is None or self.listener.done()):
+            self.listener = asyncio.create_task(self._listen())
+        # Subscribe before reading the history, so no event falls in between.
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers[user_id].add(queue)
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            if self.log.shared:
+                # Until Redis confirms the subscription, events published to other workers aren't received.
+                try:
+                    await asyncio.wait_for(self.subscribed.wait(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    return
+            last = None
+            if last_event_id is not None:
+                missed = await self.log.since(user_id, last_event_id)
+                if missed is None:
+                    yield "event: reset\ndata: {}\n\n"
+                else:
+                    last = self.log.order(missed[-1]["id"]) if missed else self.log.order(last_event_id)
+                    for user_event in missed:
+                        yield format_event(user_event)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.max_stream
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    user_event = await asyncio.wait_for(queue.get(), min(self.heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if user_event is None:
+                    return
+                if last is not None and self.log.order(user_event["id"]) <= last:
+                    continue
+                yield format_event(user_event)
+        finally:
+            self.subscribers[user_id].discard(queue)
+            if not self.subscribers[user_id]:
+                del self.subscribers[user_id]
+
+    async def close(self) -> None:
+        """Stop listening for events of other workers."""
+        if self.listener is not None:
+            self.listener.cancel()
+            self.listener = None
+            self.subscribed.clear()
+
+
+def format_event(user_event: dict) -> str:
+    """
+    Format an event for a ``text/event-stream`` response.
+
+    Args:
+        user_event (dict): Event with ``id``, ``event`` type and ``data``.
+
+    Returns:
+        str: The event, ending with a blank line.
+
+    """
+    return f"id: {user_event['id']}\nevent: {user_event['event']}\ndata: {json.dumps(user_event['data'])}\n\n"
+
+
+def create_event_log(name: str = EVENTS_BACKEND):
+    """
+    Create the configured event log.
+
+    Args:
+        name (str): ``"memory"`` or ``"redis"``.
+
+    Returns:
+        MemoryEventLog | RedisEventLog: The event log.
+
+    """
+    if name == "redis":
+        return RedisEventLog(REDIS_URL, EVENTS_HISTORY)
+    return MemoryEventLog(EVENTS_HISTORY)
+
+
+contact_broker = ContactEventBroker(create_event_log(), EVENTS_QUEUE_SIZE, EVENTS_HEARTBEAT, EVENTS_MAX_STREAM)
@@ -0,0 +1,332 @@
+"""
+Idempotent requests
+===================
+
+Clients send an ``Idempotency-Key`` header to retry a write safely. The
+first request with a key runs and its response is stored for
+``IDEMPOTENCY_TTL`` seconds, together with a hash of the request; a retry
+with the same key gets the stored response (marked ``Idempotent-Replayed``)
+without running again.
+
+- A retry arriving while the first request still runs waits up to
+  ``IDEMPOTENCY_WAIT`` seconds for it, and gets ``409 Conflict`` if it is
+  still running then.
+- Reusing a key for a different request is answered with ``422``.
+- Requests failing with an exception (rate limits, database errors) store
+  nothing, so they can be retried with the same key.
+- A key is claimed for at most ``IDEMPOTENCY_LOCK_TTL`` seconds, so the key
+  of a worker that died mid-request becomes usable again.
+- If a request succeeded but its response can't be stored, its key is
+  marked as used anyway: retries get ``409`` instead of running it again.
+
+Keys are stored per user and route, in memory or, with
+``IDEMPOTENCY_BACKEND=redis``, in Redis shared by all workers.
+
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import secrets
+import time
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from services.metrics import cache_requests_total
+from env import IDEMPOTENCY_BACKEND, REDIS_URL, IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TTL, IDEMPOTENCY_WAIT
+
+logger = logging.getLogger(__name__)
+
+class MemoryIdempotencyStore:
+    """
+    Idempotency records kept in process memory, for tests and single-process runs.
+
+    Expired records are swept every ``PURGE_INTERVAL`` seconds by a task
+    started with the first claim.
+    """
+
+    PURGE_INTERVAL = 60
+
+    def __init__(self):
+        self.records = {}
+        self.finished = {}
+        self.sweeper = None
+
+    def _get(self, key: str) -> dict | None:
+        record = self.records.get(key)
+        if record is not None and record[0] <= time.monotonic():
+            del self.records[key]
+            return None
+        return record and record[1]
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self.records.items() if expires <= now]:
+            del self.records[key]
+        # Requests waiting for a claim that expired without a response.
+        for key in [key for key in self.finished if key not in self.records]:
+            self._wake(key)
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.PURGE_INTERVAL)
+            self._purge()
+
+    async def claim(self, key: str, fingerprint: str, owner: str, lock_ttl: float) -> dict | None:
+        """
+        Claim a key for a request unless it is taken.
+
+        Args:
+            key (str): The scoped idempotency key.
+            fingerprint (str): Hash of the request.
+            owner (str): Random id of the claiming request.
+            lock_ttl (float): Seconds after which an unfinished claim expires.
+
+        Returns:
+            dict | None: None if claimed, otherwise the existing record: ``fingerprint`` and, once the
+            request finished, its ``status`` and ``body``.
+
+        """
+        if self.sweeper is None or self.sweeper.done() or self.sweeper.get_loop() is not asyncio.get_running_loop():
+            self.sweeper = asyncio.create_task(self._sweep())
+        record = self._get(key)
+        if record is not None:
+            return record
+        self.records[key] = (time.monotonic() + lock_ttl, {"fingerprint": fingerprint, "owner": owner})
+        return None
+
+    async def save(self, key: str, owner: str, record: dict, ttl: float) -> None:
+        """
+        Store the response of a claimed key and wake up requests waiting for it.
+
+        Args:
+            key (str): The scoped idempotency key.
+            owner (str): Id of the claiming request; a claim that expired and was taken over isn't overwritten.
+            record (dict): ``fingerprint``, ``status`` and ``body``.
+            ttl (float): Seconds to keep the record.
+
+        """
+        current = self._get(key)
+        if current is not None and current.get("owner") == owner:
+            self.records[key] = (time.monotonic() + ttl, record)
+        self._wake(key)
+
+    async def release(self, key: str, owner: str) -> None:
+        """
+        Give up a claim without storing a response, so the request can be retried.
+
+        Args:
+            key (str): The scoped idempotency key.
+            owner (str): Id of the claiming request.
+
+        """
+        current = self._get(key)
+        if current is not None and current.get("owner") == owner:
+            del self.records[key]
+        self._wake(key)
+
+    async def wait(self, key: str, timeout: float) -> None:
+        """
+        Wait until the request holding a claim finishes, or ``timeout`` seconds.
+
+        Args:
+            key (str): The scoped idempotency key.
+            timeout (float): Maximum seconds to wait.
+
+        """
+        finished = self.finished.setdefault(key, asyncio.Event())
+        try:
+            await asyncio.wait_for(finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _wake(self, key: str) -> None:
+        finished = self.finished.pop(key, None)
+        if finished is not None:
+            finished.set()
+
+    async def close(self) -> None:
+        """Stop sweeping expired records."""
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            self.sweeper = None
+
+
+class RedisIdempotencyStore:
+    """
+    Idempotency records in Redis, shared by all workers.
+
+    ``idempotency:<key>`` holds the record as JSON and expires with it.
+    Claiming is ``SET NX``; saving and releasing check the owner atomically.
+    Waiting requests poll, since they may run on another worker.
+    """
+
+    OWNED_SCRIPT = """
+    local current = redis.call('GET', KEYS[1])
+    if not current or cjson.decode(current)['owner'] ~= ARGV[1] then
+        return 0
+    end
+    if ARGV[2] == '' then
+        redis.call('DEL', KEYS[1])
+    else
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    end
+    return 1
+    """
+    POLL_INTERVAL = 0.05
+    MAX_POLL_INTERVAL = 0.5
+
+    def __init__(self, url: str):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.owned_script = self.redis.register_script(self.OWNED_SCRIPT)
+
+    async def claim(self, key: str, fingerprint: str, owner: str, lock_ttl: float) -> dict | None:
+        claim = json.dumps({"fingerprint": fingerprint, "owner": owner})
+        while True:
+            if await self.redis.set(f"idempotency:{key}", claim, nx=True, px=math.ceil(lock_ttl * 1000)):
+                return None
+            record = await self.redis.get(f"idempotency:{key}")
+            if record is not None:
+                return json.loads(record)
+
+    async def save(self, key: str, owner: str, record: dict, ttl: float) -> None:
+        await self.owned_script(keys=[f"idempotency:{key}"], args=[owner, json.dumps(record), math.ceil(ttl)])
+
+    async def release(self, key: str, owner: str) -> None:
+        await self.owned_script(keys=[f"idempotency:{key}"], args=[owner, "", 0])
+
+    async def wait(self, key: str, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        interval = self.POLL_INTERVAL
+        while (remaining := deadline - time.monotonic()) > 0:
+            await asyncio.sleep(min(interval, remaining))
+            record = await self.redis.get(f"idempotency:{key}")
+            if record is None or "owner" not in json.loads(record):
+                return
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+    async def close(self) -> None:
+        """Nothing to stop: Redis expires the records."""
+
+
+def fingerprint(payload) -> str:
+    """
+    Hash a request payload, independent of key order.
+
+    Args:
+        payload: JSON-serializable request payload.
+
+    Returns:
+        str: Hex SHA-256 digest.
+
+    """
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class IdempotentRequests:
+    """
+    Runs a request handler at most once per idempotency key.
+
+    Args:
+        store (MemoryIdempotencyStore | RedisIdempotencyStore): Where claims and responses are kept.
+        ttl (float): Seconds to keep responses.
+        lock_ttl (float): Seconds after which an unfinished claim expires.
+        wait (float): Seconds a retry waits for a running request with its key.
+
+    """
+
+    def __init__(self, store, ttl: float, lock_ttl: float, wait: float):
+        self.store = store
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.wait = wait
+
+    async def run(self, scope: str, key: str, payload, fn: Callable[[], Awaitable]) -> JSONResponse:
+        """
+        Run ``fn`` for the first request with a key, and replay its response for the others.
+
+        Args:
+            scope (str): Namespace of the key, e.g. user id and route.
+            key (str): The ``Idempotency-Key`` header.
+            payload: JSON-serializable request payload, compared between requests with the same key.
+            fn (Callable[[], Awaitable]): Handles the request; its result becomes the JSON response.
+
+        Returns:
+            JSONResponse: The response of the first request.
+
+        Raises:
+            HTTPException: 422 if the key was used for a different request, 409 if the first request is
+                still running after waiting for it, or ran but its response wasn't stored.
+
+        """
+        request_hash = fingerprint(payload)
+        full_key = f"{scope}:{key}"
+        owner = secrets.token_hex(16)
+        deadline = time.monotonic() + self.wait
+        waited = False
+        while (record := await self.store.claim(full_key, request_hash, owner, self.lock_ttl)) is not None:
+            if record["fingerprint"] != request_hash:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                    detail="Idempotency-Key was already used for a different request")
+            if "body" in record:
+                cache_requests_total.inc(cache="idempotency", result="shared" if waited else "hit")
+                return JSONResponse(record["body"], status_code=record["status"],
+                                    headers={"Idempotent-Replayed": "true"})
+            if record.get("completed"):
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="A request with this Idempotency-Key was processed, "
+                                           "but its response is not available")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                    detail="A request with this Idempotency-Key is still in progress",
+                                    headers={"Retry-After": "1"})
+            await self.store.wait(full_key, remaining)
+            waited = True
+
+        cache_requests_total.inc(cache="idempotency", result="miss")
+        try:
+            result = await fn()
+        except BaseException:
+            await self.store.release(full_key, owner)
+            raise
+        try:
+            body = jsonable_encoder(result)
+            await self.store.save(full_key, owner, {"fingerprint": request_hash, "status": status.HTTP_200_OK,
+                                                    "body": body}, self.ttl)
+        except Exception:
+            logger.exception("Failed to store the response of idempotent request %s", full_key)
+            # fn() has run, so the key must not be released for a retry to run it again.
+            try:
+                await self.store.save(full_key, owner, {"fingerprint": request_hash, "completed": True}, self.ttl)
+            except Exception:
+                logger.exception("Failed to mark idempotent request %s as completed", full_key)
+            raise
+        return JSONResponse(body)
+
+
+def create_idempotency_store(name: str = IDEMPOTENCY_BACKEND):
+    """
+    Create the configured idempotency store.
+
+    Args:
+        name (str): ``"memory"`` or ``"redis"``.
+
+    Returns:
+        MemoryIdempotencyStore | RedisIdempotencyStore: The store.
+
+    """
+    if name == "redis":
+        return RedisIdempotencyStore(REDIS_URL)
+    return MemoryIdempotencyStore()
+
+
+idempotent_requests = IdempotentRequests(create_idempotency_store(), IDEMPOTENCY_TTL, IDEMPOTENCY_LOCK_TTL,
+                                         IDEMPOTENCY_WAIT)
@@ -0,0 +1,394 @@
+import glob
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter, sleep
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: snapshots of exited workers are kept instead of folded together.
+    fcntl = None
+
+from env import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RETIRED_FILE = "metrics-retired.json"
+
+
+class Metric:
+    """Base class for a metric family with a fixed set of label names."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        # Threadpool threads record too, and read-modify-write of a series isn't atomic.
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self) -> dict:
+        """
+        Serialize the metric family to a JSON-compatible dict.
+
+        Returns:
+            dict: Metric metadata and its series.
+
+        """
+        with self.lock:
+            series = [[list(key), list(value) if isinstance(value, list) else value]
+                      for key, value in self.series.items()]
+        return {"type": self.type, "help": self.documentation, "labelnames": list(self.labelnames),
+                "series": series}
+
+
+class Counter(Metric):
+    """A monotonically increasing value."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increment the counter.
+
+        Args:
+            amount (float, optional): Value to add. Defaults to 1.
+            **labels: Label values.
+
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """
+        Set the gauge to a value.
+
+        Args:
+            value (float): New value.
+            **labels: Label values.
+
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        Increment the gauge.
+
+        Args:
+            amount (float, optional): Value to add. Defaults to 1.
+            **labels: Label values.
+
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        """
+        Decrement the gauge.
+
+        Args:
+            amount (float, optional): Value to subtract. Defaults to 1.
+            **labels: Label values.
+
+        """
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record an observation.
+
+        Only the matching bucket is incremented; buckets are made cumulative at
+        render time, so an observation costs one bisect and two additions.
+
+        Args:
+            value (float): Observed value.
+            **labels: Label values.
+
+        """
+        key = self._key(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Bucket counts, then +Inf, then sum.
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            series[bucket] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a ``with`` block in seconds.
+
+        Args:
+            **labels: Label values.
+
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def dump(self) -> dict:
+        data = super().dump()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+class MetricsRegistry:
+    """
+    Registry of metric families.
+
+    Every metric family has an uncontended lock held for the couple of dict
+    and list operations of an update. When ``directory`` is set, every worker
+    periodically writes its snapshot to ``<directory>/metrics-<pid>.json`` and
+    :meth:`render` aggregates all of them, so any worker can answer a scrape
+    for the whole server. Counters and histograms of exited workers are folded
+    into ``metrics-retired.json`` and their files deleted.
+    """
+
+    def __init__(self, directory: str | None = None, flush_interval: float = 5.0):
+        self.metrics = {}
+        self.collectors = []
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._flusher = None
+
+    def _register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector) -> None:
+        """
+        Register a callable invoked right before each snapshot, e.g. to sample pool gauges.
+
+        Args:
+            collector (Callable[[], None]): The collector function.
+
+        """
+        self.collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        """
+        Take a snapshot of all metrics of this process.
+
+        Returns:
+            dict: Serialized metric families keyed by name.
+
+        """
+        for collector in self.collectors:
+            collector()
+        return {name: metric.dump() for name, metric in list(self.metrics.items())}
+
+    def flush(self) -> None:
+        """Write this worker's snapshot to the shared metrics directory."""
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"pid": os.getpid(), "metrics": self.snapshot()}, f)
+        os.replace(tmp_path, path)
+
+    def start_flusher(self) -> None:
+        """Start a daemon thread that flushes the snapshot every ``flush_interval`` seconds."""
+        if not self.directory or self._flusher is not None:
+            return
+
+        def run():
+            while True:
+                sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("Failed to write the metrics snapshot")
+
+        self._flusher = threading.Thread(target=run, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def _worker_snapshots(self) -> list[dict]:
+        if not self.directory:
+            return [{"pid": os.getpid(), "metrics": self.snapshot()}]
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot["pid"] is None:
+                continue
+            if fcntl is not None and not _pid_alive(snapshot["pid"]):
+                try:
+                    self._retire(path, snapshot)
+                    continue
+                except OSError:
+                    logger.exception("Failed to retire the metrics snapshot %s", path)
+            snapshots.append(snapshot)
+        try:
+            with open(os.path.join(self.directory, RETIRED_FILE)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+        return snapshots
+
+    def _retire(self, path: str, snapshot: dict) -> None:
+        """Fold the counters and histograms of an exited worker into the retired snapshot and delete its file."""
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        with open(os.path.join(self.directory, "metrics.lock"), "w") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            # Another worker retired it while this one waited for the lock.
+            if not os.path.exists(path):
+                return
+            try:
+                with open(retired_path) as f:
+                    metrics = json.load(f)["metrics"]
+            except FileNotFoundError:
+                metrics = {}
+            merged = {}
+            _merge(merged, metrics, gauges=False)
+            _merge(merged, snapshot["metrics"], gauges=False)
+            metrics = {name: {**data, "series": [[list(key), value] for key, value in data["series"].items()]}
+                       for name, data in merged.items()}
+            with open(f"{retired_path}.tmp", "w") as f:
+                json.dump({"pid": None, "metrics": metrics}, f)
+            os.replace(f"{retired_path}.tmp", retired_path)
+            os.remove(path)
+
+    def collect(self) -> dict:
+        """
+        Aggregate snapshots of all workers.
+
+        Counters and histograms are summed over every worker that ever wrote a
+        snapshot; gauges are summed over live workers only.
+
+        Returns:
+            dict: Aggregated metric families keyed by name.
+
+        """
+        merged = {}
+        for snapshot in self._worker_snapshots():
+            _merge(merged, snapshot["metrics"], gauges=snapshot["pid"] is not None and _pid_alive(snapshot["pid"]))
+        return merged
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text.
+
+        """
+        lines = []
+        for name, data in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['type']}")
+            labelnames = data["labelnames"]
+            for key, value in sorted(data["series"].items()):
+                labels = list(zip(labelnames, key))
+                if data["type"] == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(data["buckets"] + ["+Inf"], value[:-1]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(labels + [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {value[-1]}")
+                    lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(merged: dict, metrics: dict, gauges: bool) -> None:
+    for name, data in metrics.items():
+        if data["type"] == "gauge" and not gauges:
+            continue
+        target = merged.setdefault(name, {**data, "series": {}})
+        for key, value in data["series"]:
+            key = tuple(key)
+            if key not in target["series"]:
+                target["series"][key] = value
+            elif isinstance(value, list):
+                target["series"][key] = [a + b for a, b in zip(target["series"][key], value)]
+            else:
+                target["series"][key] += value
+
+
+def _labels(pairs: list) -> str:
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+registry = MetricsRegistry(METRICS_DIR, METRICS_FLUSH_INTERVAL)
+
+http_requests_total = registry.counter(
+    "http_requests_total", "Total HTTP requests.", ("method", "route", "status"))
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency in seconds.", ("method", "route"))
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being processed.")
+db_pool_connections = registry.gauge(
+    "db_pool_connections", "Database pool connections by state.", ("state",))
+password_hash_duration_seconds = registry.histogram(
+    "password_hash_duration_seconds", "Time spent in bcrypt hashing and verification.", ("operation",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0))
+email_queue_depth = registry.gauge(
+    "email_queue_depth", "Emails queued for sending but not sent yet.")
+cache_requests_total = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit, shared or miss).", ("cache", "result"))
@@ -0,0 +1,53 @@
+import re
+
+from env import PHONE_COUNTRY_CODE
+
+_SEPARATORS = re.compile(r"[\s().\-/]")
+_TRUNK_PREFIX = "0"
+# Shorter suffixes match too many numbers to be useful.
+MIN_SUFFIX_DIGITS = 4
+
+
+def to_e164(number: str | None, country_code: str = PHONE_COUNTRY_CODE) -> str | None:
+    """
+    Normalize a phone number to E.164, e.g. ``(050) 123-45-67`` to ``+380501234567``.
+
+    Numbers starting with ``+`` or ``00`` are international. Otherwise a
+    number starting with ``country_code`` and longer than a national number
+    only gets a ``+``. Any other number is national: its trunk prefix ``0``
+    is replaced by ``country_code``.
+
+    Args:
+        number (str | None): The phone number as entered.
+        country_code (str, optional): Country calling code of national numbers. Defaults to ``PHONE_COUNTRY_CODE``.
+
+    Returns:
+        str | None: The E.164 number, or None if ``number`` isn't a phone number.
+
+    """
+    number = _SEPARATORS.sub("", number or "")
+    if number.startswith("+"):
+        digits = number[1:]
+    elif number.startswith("00"):
+        digits = number[2:]
+    elif number.startswith(country_code) and len(number) > 10:
+        digits = number
+    else:
+        digits = country_code + number.removeprefix(_TRUNK_PREFIX)
+    if not digits.isdigit() or not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        return None
+    return f"+{digits}"
+
+
+def phone_digits(number: str) -> str:
+    """
+    Get the digits of a partial phone number, for suffix lookups.
+
+    Args:
+        number (str): The partial phone number.
+
+    Returns:
+        str: Its digits.
+
+    """
+    return "".join(ch for ch in number if ch.isdigit())
@@ -0,0 +1,187 @@
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+
+from env import RATE_LIMIT_BACKEND, REDIS_URL, LOGIN_RATE_LIMIT_IP, LOGIN_RATE_LIMIT_EMAIL, CONTACTS_RATE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """
+    Token buckets kept in process memory, for single-node deployments and tests.
+
+    At most ``max_keys`` buckets are kept; the least recently used are dropped first.
+    """
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    async def hit(self, key: str, capacity: int, rate: float, cost: int = 1) -> tuple[bool, float]:
+        """
+        Take ``cost`` tokens from the bucket stored at ``key``.
+
+        Args:
+            key (str): The bucket key.
+            capacity (int): Maximum number of tokens (burst size).
+            rate (float): Tokens added per second.
+            cost (int, optional): Tokens to take. Defaults to 1.
+
+        Returns:
+            tuple[bool, float]: Whether the hit is allowed, and seconds until it would be.
+
+        """
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class RedisBackend:
+    """
+    Token buckets in Redis, shared by all workers and nodes.
+
+    Each hit is one atomic Lua script call using the Redis server clock, so
+    concurrent hits from different nodes can't both take the last token.
+    """
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local cost = tonumber(ARGV[3])
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local allowed = 0
+    local retry_after = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    else
+        retry_after = (cost - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+    return {allowed, tostring(retry_after)}
+    """
+
+    def __init__(self, url: str):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url)
+        self.script = self.redis.register_script(self.SCRIPT)
+
+    async def hit(self, key: str, capacity: int, rate: float, cost: int = 1) -> tuple[bool, float]:
+        allowed, retry_after = await self.script(keys=[f"ratelimit:{key}"], args=[capacity, rate, cost])
+        return bool(allowed), float(retry_after)
+
+
+class RateLimit:
+    """
+    Rate limit of ``capacity`` requests per ``period`` seconds, refilled continuously.
+
+    Args:
+        spec (str): The limit as ``"<requests>/<seconds>"``, e.g. ``"10/60"``.
+
+    """
+
+    def __init__(self, spec: str):
+        requests, _, period = spec.partition("/")
+        self.capacity = int(requests)
+        self.rate = self.capacity / float(period or 1)
+
+    async def check(self, backend, key: str, cost: int = 1) -> None:
+        """
+        Count a hit for ``key`` and reject it if the limit is exceeded.
+
+        The limiter fails open: if the backend is unavailable the request is allowed.
+
+        Args:
+            backend (MemoryBackend | RedisBackend): The bucket storage.
+            key (str): The key to limit, e.g. a client IP or an account email.
+            cost (int, optional): Number of requests this hit counts as. Defaults to 1.
+
+        Raises:
+            HTTPException: 429 with a ``Retry-After`` header if the limit is exceeded.
+
+        """
+        try:
+            allowed, retry_after = await backend.hit(key, self.capacity, self.rate, cost)
+        except Exception as e:
+            logger.warning("Rate limiter backend error, allowing request: %s", e)
+            return
+        if not allowed:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests",
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+def create_backend(name: str = RATE_LIMIT_BACKEND):
+    """
+    Create the configured rate limit backend.
+
+    Args:
+        name (str): ``"memory"`` or ``"redis"``.
+
+    Returns:
+        MemoryBackend | RedisBackend: The backend.
+
+    """
+    if name == "redis":
+        return RedisBackend(REDIS_URL)
+    return MemoryBackend()
+
+
+backend = create_backend()
+login_ip_limit = RateLimit(LOGIN_RATE_LIMIT_IP)
+login_email_limit = RateLimit(LOGIN_RATE_LIMIT_EMAIL)
+contacts_limit = RateLimit(CONTACTS_RATE_LIMIT)
+
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+async def limit_login(request: Request, body: OAuth2PasswordRequestForm = Depends()) -> None:
+    """
+    Dependency limiting login attempts per client IP and per account email.
+
+    Runs before the password is checked, so rejected attempts never reach bcrypt.
+
+    Args:
+        request (Request): The incoming request object.
+        body (OAuth2PasswordRequestForm): User login credentials.
+
+    Raises:
+        HTTPException: 429 if either limit is exceeded.
+
+    """
+    await login_ip_limit.check(backend, f"login:ip:{client_ip(request)}")
+    await login_email_limit.check(backend, f"login:email:{body.username.strip().lower()}")
+
+
+async def limit_contacts(request: Request) -> None:
+    """
+    Dependency limiting contact API calls per client IP.
+
+    Args:
+        request (Request): The incoming request object.
+
+    Raises:
+        HTTPException: 429 if the limit is exceeded.
+
+    """
+    await contacts_limit.check(backend, f"contacts:ip:{client_ip(request)}")
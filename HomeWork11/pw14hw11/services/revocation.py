@@ -0,0 +1,227 @@
+import bisect
+import math
+import time
+from hashlib import blake2b
+
+from env import TOKEN_STORE_BACKEND, REDIS_URL, REVOCATION_REFRESH_INTERVAL, REVOCATION_FILTER_CAPACITY
+
+
+class BloomFilter:
+    """
+    Probabilistic set of strings with no false negatives.
+
+    Args:
+        capacity (int): Expected number of items.
+        error_rate (float, optional): False positive rate at ``capacity`` items. Defaults to 0.001.
+
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class MemoryRevocationStore:
+    """
+    Revoked token ids kept in process memory, for tests and single-process runs.
+
+    Revocations of expired tokens are purged every ``PURGE_INTERVAL`` seconds.
+    The log is numbered, so cursors stay valid when entries are purged.
+    """
+
+    PURGE_INTERVAL = 60
+
+    def __init__(self):
+        self.revoked = {}
+        self.log = []
+        self.sequence = 0
+        self.purged_at = time.monotonic()
+
+    def _purge(self) -> None:
+        if time.monotonic() - self.purged_at < self.PURGE_INTERVAL:
+            return
+        self.purged_at = time.monotonic()
+        now = time.time()
+        self.revoked = {jti: expires_at for jti, expires_at in self.revoked.items() if expires_at > now}
+        self.log = [entry for entry in self.log if entry[2] > now]
+
+    async def revoke(self, jti: str, expires_at: float) -> None:
+        """
+        Revoke a token until it expires.
+
+        Args:
+            jti (str): The token id.
+            expires_at (float): Unix timestamp of the token expiry.
+
+        """
+        self._purge()
+        self.sequence += 1
+        self.revoked[jti] = expires_at
+        self.log.append((self.sequence, jti, expires_at))
+
+    async def is_revoked(self, jti: str) -> bool:
+        """
+        Exact revocation check.
+
+        Args:
+            jti (str): The token id.
+
+        Returns:
+            bool: True if the token is revoked and not expired yet.
+
+        """
+        expires_at = self.revoked.get(jti)
+        if expires_at is not None and expires_at <= time.time():
+            del self.revoked[jti]
+            return False
+        return expires_at is not None
+
+    async def changes_since(self, cursor):
+        """
+        Get revocations recorded after ``cursor``.
+
+        Args:
+            cursor: Position returned by a previous call, or None for all revocations.
+
+        Returns:
+            tuple[list[tuple[str, float]], object]: ``(jti, expires_at)`` pairs and the new cursor.
+
+        """
+        start = bisect.bisect_right(self.log, cursor or 0, key=lambda entry: entry[0])
+        return [(jti, expires_at) for _, jti, expires_at in self.log[start:]], self.sequence
+
+
+class RedisRevocationStore:
+    """
+    Revoked token ids in Redis, shared by all workers.
+
+    ``revoked:<jti>`` keys expire with the token and answer exact checks; the
+    ``revoked_log`` stream lets workers fetch only revocations they haven't seen.
+    """
+
+    LOG_KEY = "revoked_log"
+    LOG_MAXLEN = 1_000_000
+
+    def __init__(self, url: str):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+
+    async def revoke(self, jti: str, expires_at: float) -> None:
+        ttl = max(1, math.ceil(expires_at - time.time()))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"revoked:{jti}", 1, ex=ttl)
+            pipe.xadd(self.LOG_KEY, {"jti": jti, "exp": expires_at}, maxlen=self.LOG_MAXLEN, approximate=True)
+            await pipe.execute()
+
+    async def is_revoked(self, jti: str) -> bool:
+        return bool(await self.redis.exists(f"revoked:{jti}"))
+
+    async def changes_since(self, cursor):
+        entries = await self.redis.xrange(self.LOG_KEY, min=f"({cursor}" if cursor else "-")
+        if not entries:
+            return [], cursor
+        return [(fields["jti"], float(fields["exp"])) for _, fields in entries], entries[-1][0]
+
+
+class RevocationFilter:
+    """
+    Per-worker revocation check backed by a Bloom filter.
+
+    Most tokens are not revoked, and for those :meth:`is_revoked` is a Bloom
+    filter lookup with no I/O. Only filter hits (revoked tokens and rare false
+    positives) are confirmed against the store. The filter pulls new
+    revocations from the store at most every ``refresh_interval`` seconds and
+    is rebuilt from live revocations when it fills up, with room for as many
+    again, so more live revocations than ``capacity`` don't make every
+    refresh a rebuild.
+    """
+
+    def __init__(self, store, capacity: int, refresh_interval: float):
+        self.store = store
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.bloom = BloomFilter(capacity)
+        self.cursor = None
+        self.refreshed_at = float("-inf")
+
+    async def refresh(self) -> None:
+        """Add revocations recorded since the last refresh, rebuilding the filter if it is full."""
+        self.refreshed_at = time.monotonic()
+        changes, self.cursor = await self.store.changes_since(self.cursor)
+        now = time.time()
+        if self.bloom.count + len(changes) > self.bloom.capacity:
+            changes, self.cursor = await self.store.changes_since(None)
+            changes = [(jti, expires_at) for jti, expires_at in changes if expires_at > now]
+            self.bloom = BloomFilter(max(self.capacity, 2 * len(changes)))
+        for jti, expires_at in changes:
+            if expires_at > now:
+                self.bloom.add(jti)
+
+    async def revoke(self, jti: str, expires_at: float) -> None:
+        """
+        Revoke a token and make the revocation visible to this worker immediately.
+
+        Args:
+            jti (str): The token id.
+            expires_at (float): Unix timestamp of the token expiry.
+
+        """
+        await self.store.revoke(jti, expires_at)
+        self.bloom.add(jti)
+
+    async def is_revoked(self, jti: str | None) -> bool:
+        """
+        Check whether a token was revoked.
+
+        Args:
+            jti (str | None): The token id; tokens without one can't be revoked.
+
+        Returns:
+            bool: True if the token is revoked.
+
+        """
+        if jti is None:
+            return False
+        if time.monotonic() - self.refreshed_at >= self.refresh_interval:
+            await self.refresh()
+        if jti not in self.bloom:
+            return False
+        return await self.store.is_revoked(jti)
+
+
+def create_revocation_store(name: str = TOKEN_STORE_BACKEND):
+    """
+    Create the configured revocation store.
+
+    Args:
+        name (str): ``"memory"`` or ``"redis"``.
+
+    Returns:
+        MemoryRevocationStore | RedisRevocationStore: The store.
+
+    """
+    if name == "redis":
+        return RedisRevocationStore(REDIS_URL)
+    return MemoryRevocationStore()
+
+
+revocation_filter = RevocationFilter(create_revocation_store(), REVOCATION_FILTER_CAPACITY,
+                                     REVOCATION_REFRESH_INTERVAL)
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+from services.metrics import cache_requests_total
+from env import SINGLEFLIGHT_WINDOW
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls on one worker.
+
+    Calls to :meth:`do` with the same key while one is running share its result
+    (or exception) instead of running again. With ``window`` > 0 the result is
+    also reused for that many seconds after it arrives.
+
+    Every key belongs to a scope (e.g. a user id). :meth:`invalidate` starts a
+    new generation for the scope, so calls made after a write neither join a
+    call that started before it nor reuse its result. Invalidation is local:
+    with ``window`` > 0, other workers keep serving their results of the scope
+    for up to ``window`` seconds after a write they didn't handle.
+
+    ``fn`` runs as a shielded task that outlives a cancelled caller, so it
+    must not use the caller's database session.
+
+    Args:
+        name (str): Name in the ``cache_requests_total`` metric.
+        window (float, optional): Seconds to keep results. Defaults to 0.
+        max_entries (int, optional): Maximum number of kept results. Defaults to 10000.
+
+    """
+
+    def __init__(self, name: str, window: float = 0, max_entries: int = 10_000):
+        self.name = name
+        self.window = window
+        self.max_entries = max_entries
+        self.generations = {}
+        self.in_flight = {}
+        self.results = OrderedDict()
+
+    def invalidate(self, scope: Hashable) -> None:
+        """
+        Forget results and in-flight calls of a scope, after its data changed.
+
+        Args:
+            scope (Hashable): The scope, e.g. a user id.
+
+        """
+        self.generations[scope] = self.generations.get(scope, 0) + 1
+        for key in [key for key in self.results if key[0] == scope]:
+            del self.results[key]
+
+    async def do(self, scope: Hashable, key: Hashable, fn: Callable[[], Awaitable]):
+        """
+        Run ``fn`` unless an identical call is running or its result is still fresh.
+
+        Args:
+            scope (Hashable): The scope invalidated by writes.
+            key (Hashable): Identifies the call within the scope, e.g. the query parameters.
+            fn (Callable[[], Awaitable]): Produces the result.
+
+        Returns:
+            The result of ``fn``, possibly from another caller.
+
+        """
+        full_key = (scope, self.generations.get(scope, 0), key)
+        cached = self.results.get(full_key)
+        if cached is not None and cached[0] > time.monotonic():
+            cache_requests_total.inc(cache=self.name, result="hit")
+            return cached[1]
+
+        task = self.in_flight.get(full_key)
+        if task is not None:
+            cache_requests_total.inc(cache=self.name, result="shared")
+            return await asyncio.shield(task)
+
+        cache_requests_total.inc(cache=self.name, result="miss")
+        task = asyncio.ensure_future(fn())
+        self.in_flight[full_key] = task
+        try:
+            result = await asyncio.shield(task)
+        finally:
+            if self.in_flight.get(full_key) is task:
+                del self.in_flight[full_key]
+        if self.window > 0 and full_key[1] == self.generations.get(scope, 0):
+            self.results[full_key] = (time.monotonic() + self.window, result)
+            self.results.move_to_end(full_key)
+            if len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+        return result
+
+
+contacts_flight = SingleFlight("contacts", window=SINGLEFLIGHT_WINDOW)
@@ -0,0 +1,195 @@
+import time
+from enum import Enum
+
+from env import TOKEN_STORE_BACKEND, REDIS_URL
+
+
+class Rotation(Enum):
+    """Outcome of presenting a refresh token for rotation."""
+
+    OK = 1
+    UNKNOWN = 0
+    REUSED = -1
+
+
+class MemoryRefreshTokenStore:
+    """
+    Refresh token sessions kept in process memory, for tests and single-process runs.
+
+    Each session (``sid``) of a user stores the ``jti`` of its one valid refresh
+    token. Expired sessions are dropped lazily when the user's sessions are accessed.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+
+    def _user_sessions(self, email: str) -> dict:
+        sessions = self.sessions.get(email, {})
+        now = time.monotonic()
+        for sid in [sid for sid, (_, expires) in sessions.items() if expires <= now]:
+            del sessions[sid]
+        return sessions
+
+    async def create_session(self, email: str, sid: str, jti: str, ttl: int) -> None:
+        """
+        Start a new session for a user.
+
+        Args:
+            email (str): The user's email.
+            sid (str): The new session id.
+            jti (str): Id of the session's first refresh token.
+            ttl (int): Session lifetime in seconds.
+
+        """
+        self._user_sessions(email)
+        self.sessions.setdefault(email, {})[sid] = (jti, time.monotonic() + ttl)
+
+    async def rotate(self, email: str, sid: str, jti: str, new_jti: str, ttl: int) -> Rotation:
+        """
+        Replace the session's refresh token if ``jti`` is the current one.
+
+        Presenting an older token of a live session means it was stolen or
+        replayed, so the whole session is revoked.
+
+        Args:
+            email (str): The user's email.
+            sid (str): The session id.
+            jti (str): Id of the presented refresh token.
+            new_jti (str): Id of the refresh token replacing it.
+            ttl (int): New session lifetime in seconds.
+
+        Returns:
+            Rotation: OK if rotated, REUSED if the session was revoked, UNKNOWN if there is no such session.
+
+        """
+        sessions = self._user_sessions(email)
+        if sid not in sessions:
+            return Rotation.UNKNOWN
+        if sessions[sid][0] != jti:
+            del sessions[sid]
+            return Rotation.REUSED
+        sessions[sid] = (new_jti, time.monotonic() + ttl)
+        return Rotation.OK
+
+    async def revoke_session(self, email: str, sid: str) -> None:
+        """
+        End one session of a user.
+
+        Args:
+            email (str): The user's email.
+            sid (str): The session id.
+
+        """
+        self._user_sessions(email).pop(sid, None)
+
+    async def revoke_all(self, email: str) -> None:
+        """
+        End all sessions of a user.
+
+        Args:
+            email (str): The user's email.
+
+        """
+        self.sessions.pop(email, None)
+
+    async def list_sessions(self, email: str) -> list[str]:
+        """
+        Get the live session ids of a user.
+
+        Args:
+            email (str): The user's email.
+
+        Returns:
+            list[str]: Session ids.
+
+        """
+        return list(self._user_sessions(email))
+
+
+class RedisRefreshTokenStore:
+    """
+    Refresh token sessions in Redis.
+
+    ``refresh:<email>:<sid>`` holds the current ``jti`` and expires with the
+    session, so no cleanup queries are needed; ``refresh_sessions:<email>``
+    indexes the user's sessions. Rotation is a single atomic Lua script.
+    """
+
+    ROTATE_SCRIPT = """
+    local current = redis.call('GET', KEYS[1])
+    if not current then
+        redis.call('SREM', KEYS[2], ARGV[3])
+        return 0
+    end
+    if current ~= ARGV[1] then
+        redis.call('DEL', KEYS[1])
+        redis.call('SREM', KEYS[2], ARGV[3])
+        return -1
+    end
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[4])
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+    return 1
+    """
+
+    def __init__(self, url: str):
+        from redis import asyncio as aioredis
+
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.rotate_script = self.redis.register_script(self.ROTATE_SCRIPT)
+
+    @staticmethod
+    def _keys(email: str, sid: str = "") -> tuple[str, str]:
+        return f"refresh:{email}:{sid}", f"refresh_sessions:{email}"
+
+    async def create_session(self, email: str, sid: str, jti: str, ttl: int) -> None:
+        session_key, index_key = self._keys(email, sid)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(session_key, jti, ex=ttl)
+            pipe.sadd(index_key, sid)
+            pipe.expire(index_key, ttl)
+            await pipe.execute()
+
+    async def rotate(self, email: str, sid: str, jti: str, new_jti: str, ttl: int) -> Rotation:
+        result = await self.rotate_script(keys=list(self._keys(email, sid)), args=[jti, new_jti, sid, ttl])
+        return Rotation(int(result))
+
+    async def revoke_session(self, email: str, sid: str) -> None:
+        session_key, index_key = self._keys(email, sid)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(session_key)
+            pipe.srem(index_key, sid)
+            await pipe.execute()
+
+    async def revoke_all(self, email: str) -> None:
+        _, index_key = self._keys(email)
+        sids = await self.redis.smembers(index_key)
+        await self.redis.delete(index_key, *(self._keys(email, sid)[0] for sid in sids))
+
+    async def list_sessions(self, email: str) -> list[str]:
+        _, index_key = self._keys(email)
+        sids = sorted(await self.redis.smembers(index_key))
+        if not sids:
+            return []
+        alive = await self.redis.exists(*(self._keys(email, sid)[0] for sid in sids))
+        if alive == len(sids):
+            return sids
+        return [sid for sid in sids if await self.redis.exists(self._keys(email, sid)[0])]
+
+
+def create_refresh_token_store(name: str = TOKEN_STORE_BACKEND):
+    """
+    Create the configured refresh token store.
+
+    Args:
+        name (str): ``"memory"`` or ``"redis"``.
+
+    Returns:
+        MemoryRefreshTokenStore | RedisRefreshTokenStore: The store.
+
+    """
+    if name == "redis":
+        return RedisRefreshTokenStore(REDIS_URL)
+    return MemoryRefreshTokenStore()
+
+
+refresh_token_store = create_refresh_token_store()
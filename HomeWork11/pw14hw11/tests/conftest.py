@@ -1,10 +1,19 @@
+import asyncio
+import tempfile
+from pathlib import Path
+from unittest.mock import MagicMock
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from main import app
+from models import User
+from services.audit import audit_log
+from services.auth import auth_service
 from database.connection import Base, get_db
+from database.instrumentation import instrument_engine, enable_strict_loading
 
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -13,6 +22,13 @@ engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument_engine(engine)
+enable_strict_loading(TestingSessionLocal)
+
+# Write audit events to the test database, and only when a test flushes them.
+audit_log.session_factory = TestingSessionLocal
+audit_log.directory = Path(tempfile.mkdtemp(prefix="audit-"))
+audit_log.flush_interval = audit_log.batch_size = 10 ** 9
 
 
 @pytest.fixture(scope="module")
@@ -46,4 +62,17 @@ def client(session):
 
 @pytest.fixture(scope="module")
 def user():
-    return {"username": "test_user", "email": "test@example.com", "password": "password123"}
\ No newline at end of file
+    return {"username": "test_user", "email": "test@example.com", "password": "password123"}
+
+
+@pytest.fixture(scope="module")
+def headers(client, session, user):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("routes.auth.send_email", MagicMock())
+        client.post("/api/auth/signup", json=user)
+    current_user = session.query(User).filter(User.email == user.get("email")).first()
+    current_user.confirmed = True
+    session.commit()
+    # Sign the token directly: logging in from every module would hit the login rate limit.
+    token = asyncio.run(auth_service.create_access_token(data={"sub": user.get("email")}))
+    return {"Authorization": f"Bearer {token}"}
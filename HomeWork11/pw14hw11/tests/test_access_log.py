@@ -0,0 +1,28 @@
+import json
+import logging
+
+from services.logs import JSONFormatter
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.makeLogRecord({"name": "access", "levelname": "INFO", "msg": "GET / %d", "args": (200,),
+                                    "route": "/", "status": 200})
+
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry["message"] == "GET / 200"
+    assert entry["route"] == "/"
+    assert entry["status"] == 200
+    assert entry["logger"] == "access"
+
+
+def test_access_log_record(client, caplog):
+    with caplog.at_level(logging.INFO, logger="access"):
+        response = client.get("/")
+
+    assert response.status_code == 200
+    record = next(r for r in caplog.records if r.name == "access")
+    assert record.route == "/"
+    assert record.status == 200
+    assert record.duration_ms >= 0
+    assert record.db_queries == 0
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from starlette.requests import Request
+
+from main import operational_error_handler
+from database.connection import is_statement_timeout, set_sqlite_statement_timeout
+from middleware.admission import LimitPool, overloaded_response
+
+
+class TestLimitPool(IsolatedAsyncioTestCase):
+
+    async def test_queue_full_is_rejected(self):
+        pool = LimitPool("test", max_concurrency=1, max_queue=1, queue_timeout=1)
+
+        self.assertTrue(await pool.acquire())
+        waiter = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(await pool.acquire())
+
+        pool.release()
+        self.assertTrue(await waiter)
+
+    async def test_queue_timeout(self):
+        pool = LimitPool("test", max_concurrency=1, max_queue=5, queue_timeout=0.01)
+
+        self.assertTrue(await pool.acquire())
+        self.assertFalse(await pool.acquire())
+        self.assertEqual(pool.waiting, 0)
+
+    async def test_cancelled_waiters_keep_no_slot(self):
+        pool = LimitPool("test", max_concurrency=1, max_queue=5, queue_timeout=1)
+
+        self.assertTrue(await pool.acquire())
+        waiter = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0)
+        # The slot is handed to the waiter, which is cancelled before it runs again.
+        pool.release()
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+        self.assertEqual(pool.waiting, 0)
+        self.assertTrue(await pool.acquire())
+
+    def test_overloaded_response(self):
+        response = overloaded_response(0.2)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+
+class TestOperationalErrors(IsolatedAsyncioTestCase):
+
+    request = Request({"type": "http", "method": "GET", "path": "/api/contacts/", "headers": [], "query_string": b""})
+
+    async def test_statement_timeout_is_overloaded(self):
+        error = OperationalError("SELECT 1", {}, Exception("interrupted"))
+
+        response = await operational_error_handler(self.request, error)
+        self.assertEqual(response.status_code, 503)
+
+    def test_statement_timeout_interrupts_long_queries(self):
+        engine = create_engine("sqlite://")
+        set_sqlite_statement_timeout(engine, 50)
+        count = text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT count(*) FROM n")
+
+        with engine.connect() as conn:
+            started = time.perf_counter()
+            with self.assertRaises(OperationalError) as raised:
+                conn.execute(count)
+            self.assertLess(time.perf_counter() - started, 5)
+            self.assertTrue(is_statement_timeout(raised.exception))
+            conn.rollback()
+            self.assertEqual(conn.execute(text("SELECT 1")).scalar(), 1)
+        engine.dispose()
+
+    async def test_other_errors_are_logged(self):
+        error = OperationalError("SELECT 1", {}, Exception("disk I/O error"))
+
+        with self.assertLogs("main", "ERROR") as logs:
+            response = await operational_error_handler(self.request, error)
+        self.assertEqual(response.status_code, 500)
+        self.assertIn("disk I/O error", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import threading
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import services.events
+from models import AuditEvent
+from services.audit import AuditLog
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "email": "anna.melnyk@example.com", "birthdate": "1990-05-17"}
+
+
+@pytest.fixture
+def audit(session, tmp_path, monkeypatch):
+    log = AuditLog(tmp_path, batch_size=10 ** 9, flush_interval=10 ** 9,
+                   session_factory=sessionmaker(bind=session.get_bind()))
+    monkeypatch.setattr(services.events, "audit_log", log)
+    yield log
+    log.close()
+
+
+def history(client, headers, path="/api/contacts/history", **params):
+    response = client.get(path, params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_changes_are_written_in_batches(client, session, headers, audit):
+    contact_id = client.post("/api/contacts/", json=CONTACT, headers=headers).json()["id"]
+    response = client.put(f"/api/contacts/{contact_id}", json={**CONTACT, "first_name": "Olena"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert client.delete(f"/api/contacts/{contact_id}", headers=headers).status_code == 200
+    assert session.query(AuditEvent).count() == 0
+    assert len(list(audit.directory.glob("audit-*.log"))) == 1
+
+    assert audit.flush() == 3
+    assert list(audit.directory.glob("audit-*.log")) == []
+    items = history(client, headers, f"/api/contacts/{contact_id}/history")["items"]
+    assert [item["action"] for item in items] == ["deleted", "updated", "created"]
+    deleted, updated, created = (item["changes"] for item in items)
+    assert created["first_name"] == [None, "Anna"] and created["birthdate"] == [None, "1990-05-17"]
+    assert updated == {"first_name": ["Anna", "Olena"]}
+    assert deleted["first_name"] == ["Olena", None] and len(deleted) == len(created)
+
+
+def test_appends_off_the_event_loop(client, headers, audit, monkeypatch):
+    threads = []
+    append = audit._append
+    monkeypatch.setattr(audit, "_append", lambda *args: threads.append(threading.current_thread()) or append(*args))
+    client.post("/api/contacts/", json=CONTACT, headers=headers)
+    assert len(threads) == 1 and threads[0].name.startswith("asyncio")
+    assert len(audit.buffer) == 1
+
+
+def test_rolled_back_changes_are_not_audited(client, session, headers, audit):
+    response = client.post("/api/batch/", json={"atomic": True, "operations": [
+        {"op": "create", "body": CONTACT}, {"op": "delete", "id": 999999}]}, headers=headers)
+    assert response.json()["committed"] is False
+    assert audit.buffer == []
+
+
+def test_history_pages(client, headers, audit):
+    for name in ("Ivan", "Petro", "Taras"):
+        client.post("/api/contacts/", json={**CONTACT, "first_name": name}, headers=headers)
+    audit.flush()
+    everything = history(client, headers, limit=500)["items"]
+    first = history(client, headers, limit=2)
+    assert first["items"] == everything[:2]
+    second = history(client, headers, limit=2, before=first["next_before"])
+    assert second["items"] == everything[2:4]
+    assert history(client, headers, before=everything[-1]["id"]) == {"items": [], "next_before": None}
+
+
+def test_failed_flush_keeps_events(client, session, headers, audit, monkeypatch):
+    client.post("/api/contacts/", json=CONTACT, headers=headers)
+    session_factory = audit.session_factory
+    monkeypatch.setattr(audit, "session_factory", lambda: 1 / 0)
+    assert audit.flush() == 0
+    assert len(audit.buffer) == 1 and len(list(audit.directory.glob("audit-*.log"))) == 1
+
+    monkeypatch.setattr(audit, "session_factory", session_factory)
+    assert audit.flush() == 1
+    assert list(audit.directory.glob("audit-*.log")) == []
+
+
+def test_replay_segments_of_crashed_process(client, session, headers, audit, tmp_path):
+    client.post("/api/contacts/", json=CONTACT, headers=headers)
+    client.post("/api/contacts/", json=CONTACT, headers=headers)
+    path = audit.segment[0]
+    rows = [json.loads(line) for line in path.read_text().splitlines()]
+    # A process killed mid-flush: the first event is stored, and the last line is cut off.
+    audit.flush()
+    session.query(AuditEvent).filter(AuditEvent.event_id == rows[1]["event_id"]).delete()
+    session.commit()
+    crashed = tmp_path / "audit-1-crashed.log"
+    crashed.write_text("".join(json.dumps(row) + "\n" for row in rows) + '{"event_id": "')
+    count = session.query(AuditEvent).count()
+
+    assert audit.replay() == 2
+    assert session.query(AuditEvent).count() == count + 1
+    assert not crashed.exists()
+
+
+def test_history_follows_event_time(client, session, headers, audit, tmp_path):
+    for name in ("Ivan", "Petro"):
+        client.post("/api/contacts/", json={**CONTACT, "first_name": name}, headers=headers)
+    ivan = json.loads(audit.segment[0].read_text().splitlines()[0])
+    audit.flush()
+    # Ivan's creation is only stored when a crashed process's segment is replayed.
+    session.query(AuditEvent).filter(AuditEvent.event_id == ivan["event_id"]).delete()
+    session.commit()
+    (tmp_path / "audit-1-crashed.log").write_text(json.dumps(ivan) + "\n")
+    client.post("/api/contacts/", json={**CONTACT, "first_name": "Taras"}, headers=headers)
+    audit.flush()
+    audit.replay()
+
+    items = history(client, headers, limit=3)["items"]
+    assert [item["changes"]["first_name"][1] for item in items] == ["Taras", "Petro", "Ivan"]
+    assert history(client, headers, limit=1, before=items[1]["id"])["items"] == items[2:]
@@ -0,0 +1,114 @@
+import io
+
+import httpx
+import pytest
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+
+import services.avatars
+from models import User
+from services.avatars import AvatarStore, ByteLRU, avatar_store, render_variants
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = AvatarStore(tmp_path, workers=0, cache_bytes=1024)
+    for name in ("root", "workers", "cache"):
+        monkeypatch.setattr(avatar_store, name, getattr(store, name))
+    monkeypatch.setattr(services.avatars, "AVAILABLE", True)
+    return avatar_store
+
+
+def upload(client, headers, data=b"image"):
+    return client.put("/api/users/me/avatar", files={"file": ("me.png", data, "image/png")}, headers=headers)
+
+
+def test_byte_lru():
+    cache = ByteLRU(max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc")
+    cache.put("huge", b"x" * 11)
+
+    assert cache.get("b") is None and cache.get("huge") is None
+    assert (cache.get("a"), cache.get("c"), cache.size) == (b"aaaa", b"cccc", 8)
+
+
+def test_upload_and_serve(client, session, headers, user, store, monkeypatch):
+    renders = []
+
+    def render(data):
+        renders.append(data)
+        return {variant: f"{variant}:{data.decode()}".encode() for variant in services.avatars.VARIANTS}
+
+    monkeypatch.setattr(services.avatars, "render_variants", render)
+    response = upload(client, headers)
+    assert response.status_code == 200, response.text
+    variants = response.json()["variants"]
+    assert response.json()["avatar"] == variants["medium"]
+    assert session.query(User.avatar).filter(User.email == user["email"]).scalar() == variants["medium"]
+
+    assert upload(client, headers).json() == response.json()
+    assert renders == [b"image"]
+
+    small = client.get(variants["small"])
+    assert small.content == b"small:image"
+    assert small.headers["content-type"] == "image/jpeg"
+    assert "immutable" in small.headers["cache-control"]
+    large = client.get(variants["large"])
+    assert large.content == b"large:image"
+    assert large.headers["etag"] != small.headers["etag"]
+    assert client.get(variants["large"], headers={"If-None-Match": large.headers["etag"]}).status_code == 304
+    listed = f'"other", W/{large.headers["etag"]}'
+    assert client.get(variants["large"], headers={"If-None-Match": listed}).status_code == 304
+    assert client.get(variants["large"], headers={"If-None-Match": '"other"'}).status_code == 200
+    assert client.get(variants["small"], headers={"If-None-Match": "*"}).status_code == 304
+    assert client.get("/api/users/avatars/" + "0" * 32 + "/large", headers={"If-None-Match": "*"}).status_code == 404
+    assert client.get(variants["large"].replace("large", "huge")).status_code == 422
+    assert client.get("/api/users/avatars/" + "0" * 32 + "/small").status_code == 404
+
+
+def test_rejected_uploads(client, headers, store, monkeypatch):
+    monkeypatch.setattr(services.avatars, "render_variants", render_variants)
+    monkeypatch.setattr("routes.users.AVATAR_MAX_BYTES", 10)
+    assert upload(client, headers, b"x" * 11).status_code == 413
+
+    monkeypatch.setattr(services.avatars, "AVAILABLE", False)
+    assert upload(client, headers).status_code == 503
+    assert client.put("/api/users/me/avatar", files={"other": ("me.png", b"image")},
+                      headers=headers).status_code == 422
+
+
+def test_large_uploads_are_refused_unread(client, headers, store, monkeypatch):
+    forms = []
+    form = Request.form
+    monkeypatch.setattr(Request, "form", lambda self, *args, **kwargs: forms.append(1) or form(self, *args, **kwargs))
+    monkeypatch.setattr("routes.users.AVATAR_MAX_BYTES", 10)
+    assert upload(client, headers, b"x" * 100_000).status_code == 413
+    assert forms == []
+
+    # Without a Content-Length, the body is cut off once it passes the limit.
+    spooled = []
+    write = UploadFile.write
+    monkeypatch.setattr(UploadFile, "write", lambda self, data: spooled.append(len(data)) or write(self, data))
+    request = httpx.Request("PUT", "http://test", files={"file": ("me.png", b"x" * 100_000, "image/png")})
+    body = request.read()
+    chunks = (body[i:i + 1024] for i in range(0, len(body), 1024))
+    response = client.put("/api/users/me/avatar", content=chunks,
+                          headers={**headers, "Content-Type": request.headers["Content-Type"]})
+    assert response.status_code == 413
+    assert forms == [1] and sum(spooled) < 100_000
+
+
+def test_render_variants():
+    image_module = pytest.importorskip("PIL.Image")
+    source = io.BytesIO()
+    image_module.new("RGB", (800, 600), "red").save(source, "PNG")
+
+    variants = render_variants(source.getvalue())
+
+    sizes = {name: image_module.open(io.BytesIO(data)).size for name, data in variants.items()}
+    assert sizes == {"small": (64, 64), "medium": (256, 256), "large": (512, 512)}
+    with pytest.raises(services.avatars.InvalidImage):
+        render_variants(b"not an image")
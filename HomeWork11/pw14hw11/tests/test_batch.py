@@ -0,0 +1,45 @@
+CONTACT = {"first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "email": "anna.melnyk@example.com", "birthdate": "1990-05-17"}
+
+
+def batch(client, headers, operations, atomic=True):
+    response = client.post("/api/batch/", json={"operations": operations, "atomic": atomic}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_atomic_batch(client, headers):
+    data = batch(client, headers, [{"op": "create", "body": CONTACT},
+                                   {"op": "create", "body": {**CONTACT, "first_name": "Olena"}}])
+
+    assert data["committed"] is True
+    assert [result["status"] for result in data["results"]] == [201, 201]
+    contact_id = data["results"][0]["contact"]["id"]
+
+    data = batch(client, headers, [{"op": "update", "id": contact_id, "body": {**CONTACT, "first_name": "Changed"}},
+                                   {"op": "delete", "id": 999999}])
+
+    assert data["committed"] is False
+    assert [result["status"] for result in data["results"]] == [424, 404]
+    response = client.get(f"/api/contacts/{contact_id}", headers=headers)
+    assert response.json()["first_name"] == "Anna"
+
+
+def test_independent_batch(client, headers):
+    contact_id = batch(client, headers, [{"op": "create", "body": CONTACT}])["results"][0]["contact"]["id"]
+
+    data = batch(client, headers, [{"op": "update", "id": contact_id, "body": {**CONTACT, "first_name": "Changed"}},
+                                   {"op": "delete", "id": 999999},
+                                   {"op": "get", "id": contact_id}], atomic=False)
+
+    assert data["committed"] is True
+    assert [result["status"] for result in data["results"]] == [200, 404, 200]
+    assert data["results"][2]["contact"]["first_name"] == "Changed"
+    response = client.get(f"/api/contacts/{contact_id}", headers=headers)
+    assert response.json()["first_name"] == "Changed"
+
+
+def test_invalid_operation(client, headers):
+    response = client.post("/api/batch/", json={"operations": [{"op": "get"}]}, headers=headers)
+
+    assert response.status_code == 422
@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import database.connection
+from models import Base, User
+from database.connection import LazySession, get_db, release
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'connection.db'}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add(User(username="anna", email="anna@example.com", password="secret"))
+        db.commit()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def users(engine) -> int:
+    with sessionmaker(bind=engine)() as db:
+        return db.query(User).count()
+
+
+def test_get_db_connects_on_first_use(monkeypatch, session_factory, engine):
+    opened = []
+    monkeypatch.setattr(database.connection, "_default_session", lambda: opened.append(1) or session_factory())
+    requests = get_db()
+    db = next(requests)
+    assert not db.started and opened == []
+
+    db.query(User).first()
+    assert db.started and opened == [1] and engine.pool.checkedout() == 1
+    requests.close()
+    assert engine.pool.checkedout() == 0
+
+
+def test_release_returns_connection_and_keeps_objects(session_factory, engine):
+    db = LazySession(session_factory)
+    user = db.query(User).one()
+    assert engine.pool.checkedout() == 1
+
+    release(db)
+    assert engine.pool.checkedout() == 0
+    # Not expired, so reading it doesn't check the connection out again.
+    assert user.email == "anna@example.com"
+    assert engine.pool.checkedout() == 0
+    db.close()
+
+
+def test_release_keeps_flushed_writes(session_factory, engine):
+    db = LazySession(session_factory)
+    db.add(User(username="ivan", email="ivan@example.com", password="secret"))
+    db.flush()
+
+    release(db)
+    assert engine.pool.checkedout() == 1
+    db.rollback()
+    assert users(engine) == 1
+    db.close()
+
+
+def test_release_keeps_pending_writes(session_factory, engine):
+    db = LazySession(session_factory)
+    db.query(User).one().username = "olena"
+    db.add(User(username="ivan", email="ivan@example.com", password="secret"))
+
+    release(db)
+    assert len(db.new) == 1 and len(db.dirty) == 1
+    assert engine.pool.checkedout() == 1
+    db.close()
+    assert users(engine) == 1
+
+
+def test_release_ignores_plain_sessions(session_factory, engine):
+    db = session_factory()
+    db.query(User).one()
+    release(db)
+    assert db.in_transaction() and engine.pool.checkedout() == 1
+    db.close()
@@ -0,0 +1,94 @@
+from datetime import date
+
+from sqlalchemy import event
+
+from models import Contact, User, UserContactStats
+from repository.contacts import reconcile_contact_stats
+from tests.conftest import TestingSessionLocal
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "email": "anna.melnyk@example.com", "birthdate": "1990-05-17"}
+
+
+def stats(client, headers):
+    response = client.get("/api/contacts/stats", headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    return data["contacts"], {month: count for month, count in enumerate(data["birthdays_per_month"], 1) if count}, \
+        data["without_birthdate"]
+
+
+def create(client, headers, **fields):
+    response = client.post("/api/contacts/", json={**CONTACT, **fields}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_counters_follow_writes(client, headers):
+    assert stats(client, headers) == (0, {}, 0)
+    anna = create(client, headers)
+    olena = create(client, headers, first_name="Olena", birthdate="1992-05-01")
+    ivan = create(client, headers, first_name="Ivan", birthdate="1988-03-09")
+    assert stats(client, headers) == (3, {3: 1, 5: 2}, 0)
+
+    response = client.put(f"/api/contacts/{olena}", json={**CONTACT, "birthdate": "1992-12-01"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert stats(client, headers) == (3, {3: 1, 5: 1, 12: 1}, 0)
+
+    assert client.delete(f"/api/contacts/{ivan}", headers=headers).status_code == 200
+    assert stats(client, headers) == (2, {5: 1, 12: 1}, 0)
+
+    response = client.post("/api/contacts/merge", json={"keep": anna, "merge": [olena]}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert stats(client, headers) == (1, {5: 1}, 0)
+
+
+def test_rolled_back_batch_leaves_counters(client, headers):
+    before = stats(client, headers)
+    response = client.post("/api/batch/", json={"atomic": True, "operations": [
+        {"op": "create", "body": CONTACT}, {"op": "delete", "id": 999999}]}, headers=headers)
+    assert response.json()["committed"] is False
+    assert stats(client, headers) == before
+
+    response = client.post("/api/batch/", json={"atomic": True, "operations": [
+        {"op": "create", "body": {**CONTACT, "birthdate": "2000-01-31"}}]}, headers=headers)
+    assert response.json()["committed"] is True
+    assert stats(client, headers) == (before[0] + 1, {**before[1], 1: 1}, 0)
+
+
+def test_reconcile_repairs_drift(client, session, headers, user):
+    user_id = session.query(User.id).filter(User.email == user["email"]).scalar()
+    expected = stats(client, headers)
+    session.add(Contact(first_name="Imported", user_id=user_id))
+    session.query(UserContactStats).filter(UserContactStats.month == 5).update({"contacts": 40})
+    session.commit()
+
+    assert reconcile_contact_stats(session, batch_size=1) == 2
+    assert stats(client, headers) == (expected[0] + 1, expected[1], 1)
+    assert reconcile_contact_stats(session) == 0
+
+
+def test_reconcile_adds_to_counters_created_meanwhile(client, session, headers, user):
+    user_id = session.query(User.id).filter(User.email == user["email"]).scalar()
+    expected = stats(client, headers)
+    # Imported without its counter; then a contact with the same birth month is created during the recount.
+    session.add(Contact(first_name="Imported", user_id=user_id, birthdate=date(1990, 7, 1)))
+    session.commit()
+
+    created = []
+
+    def create_during_recount(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO user_contact_stats") and not created:
+            created.append(1)
+            with TestingSessionLocal() as other:
+                other.add(Contact(first_name="Created", user_id=user_id, birthdate=date(1991, 7, 2)))
+                other.add(UserContactStats(user_id=user_id, month=7, contacts=1))
+                other.commit()
+
+    event.listen(session.get_bind(), "before_cursor_execute", create_during_recount)
+    try:
+        assert reconcile_contact_stats(session, user_id) == 1
+    finally:
+        event.remove(session.get_bind(), "before_cursor_execute", create_during_recount)
+    assert stats(client, headers) == (expected[0] + 2, {**expected[1], 7: 2}, expected[2])
+    assert reconcile_contact_stats(session, user_id) == 0
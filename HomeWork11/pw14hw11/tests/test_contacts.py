@@ -0,0 +1,37 @@
+import asyncio
+from datetime import date, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import User
+from repository.contacts import get_contacts
+
+
+def test_upcoming_birthdays(client, headers):
+    today = date.today()
+    for days, name in ((3, "Soon"), (1, "Tomorrow"), (30, "Later")):
+        # 2000 is a leap year, so this also works when the date is February 29.
+        birthdate = (today + timedelta(days=days)).replace(year=2000)
+        response = client.post("/api/contacts/", json={"id": 0, "first_name": name, "last_name": "Melnyk",
+                                                       "phone_number": "+380501234567", "email": "a@example.com",
+                                                       "birthdate": birthdate.isoformat()}, headers=headers)
+        assert response.status_code == 200, response.text
+
+    response = client.get("/api/contacts/birthdays", params={"days": 7}, headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert [contact["first_name"] for contact in response.json()] == ["Tomorrow", "Soon"]
+
+
+def test_shared_reads_leave_the_request_session_alone(client, session, headers, user):
+    current_user = session.query(User).filter(User.email == user["email"]).one()
+    db = Session(bind=session.get_bind())
+    began = []
+    event.listen(db, "after_begin", lambda *args: began.append(args))
+
+    contacts = asyncio.run(get_contacts(0, 10, current_user, db))
+
+    assert contacts and all(contact.first_name for contact in contacts)
+    assert began == []
+    db.close()
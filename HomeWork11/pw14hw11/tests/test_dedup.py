@@ -0,0 +1,95 @@
+from datetime import date
+from types import SimpleNamespace
+
+from models import Contact, ContactDedupKey, User
+from services.dedup import dedup_keys, normalize_phone, score, soundex
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "email": "anna.melnyk@example.com", "birthdate": "1990-05-17"}
+
+
+def create(client, headers, **fields):
+    response = client.post("/api/contacts/", json={**CONTACT, **fields}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def test_soundex():
+    assert soundex("Robert") == soundex("Rupert") == "R163"
+    assert soundex("Tymczak") == "T522"
+    assert soundex("Pfister") == "P236"
+    assert soundex("Ševčenko") == soundex("Shevchenko")
+    assert soundex("Ли") == ""
+
+
+def test_dedup_keys():
+    contact = SimpleNamespace(first_name="anna", last_name="Melnik", phone_number="(050) 123-45-67",
+                              email=" Anna.Melnyk@Example.com")
+
+    assert dedup_keys(contact) == {"email": "anna.melnyk@example.com", "phone": "501234567", "name": "A500M452"}
+    assert normalize_phone("+380 50 123 45 67") == normalize_phone("0501234567") == "501234567"
+    assert dedup_keys(SimpleNamespace(first_name="", last_name="Melnyk", phone_number="123", email=None)) == {}
+    assert score(["email", "phone", "name", "birthdate"]) == 1
+    assert score(["name", "birthdate"]) == 0.5
+
+
+def test_duplicates_and_merge(client, session, headers):
+    anna = create(client, headers)
+    copy = create(client, headers, first_name="anna", phone_number="(050) 123-45-67", email="")
+    namesake = create(client, headers, phone_number="+380671111111", email="other@example.com",
+                      birthdate="1985-01-01")
+    olena = create(client, headers, first_name="Olena", phone_number="+380672222222", email="olena@example.com")
+
+    response = client.get("/api/contacts/duplicates", headers=headers)
+    assert response.status_code == 200, response.text
+    pairs = [([contact["id"] for contact in pair["contacts"]], pair["score"], pair["signals"])
+             for pair in response.json()]
+    assert pairs == [([anna, copy], 0.9, ["phone", "name", "birthdate"])]
+
+    response = client.get(f"/api/contacts/{namesake}/duplicates", params={"min_score": 0.3}, headers=headers)
+    assert sorted(contact["id"] for pair in response.json() for contact in pair["contacts"]) == [anna, copy, namesake,
+                                                                                                 namesake]
+    assert client.get(f"/api/contacts/{olena}/duplicates", headers=headers).json() == []
+
+    response = client.post("/api/contacts/merge", json={"keep": copy, "merge": [anna]}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == "anna.melnyk@example.com"
+    assert response.json()["first_name"] == "anna"
+    assert client.get(f"/api/contacts/{anna}", headers=headers).status_code == 404
+    assert client.get("/api/contacts/duplicates", headers=headers).json() == []
+    assert session.query(ContactDedupKey).filter(ContactDedupKey.contact_id == anna).count() == 0
+
+    response = client.post("/api/contacts/merge", json={"keep": copy, "merge": [anna]}, headers=headers)
+    assert response.status_code == 404
+    response = client.post("/api/contacts/merge", json={"keep": copy, "merge": [copy]}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_scan_indexes_imported_contacts(client, session, headers, user):
+    user_id = session.query(User.id).filter(User.email == user["email"]).scalar()
+    session.add_all([Contact(first_name="Ivan", last_name="Koval", phone_number="0931234567", email="ivan@example.com",
+                             birthdate=date(1980, 2, 3), user_id=user_id),
+                     Contact(first_name="Ivan", last_name="Koval", phone_number="+380931234567",
+                             email="IVAN@example.com", birthdate=date(1980, 3, 2), user_id=user_id)])
+    session.commit()
+    assert client.get("/api/contacts/duplicates", headers=headers).json() == []
+
+    response = client.post("/api/contacts/duplicates/scan", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert [pair["signals"] for pair in response.json()] == [["email", "phone", "name"]]
+
+
+def test_reused_id_gets_fresh_keys(client, session, headers):
+    contact_id = create(client, headers, first_name="Taras", email="taras@example.com")
+    assert client.delete(f"/contacts/{contact_id}").status_code == 200
+    assert session.query(ContactDedupKey).filter(ContactDedupKey.contact_id == contact_id).count() == 0
+    # Keys left behind by a delete that bypassed the repository, e.g. from before this fix.
+    session.add(ContactDedupKey(contact_id=contact_id, user_id=1, kind="email", value="taras@example.com"))
+    session.commit()
+
+    # SQLite reuses the id of the deleted contact.
+    assert create(client, headers, first_name="Olha", email="olha@example.com") == contact_id
+    keys = session.query(ContactDedupKey.kind, ContactDedupKey.value) \
+        .filter(ContactDedupKey.contact_id == contact_id).all()
+    assert ("email", "olha@example.com") in keys and ("email", "taras@example.com") not in keys
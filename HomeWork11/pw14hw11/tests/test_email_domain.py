@@ -0,0 +1,35 @@
+from services.email_address import email_domain
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "birthdate": "1990-05-17"}
+
+
+def test_email_domain():
+    assert email_domain(" Anna.Melnyk@Company.COM ") == "company.com"
+    assert email_domain("a@b@mail.example.org") == "mail.example.org"
+    assert email_domain("not an email") is None
+    assert email_domain("@company.com") is None
+    assert email_domain(None) is None
+
+
+def test_domain_filter_and_histogram(client, headers):
+    ids = {}
+    for name, email in [("Anna", "anna@company.com"), ("Olena", "Olena@COMPANY.com"), ("Ivan", "ivan@gmail.com"),
+                        ("Petro", "petro@mail.company.com"), ("Maria", "")]:
+        response = client.post("/api/contacts/", json={**CONTACT, "first_name": name, "email": email},
+                               headers=headers)
+        assert response.status_code == 200, response.text
+        ids[name] = response.json()["id"]
+
+    response = client.get("/api/contacts/", params={"domain": "@Company.com"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert sorted(contact["id"] for contact in response.json()) == [ids["Anna"], ids["Olena"]]
+    assert len(client.get("/api/contacts/", headers=headers).json()) == 5
+
+    client.put(f"/api/contacts/{ids['Ivan']}", json={**CONTACT, "first_name": "Ivan", "email": "ivan@company.com"},
+               headers=headers)
+    response = client.get("/api/contacts/domains", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == [{"domain": "company.com", "contacts": 3}, {"domain": "mail.company.com", "contacts": 1}]
+    assert client.get("/api/contacts/domains", params={"limit": 1}, headers=headers).json() == [
+        {"domain": "company.com", "contacts": 3}]
@@ -0,0 +1,160 @@
+import asyncio
+import json
+
+import pytest
+
+import services.events
+from models import User
+from services.events import ContactEventBroker, MemoryEventLog, contact_broker
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "email": "anna.melnyk@example.com", "birthdate": "1990-05-17"}
+
+
+def parse(body: str) -> list[dict]:
+    events = []
+    for block in body.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if line and not line.startswith(":"))
+        if "event" in fields:
+            events.append({"id": fields.get("id"), "event": fields["event"], "data": json.loads(fields["data"])})
+    return events
+
+
+@pytest.fixture
+def short_streams(monkeypatch):
+    monkeypatch.setattr(contact_broker, "max_stream", 0.2)
+    monkeypatch.setattr(contact_broker, "heartbeat", 0.05)
+
+
+def test_resume_from_last_event_id(client, session, headers, user, short_streams, monkeypatch):
+    user_id = session.query(User.id).filter(User.email == user["email"]).scalar()
+    published = []
+    append = contact_broker.log.append
+    monkeypatch.setattr(contact_broker.log, "append", lambda *args: published.extend(args[1]) or append(*args))
+    contact_id = client.post("/api/contacts/", json=CONTACT, headers=headers).json()["id"]
+    assert published[-1]["event"] == "created" and published[-1]["data"]["phone_e164"] == "+380501234567"
+    n, _, _ = contact_broker.log.events[user_id][1][-1]
+    first = {"id": f"{contact_broker.log.epoch}-{n}"}
+
+    client.put(f"/api/contacts/{contact_id}", json={**CONTACT, "first_name": "Olena"}, headers=headers)
+    response = client.post("/api/batch/", json={"atomic": True, "operations": [
+        {"op": "create", "body": CONTACT}, {"op": "delete", "id": 999999}]}, headers=headers)
+    assert response.json()["committed"] is False
+    response = client.post("/api/batch/", json={"atomic": False, "operations": [
+        {"op": "delete", "id": contact_id}, {"op": "delete", "id": 999999}]}, headers=headers)
+    assert response.json()["committed"] is True
+
+    response = client.get("/api/contacts/events", headers={**headers, "Last-Event-ID": first["id"]})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert ": heartbeat" in response.text
+    assert [(event["event"], event["data"]) for event in parse(response.text)] == [
+        ("updated", {"id": contact_id}), ("deleted", {"id": contact_id})]
+
+    response = client.get("/api/contacts/events", headers={**headers, "Last-Event-ID": "1-1"})
+    assert [event["event"] for event in parse(response.text)] == ["reset"]
+    assert client.get("/api/contacts/events").status_code == 401
+
+
+def test_live_events_and_slow_clients():
+    async def scenario():
+        broker = ContactEventBroker(MemoryEventLog(history=3), queue_size=2, heartbeat=0.05, max_stream=5)
+        stream = broker.stream(1)
+        assert await anext(stream) == "retry: 1000\n\n"
+        assert await anext(stream) == ": heartbeat\n\n"
+
+        await broker.publish(1, [{"event": "created", "data": {"id": 1}}])
+        await broker.publish(2, [{"event": "created", "data": {"id": 2}}])
+        live = parse(await anext(stream))
+        assert live[0]["data"] == {"id": 1}
+
+        # Overflowing the queue ends the stream; the client resumes from its last event.
+        await broker.publish(1, [{"event": "updated", "data": {"id": n}} for n in range(3)])
+        assert [chunk async for chunk in stream] == []
+        assert not broker.subscribers
+
+        resumed = broker.stream(1, live[0]["id"])
+        await anext(resumed)
+        assert [parse(await anext(resumed))[0]["data"]["id"] for _ in range(3)] == [0, 1, 2]
+        await resumed.aclose()
+
+        await broker.publish(1, [{"event": "deleted", "data": {"id": 1}}])
+        stale = broker.stream(1, live[0]["id"])
+        await anext(stale)
+        assert parse(await anext(stale))[0]["event"] == "reset"
+        await stale.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_memory_log_forgets_least_recent_users():
+    async def scenario():
+        log = MemoryEventLog(history=2, max_users=2)
+        first = (await log.append(1, [{"event": "created", "data": {"id": 1, "first_name": "Anna"}}]))[0]
+        assert first["data"]["first_name"] == "Anna"
+        await log.append(2, [{"event": "created", "data": {"id": 2}}])
+        updated = (await log.append(1, [{"event": "updated", "data": {"id": 1, "first_name": "Olena"}}]))[0]
+        last = (await log.append(3, [{"event": "created", "data": {"id": 3}}]))[0]
+
+        assert list(log.events) == [1, 3]
+        assert await log.since(1, first["id"]) == [{"id": updated["id"], "event": "updated", "data": {"id": 1}}]
+        assert await log.since(2, first["id"]) is None
+        assert await log.since(4, first["id"]) is None
+        assert await log.since(4, last["id"]) == []
+
+    asyncio.run(scenario())
+
+
+def test_history_is_read_after_subscribing():
+    class SlowSubscription(MemoryEventLog):
+        shared = True
+
+        def __init__(self):
+            super().__init__(history=10)
+            self.calls = []
+            self.channel = asyncio.Queue()
+
+        async def append(self, user_id, events):
+            stored = await super().append(user_id, events)
+            self.channel.put_nowait((user_id, stored))
+            return stored
+
+        async def since(self, user_id, event_id):
+            self.calls.append("since")
+            return await super().since(user_id, event_id)
+
+        async def listen(self, subscribed):
+            await asyncio.sleep(0.05)
+            self.calls.append("subscribed")
+            subscribed.set()
+            while True:
+                yield await self.channel.get()
+
+    async def scenario():
+        log = SlowSubscription()
+        broker = ContactEventBroker(log, queue_size=10, heartbeat=1, max_stream=5)
+        first = (await log.append(1, [{"event": "created", "data": {"id": 1}}]))[0]
+        stream = broker.stream(1, first["id"])
+        await anext(stream)
+        received = asyncio.create_task(anext(stream))
+        await asyncio.sleep(0.1)
+        await broker.publish(1, [{"event": "updated", "data": {"id": 1, "first_name": "Olena"}}])
+
+        assert parse(await received)[0]["data"] == {"id": 1, "first_name": "Olena"}
+        assert log.calls == ["subscribed", "since"]
+        await stream.aclose()
+        await broker.close()
+
+    asyncio.run(scenario())
+
+
+def test_publish_failure_is_logged(client, headers, monkeypatch, caplog):
+    async def fail(user_id, events):
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(services.events.contact_broker, "publish", fail)
+    response = client.post("/api/contacts/", json=CONTACT, headers=headers)
+
+    assert response.status_code == 200
+    assert "Failed to publish 1 contact event(s)" in caplog.text
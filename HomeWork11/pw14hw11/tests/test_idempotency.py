@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+import repository.contacts
+from models import Contact
+from services.idempotency import IdempotentRequests, MemoryIdempotencyStore
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "email": "anna.melnyk@example.com", "birthdate": "1990-05-17"}
+
+
+def test_replayed_create(client, session, headers, monkeypatch):
+    keyed = {**headers, "Idempotency-Key": "create-anna"}
+    first = client.post("/api/contacts/", json=CONTACT, headers=keyed)
+    assert first.status_code == 200, first.text
+    assert "Idempotent-Replayed" not in first.headers
+
+    monkeypatch.setattr(repository.contacts, "create_contact", lambda *args: pytest.fail("created again"))
+    retry = client.post("/api/contacts/", json=CONTACT, headers=keyed)
+
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert session.query(Contact).filter(Contact.first_name == "Anna").count() == 1
+
+    response = client.post("/api/contacts/", json={**CONTACT, "first_name": "Olena"}, headers=keyed)
+    assert response.status_code == 422
+
+
+def test_replayed_batch(client, session, headers):
+    keyed = {**headers, "Idempotency-Key": "import-1"}
+    body = {"operations": [{"op": "create", "body": {**CONTACT, "first_name": "Ivan"}}]}
+    first = client.post("/api/batch/", json=body, headers=keyed)
+    retry = client.post("/api/batch/", json=body, headers=keyed)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert session.query(Contact).filter(Contact.first_name == "Ivan").count() == 1
+    assert client.post("/api/batch/", json=body, headers={**headers, "Idempotency-Key": "import-2"}).status_code == 200
+    assert session.query(Contact).filter(Contact.first_name == "Ivan").count() == 2
+
+
+def test_concurrent_requests_wait_for_the_first():
+    requests = IdempotentRequests(MemoryIdempotencyStore(), ttl=60, lock_ttl=60, wait=1)
+    calls = []
+
+    async def create():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"id": len(calls)}
+
+    async def fail():
+        raise RuntimeError("database is down")
+
+    async def scenario():
+        responses = await asyncio.gather(*(requests.run("1:contacts", "key", CONTACT, create) for _ in range(5)))
+        assert len(calls) == 1
+        assert {response.body for response in responses} == {b'{"id":1}'}
+        assert sum("idempotent-replayed" in response.headers for response in responses) == 4
+
+        with pytest.raises(RuntimeError):
+            await requests.run("1:contacts", "other", CONTACT, fail)
+        assert (await requests.run("1:contacts", "other", CONTACT, create)).body == b'{"id":2}'
+
+        slow = IdempotentRequests(requests.store, ttl=60, lock_ttl=60, wait=0.01)
+        first = asyncio.create_task(requests.run("1:contacts", "slow", CONTACT, create))
+        await asyncio.sleep(0)
+        with pytest.raises(Exception) as error:
+            await slow.run("1:contacts", "slow", CONTACT, create)
+        assert error.value.status_code == 409
+        await first
+
+    asyncio.run(scenario())
+
+
+def test_unsaved_response_is_not_run_again(monkeypatch):
+    store = MemoryIdempotencyStore()
+    requests = IdempotentRequests(store, ttl=60, lock_ttl=0.05, wait=1)
+    calls = []
+    save = store.save
+
+    async def create():
+        calls.append(1)
+        return {"id": len(calls)}
+
+    async def save_small_records(key, owner, record, ttl):
+        if "body" in record:
+            raise ConnectionError("response too large")
+        await save(key, owner, record, ttl)
+
+    async def scenario():
+        monkeypatch.setattr(store, "save", save_small_records)
+        with pytest.raises(ConnectionError):
+            await requests.run("1:contacts", "key", CONTACT, create)
+        await asyncio.sleep(0.1)
+        with pytest.raises(Exception) as error:
+            await requests.run("1:contacts", "key", CONTACT, create)
+        assert error.value.status_code == 409
+        assert len(calls) == 1
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_memory_store_sweeps_expired_records(monkeypatch):
+    monkeypatch.setattr(MemoryIdempotencyStore, "PURGE_INTERVAL", 0.01)
+    store = MemoryIdempotencyStore()
+
+    async def scenario():
+        assert await store.claim("1:contacts:key", "hash", "owner", 0.01) is None
+        waiting = asyncio.create_task(store.wait("1:contacts:key", 5))
+        await asyncio.sleep(0.1)
+        assert store.records == {} and store.finished == {}
+        assert waiting.done()
+        await store.close()
+
+    asyncio.run(scenario())
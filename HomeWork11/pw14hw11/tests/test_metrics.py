@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from services.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_render_histogram(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+        latency.observe(0.05, route="/a")
+        latency.observe(0.5, route="/a")
+        latency.observe(5, route="/a")
+
+        text = registry.render()
+
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count{route="/a"} 3', text)
+        self.assertIn('# TYPE latency_seconds histogram', text)
+
+    def test_aggregates_worker_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = MetricsRegistry(directory)
+            requests = registry.counter("requests_total", "Requests.", ("status",))
+            in_flight = registry.gauge("in_flight", "In flight.")
+            requests.inc(status=200)
+            in_flight.set(2)
+
+            # A worker that has exited: its counters still count, its gauges don't.
+            dead_worker = {"pid": 2 ** 22 + 1, "metrics": {
+                "requests_total": {"type": "counter", "help": "Requests.", "labelnames": ["status"],
+                                   "series": [[["200"], 4]]},
+                "in_flight": {"type": "gauge", "help": "In flight.", "labelnames": [], "series": [[[], 7]]},
+            }}
+            with open(os.path.join(directory, "metrics-dead.json"), "w") as f:
+                json.dump(dead_worker, f)
+
+            text = registry.render()
+            # Folded into the retired snapshot, so the file is gone and the count stays.
+            files = sorted(os.listdir(directory))
+            again = registry.render()
+
+        self.assertIn('requests_total{status="200"} 5', text)
+        self.assertIn('in_flight 2', text)
+        self.assertEqual(files, sorted([f"metrics-{os.getpid()}.json", "metrics-retired.json", "metrics.lock"]))
+        self.assertIn('requests_total{status="200"} 5', again)
+
+    def test_concurrent_increments_are_not_lost(self):
+        registry = MetricsRegistry()
+        requests = registry.counter("requests_total", "Requests.")
+        latency = registry.histogram("latency_seconds", "Latency.", buckets=(1.0,))
+
+        def record():
+            for _ in range(10000):
+                requests.inc()
+                latency.observe(0.5)
+
+        interval = sys.getswitchinterval()
+        # Switch threads as often as possible, so unlocked updates would get lost.
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=record) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+
+        self.assertEqual(requests.series[()], 80000)
+        self.assertEqual(latency.series[()][0], 80000)
+
+    def test_flusher_survives_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = MetricsRegistry(directory, flush_interval=0.01)
+            flushed = threading.Event()
+            calls = []
+
+            def collector():
+                calls.append(1)
+                if len(calls) == 1:
+                    raise OSError("disk full")
+                flushed.set()
+
+            registry.register_collector(collector)
+            registry.start_flusher()
+
+            self.assertTrue(flushed.wait(5))
+            # The flusher thread can't be stopped; make its next flushes no-ops.
+            registry.directory = None
+
+
+def test_metrics_endpoint(client):
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.status_code == 200, response.text
+    assert 'http_requests_total{method="GET",route="/",status="200"}' in response.text
+    assert "http_request_duration_seconds_bucket" in response.text
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import pytest
+
+from services.phone import to_e164
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "email": "anna.melnyk@example.com",
+           "birthdate": "1990-05-17"}
+
+
+@pytest.mark.parametrize("number, expected", [
+    ("+380501234567", "+380501234567"),
+    ("+380 50 123 45 67", "+380501234567"),
+    ("(050) 123-45-67", "+380501234567"),
+    ("380501234567", "+380501234567"),
+    ("00380501234567", "+380501234567"),
+    ("+1 (555) 123-4567", "+15551234567"),
+    ("12-34", None),
+    ("call me", None),
+    ("", None),
+    (None, None),
+])
+def test_to_e164(number, expected):
+    assert to_e164(number) == expected
+
+
+def test_contacts_by_phone(client, headers):
+    ids = {}
+    for name, phone in [("Anna", "+380 50 123 45 67"), ("Olena", "0671234567"), ("John", "+1 555 123 4567")]:
+        response = client.post("/api/contacts/", json={**CONTACT, "first_name": name, "phone_number": phone},
+                               headers=headers)
+        assert response.status_code == 200, response.text
+        ids[name] = response.json()["id"]
+    assert response.json()["phone_e164"] == "+15551234567"
+
+    def lookup(number, **params):
+        response = client.get(f"/api/contacts/by-phone/{number}", params=params, headers=headers)
+        assert response.status_code == 200, response.text
+        return sorted(contact["id"] for contact in response.json())
+
+    assert lookup("(050) 123-45-67") == [ids["Anna"]]
+    assert lookup("+380501234567") == [ids["Anna"]]
+    assert lookup("+380509999999") == []
+    assert lookup("1234567", match="suffix") == sorted(ids.values())
+    assert lookup("67-1234567", match="suffix") == [ids["Olena"]]
+
+    client.put(f"/api/contacts/{ids['Olena']}",
+               json={**CONTACT, "first_name": "Olena", "phone_number": "+380 99 000 00 00"}, headers=headers)
+    assert client.get(f"/api/contacts/{ids['Olena']}", headers=headers).json()["phone_e164"] == "+380990000000"
+    assert lookup("0990000000") == [ids["Olena"]]
+
+    assert client.get("/api/contacts/by-phone/123", params={"match": "suffix"}, headers=headers).status_code == 422
+    assert client.get("/api/contacts/by-phone/nobody", headers=headers).status_code == 422
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+from unittest.mock import patch
+
+from middleware.profiling import StackSampler, main, sign_profile_token, verify_profile_token, write_profile
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_verify_profile_token(self):
+        token = sign_profile_token(int(time.time()) + 60, "admin-secret")
+        tampered = token[:-1] + ("1" if token.endswith("0") else "0")
+
+        self.assertTrue(verify_profile_token(token, "admin-secret"))
+        self.assertFalse(verify_profile_token(token, "other-secret"))
+        self.assertFalse(verify_profile_token(tampered, "admin-secret"))
+        self.assertFalse(verify_profile_token(token, None))
+
+    def test_expired_profile_token(self):
+        token = sign_profile_token(int(time.time()) - 1, "admin-secret")
+
+        self.assertFalse(verify_profile_token(token, "admin-secret"))
+
+    def test_non_ascii_digits_in_profile_token(self):
+        self.assertFalse(verify_profile_token("\u00b2.signature", "admin-secret"))
+        self.assertFalse(verify_profile_token("\u0661\u0662.signature", "admin-secret"))
+
+    def test_sampler_sees_other_threads(self):
+        def threadpool_work(done):
+            done.wait(5)
+
+        done = threading.Event()
+        worker = threading.Thread(target=threadpool_work, args=(done,), name="worker")
+        worker.start()
+        sampler = StackSampler(0.005)
+        sampler.start()
+        time.sleep(0.1)
+        sampler.stop()
+        done.set()
+        worker.join()
+
+        stacks = sampler.collapsed().splitlines()
+        self.assertTrue(any(stack.startswith("worker;") and "threadpool_work" in stack for stack in stacks))
+        self.assertFalse(any(stack.startswith("stack-sampler;") for stack in stacks))
+
+    def test_cli_needs_secret(self):
+        stderr = StringIO()
+        with patch("middleware.profiling.PROFILE_SECRET", None), patch("sys.argv", ["profiling", "60"]), \
+                redirect_stderr(stderr), self.assertRaises(SystemExit):
+            main()
+
+        self.assertIn("PROFILE_SECRET is not set", stderr.getvalue())
+
+    def test_write_profile_rotates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(5):
+                path = write_profile(directory, f"profile{i}", "main;handler 3\n", max_files=3)
+                os.utime(path, (i, i))
+
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ["profile2.folded", "profile3.folded", "profile4.folded"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from fastapi import HTTPException
+
+from services.rate_limit import MemoryBackend, RateLimit
+
+
+class TestRateLimit(IsolatedAsyncioTestCase):
+
+    async def test_memory_backend_bucket(self):
+        backend = MemoryBackend()
+
+        results = [await backend.hit("key", capacity=3, rate=0.001) for _ in range(4)]
+
+        self.assertEqual([allowed for allowed, _ in results], [True, True, True, False])
+        self.assertGreater(results[-1][1], 0)
+
+    async def test_memory_backend_keys_are_independent(self):
+        backend = MemoryBackend()
+        await backend.hit("a", capacity=1, rate=0.001)
+
+        allowed, _ = await backend.hit("b", capacity=1, rate=0.001)
+
+        self.assertTrue(allowed)
+
+    async def test_memory_backend_evicts_oldest_keys(self):
+        backend = MemoryBackend(max_keys=2)
+        for key in ("a", "b", "c"):
+            await backend.hit(key, capacity=1, rate=1)
+
+        self.assertEqual(list(backend.buckets), ["b", "c"])
+
+    async def test_check_raises_too_many_requests(self):
+        limit = RateLimit("1/60")
+        backend = MemoryBackend()
+        await limit.check(backend, "login:ip:127.0.0.1")
+
+        with self.assertRaises(HTTPException) as cm:
+            await limit.check(backend, "login:ip:127.0.0.1")
+
+        self.assertEqual(cm.exception.status_code, 429)
+        self.assertEqual(cm.exception.headers["Retry-After"], "60")
+
+    async def test_check_fails_open(self):
+        backend = AsyncMock()
+        backend.hit.side_effect = ConnectionError("redis is down")
+
+        await RateLimit("1/60").check(backend, "key")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import time
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import MagicMock
+
+from jose import jwt
+
+from models import User
+from services.auth import auth_service
+from services.revocation import BloomFilter, MemoryRevocationStore, RevocationFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        items = [f"jti{i}" for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+
+        self.assertTrue(all(item in bloom for item in items))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+
+        self.assertLess(false_positives, 300)
+
+
+class TestRevocationFilter(IsolatedAsyncioTestCase):
+
+    async def test_revocations_from_other_workers(self):
+        store = MemoryRevocationStore()
+        worker1 = RevocationFilter(store, capacity=100, refresh_interval=0)
+        worker2 = RevocationFilter(store, capacity=100, refresh_interval=0)
+
+        await worker1.revoke("jti1", time.time() + 60)
+
+        self.assertTrue(await worker2.is_revoked("jti1"))
+        self.assertFalse(await worker2.is_revoked("jti2"))
+        self.assertFalse(await worker2.is_revoked(None))
+
+    async def test_expired_revocation(self):
+        store = MemoryRevocationStore()
+        revocations = RevocationFilter(store, capacity=100, refresh_interval=0)
+
+        await revocations.revoke("jti1", time.time() - 1)
+
+        self.assertFalse(await revocations.is_revoked("jti1"))
+
+    async def test_rebuild_when_full(self):
+        store = MemoryRevocationStore()
+        revocations = RevocationFilter(store, capacity=2, refresh_interval=0)
+        for i in range(3):
+            await store.revoke(f"expired{i}", time.time() - 1)
+        await store.revoke("jti1", time.time() + 60)
+
+        self.assertTrue(await revocations.is_revoked("jti1"))
+        self.assertEqual(revocations.bloom.count, 1)
+
+    async def test_grow_when_live_revocations_exceed_capacity(self):
+        store = MemoryRevocationStore()
+        revocations = RevocationFilter(store, capacity=2, refresh_interval=0)
+        for i in range(3):
+            await store.revoke(f"jti{i}", time.time() + 60)
+        await revocations.refresh()
+        self.assertEqual((revocations.bloom.capacity, revocations.bloom.count), (6, 3))
+
+        rebuilds = []
+        changes_since = store.changes_since
+        store.changes_since = lambda cursor: rebuilds.append(cursor) or changes_since(cursor)
+        await store.revoke("jti3", time.time() + 60)
+        self.assertTrue(await revocations.is_revoked("jti3"))
+        self.assertFalse(await revocations.is_revoked("other"))
+        self.assertNotIn(None, rebuilds)
+
+    async def test_store_purges_expired_revocations(self):
+        store = MemoryRevocationStore()
+        await store.revoke("expired", time.time() - 1)
+        await store.revoke("jti1", time.time() + 60)
+        changes, cursor = await store.changes_since(None)
+
+        store.purged_at -= store.PURGE_INTERVAL
+        await store.revoke("jti2", time.time() + 60)
+
+        self.assertEqual([jti for _, jti, _ in store.log], ["jti1", "jti2"])
+        self.assertEqual(list(store.revoked), ["jti1", "jti2"])
+        self.assertEqual([jti for jti, _ in (await store.changes_since(cursor))[0]], ["jti2"])
+
+
+def test_logout_revokes_access_token(client, session, user, monkeypatch):
+    monkeypatch.setattr("routes.auth.send_email", MagicMock())
+    client.post("/api/auth/signup", json=user)
+    current_user = session.query(User).filter(User.email == user.get("email")).first()
+    current_user.confirmed = True
+    session.commit()
+    tokens = client.post("/api/auth/login",
+                         data={"username": user.get("email"), "password": user.get("password")}).json()
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.get("/secret", headers=headers).status_code == 200
+
+    response = client.post("/api/auth/logout", headers=headers)
+    assert response.status_code == 204, response.text
+
+    assert client.get("/secret", headers=headers).status_code == 401
+    response = client.get("/api/auth/refresh_token",
+                          headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401
+
+
+def test_logout_without_jti(client, user, headers):
+    # Access tokens issued before tokens got a jti.
+    token = jwt.encode({"sub": user["email"], "scope": "access_token", "exp": time.time() + 60},
+                       auth_service.SECRET_KEY, algorithm=auth_service.ALGORITHM)
+
+    response = client.post("/api/auth/logout", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 204, response.text
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from itertools import accumulate
+
+from database.seed import generate_contacts, seed_database, user_weights
+
+
+class TestSeed(unittest.TestCase):
+
+    def test_user_weights_are_skewed(self):
+        weights = user_weights(users=100, contacts=1_000_000, heavy_users=2, heavy_contacts=300_000)
+
+        self.assertAlmostEqual(sum(weights), 1)
+        self.assertAlmostEqual(weights[0] * 1_000_000, 300_000)
+        self.assertGreater(weights[2], weights[50])
+
+    def test_contacts_are_deterministic(self):
+        cum_weights = list(accumulate(user_weights(10, 1000, 1, 500)))
+
+        first = generate_contacts(3, 300, 100, 42, cum_weights, duplicate_rate=0.2)
+        second = generate_contacts(3, 300, 100, 42, cum_weights, duplicate_rate=0.2)
+        other_seed = generate_contacts(3, 300, 100, 43, cum_weights, duplicate_rate=0.2)
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other_seed)
+        self.assertEqual([row["id"] for row in first], list(range(301, 401)))
+
+    def test_duplicates(self):
+        cum_weights = list(accumulate(user_weights(1, 1000, 0, 0)))
+
+        rows = generate_contacts(0, 0, 1000, 0, cum_weights, duplicate_rate=0.2)
+
+        names = {(row["first_name"].lower(), row["last_name"], row["birthdate"]) for row in rows}
+        self.assertLess(len(names), 900)
+
+    def test_seed_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "seed.db")
+            seed_database(f"sqlite:///{path}", users=5, contacts=500, heavy_users=1, heavy_contacts=250,
+                          processes=1, chunk_size=200)
+
+            with sqlite3.connect(path) as connection:
+                self.assertEqual(connection.execute("SELECT count(*) FROM users").fetchone()[0], 5)
+                counts = dict(connection.execute("SELECT user_id, count(*) FROM contacts GROUP BY user_id"))
+            self.assertEqual(sum(counts.values()), 500)
+            self.assertGreater(counts[1], 150)
+            with self.assertRaises(ValueError):
+                seed_database(f"sqlite:///{path}", users=5, contacts=10, processes=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
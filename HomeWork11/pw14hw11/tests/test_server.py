@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from server import resolve_http, resolve_loop
+from services.email import drain_email_queue, send_email
+
+
+class TestServerOptions(unittest.TestCase):
+
+    def test_explicit_choices_are_kept(self):
+        self.assertEqual(resolve_loop("asyncio"), "asyncio")
+        self.assertEqual(resolve_http("h11"), "h11")
+
+    def test_auto_falls_back_without_optional_packages(self):
+        with patch("server.find_spec", return_value=None):
+            self.assertEqual(resolve_loop("auto"), "asyncio")
+            self.assertEqual(resolve_http("auto"), "h11")
+
+
+class TestDrainEmailQueue(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        # The mail settings need MAIL_* env vars the tests don't set.
+        patcher = patch("services.email.get_mail_config", return_value=MagicMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_waits_for_pending_sends(self):
+        sent = asyncio.Event()
+
+        async def slow_send(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            sent.set()
+
+        with patch("fastapi_mail.FastMail", return_value=MagicMock(send_message=AsyncMock(side_effect=slow_send))):
+            task = asyncio.create_task(send_email("test@example.com", "test", "http://localhost/"))
+            await asyncio.sleep(0)
+
+            self.assertEqual(await drain_email_queue(1), 0)
+            self.assertTrue(sent.is_set())
+            await task
+
+    async def test_gives_up_after_timeout(self):
+        async def stuck_send(*args, **kwargs):
+            await asyncio.sleep(1)
+
+        with patch("fastapi_mail.FastMail", return_value=MagicMock(send_message=AsyncMock(side_effect=stuck_send))):
+            task = asyncio.create_task(send_email("test@example.com", "test", "http://localhost/"))
+            await asyncio.sleep(0)
+
+            self.assertEqual(await drain_email_queue(0.01), 1)
+            task.cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
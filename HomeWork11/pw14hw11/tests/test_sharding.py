@@ -0,0 +1,201 @@
+from collections import Counter
+
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+
+import database.sharding
+import services.events
+from database.sharding import HashRing, ShardRouter, move_user, parse_shard_urls
+from models import Contact, ContactIdMove, ShardAssignment, ShardMove, ShardMoveId, User, UserContactStats
+from services.audit import AuditLog
+from tests.conftest import TestingSessionLocal
+
+CONTACT = {"id": 0, "first_name": "Anna", "last_name": "Melnyk", "phone_number": "+380501234567",
+           "email": "anna.melnyk@example.com", "birthdate": "1990-05-17"}
+
+
+@pytest.fixture
+def shards(tmp_path):
+    router = ShardRouter({name: f"sqlite:///{tmp_path / name}.db" for name in ("a", "b", "c")})
+    router.create_schemas()
+    yield router
+    router.dispose()
+
+
+@pytest.fixture
+def sharded_client(client, shards, monkeypatch):
+    monkeypatch.setattr(database.sharding, "shard_router", shards)
+    return client
+
+
+@pytest.fixture
+def user_id(session, headers, user):
+    user_id = session.query(User.id).filter(User.email == user["email"]).scalar()
+    session.query(ShardAssignment).delete()
+    session.query(ContactIdMove).delete()
+    session.commit()
+    return user_id
+
+
+def user_contacts(router, shard, user_id):
+    with router.session_factory(shard)() as db:
+        return db.scalars(select(Contact.first_name).where(Contact.user_id == user_id).order_by(Contact.id)).all()
+
+
+def test_parse_shard_urls():
+    assert parse_shard_urls("") == {}
+    assert parse_shard_urls("a=sqlite:///a.db, b=postgresql://db/b") == {"a": "sqlite:///a.db",
+                                                                         "b": "postgresql://db/b"}
+    with pytest.raises(ValueError):
+        parse_shard_urls("sqlite:///a.db")
+
+
+def test_hash_ring_spreads_and_remaps_few_keys():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    counts = Counter(before.lookup(key) for key in range(10000))
+    moved = [key for key in range(10000) if before.lookup(key) != after.lookup(key)]
+
+    assert min(counts.values()) > 2000
+    assert all(after.lookup(key) == "d" for key in moved)
+    assert 1500 < len(moved) < 3500
+    with pytest.raises(LookupError):
+        HashRing([]).lookup(1)
+
+
+def test_directory_overrides_ring(shards, session, user_id):
+    ring_shard = shards.ring.lookup(user_id)
+    assert shards.locate(user_id, session).shard == ring_shard
+
+    other = next(shard for shard in "abc" if shard != ring_shard)
+    session.add(ShardAssignment(user_id=user_id, shard=other))
+    session.commit()
+
+    assert shards.locate(user_id, session).shard == other
+
+
+def test_contacts_go_to_user_shard(sharded_client, shards, headers, user_id):
+    response = sharded_client.post("/api/contacts/", json=CONTACT, headers=headers)
+    assert response.status_code == 200, response.text
+
+    shard = shards.ring.lookup(user_id)
+    assert user_contacts(shards, shard, user_id) == ["Anna"]
+    assert all(not user_contacts(shards, other, user_id) for other in "abc" if other != shard)
+    response = sharded_client.get("/api/contacts/", headers=headers)
+    assert [contact["first_name"] for contact in response.json()] == ["Anna"]
+
+
+def test_move_user_resumes(sharded_client, shards, session, headers, user_id, monkeypatch):
+    for name in ("Anna", "Olena", "Ivan", "Petro", "Maria"):
+        sharded_client.post("/api/contacts/", json={**CONTACT, "first_name": name}, headers=headers)
+    source = shards.ring.lookup(user_id)
+    target = next(shard for shard in "abc" if shard != source)
+
+    copy_batch = database.sharding._copy_contacts
+    monkeypatch.setattr(database.sharding, "_copy_contacts", lambda *args: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        move_user(user_id, target, shards, TestingSessionLocal, batch_size=2, grace=0)
+    monkeypatch.setattr(database.sharding, "_copy_contacts", copy_batch)
+
+    # Interrupted after marking the move: reads still work, writes are refused.
+    assert sharded_client.get("/api/contacts/", headers=headers).status_code == 200
+    response = sharded_client.post("/api/contacts/", json=CONTACT, headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+    finish = database.sharding._finish_move
+    monkeypatch.setattr(database.sharding, "_finish_move",
+                        lambda router, user, shard, batch: shard == source and finish(router, user, shard, batch))
+    assert move_user(user_id, target, shards, TestingSessionLocal, batch_size=2, grace=0) == 5
+    monkeypatch.setattr(database.sharding, "_finish_move", finish)
+
+    # Interrupted before deleting the old rows: already served from the target.
+    session.expire_all()
+    assert shards.locate(user_id, session).shard == target
+    assert user_contacts(shards, source, user_id) == ["Anna", "Olena", "Ivan", "Petro", "Maria"]
+    response = sharded_client.get("/api/contacts/", headers=headers)
+    assert [contact["first_name"] for contact in response.json()] == ["Anna", "Olena", "Ivan", "Petro", "Maria"]
+
+    assert move_user(user_id, target, shards, TestingSessionLocal, grace=0) == 0
+
+    assert user_contacts(shards, source, user_id) == []
+    assert user_contacts(shards, target, user_id) == ["Anna", "Olena", "Ivan", "Petro", "Maria"]
+    with shards.session_factory(target)() as db:
+        assert db.get(ShardMove, user_id) is None
+    with shards.session_factory(source)() as db:
+        assert db.get(UserContactStats, (user_id, 5)) is None
+    assert sharded_client.get("/api/contacts/stats", headers=headers).json()["birthdays_per_month"][4] == 5
+    assert sharded_client.post("/api/contacts/", json=CONTACT, headers=headers).status_code == 200
+
+
+def test_move_user_keeps_audit_history(sharded_client, shards, headers, user_id, tmp_path, monkeypatch, caplog):
+    audit = AuditLog(tmp_path, batch_size=10 ** 9, flush_interval=10 ** 9, session_factory=TestingSessionLocal)
+    monkeypatch.setattr(services.events, "audit_log", audit)
+    ids = {}
+    for name in ("Anna", "Olena", "Ivan"):
+        response = sharded_client.post("/api/contacts/", json={**CONTACT, "first_name": name}, headers=headers)
+        ids[name] = response.json()["id"]
+    sharded_client.delete(f"/api/contacts/{ids['Olena']}", headers=headers)
+    sharded_client.put(f"/api/contacts/{ids['Ivan']}",
+                       json={**CONTACT, "first_name": "Ivan", "email": "ivan@example.com"}, headers=headers)
+    source = shards.ring.lookup(user_id)
+    target = next(shard for shard in "abc" if shard != source)
+
+    move_user(user_id, target, shards, TestingSessionLocal, grace=0)
+    new_ids = {contact["first_name"]: contact["id"] for contact in
+               sharded_client.get("/api/contacts/", headers=headers).json()}
+    sharded_client.put(f"/api/contacts/{new_ids['Ivan']}",
+                       json={**CONTACT, "first_name": "Ivan", "email": "ivan@example.org"}, headers=headers)
+    # The events from before the move are only stored now.
+    audit.flush()
+
+    # Ivan's new id is the id Olena had on the old shard.
+    assert new_ids == {"Anna": ids["Anna"], "Ivan": ids["Olena"]}
+    assert f"new contact ids {ids['Anna']}->{new_ids['Anna']}, {ids['Ivan']}->{new_ids['Ivan']}" in caplog.text
+    history = sharded_client.get(f"/api/contacts/{new_ids['Ivan']}/history", headers=headers).json()["items"]
+    assert [(item["action"], item["generation"], item["contact_id"]) for item in history] == [
+        ("updated", 1, new_ids["Ivan"]), ("updated", 0, ids["Ivan"]), ("created", 0, ids["Ivan"])]
+    assert history[1]["changes"] == {"email": [CONTACT["email"], "ivan@example.com"]}
+    assert history[2]["changes"]["first_name"] == [None, "Ivan"]
+    history = sharded_client.get("/api/contacts/history", headers=headers).json()["items"]
+    olena = [item["action"] for item in history if (item["generation"], item["contact_id"]) == (0, ids["Olena"])]
+    assert olena == ["deleted", "created"]
+    with shards.session_factory(target)() as db:
+        assert db.query(ShardMoveId).count() == 0
+    audit.close()
+
+
+def test_upgrade_schemas_adds_and_fills_contact_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as connection:
+        # contacts as created on a shard before phone_e164 and email_domain were added.
+        connection.execute(text("CREATE TABLE contacts (id INTEGER PRIMARY KEY, first_name VARCHAR, "
+                                "last_name VARCHAR, phone_number VARCHAR, email VARCHAR, birthdate DATE, "
+                                "user_id INTEGER)"))
+        connection.execute(text("INSERT INTO contacts (first_name, phone_number, email, user_id) VALUES "
+                                "('Anna', '050 123 45 67', 'Anna@Example.com', 1), ('Ivan', NULL, NULL, 1), "
+                                "('Olena', '+380501234568', 'olena@example.org', 2)"))
+    engine.dispose()
+    router = ShardRouter({"old": f"sqlite:///{tmp_path / 'old.db'}"})
+
+    router.upgrade_schemas(batch_size=2)
+    router.upgrade_schemas(batch_size=2)
+
+    with router.session_factory("old")() as db:
+        assert db.execute(select(Contact.phone_e164, Contact.email_domain).order_by(Contact.id)).all() == [
+            ("+380501234567", "example.com"), (None, None), ("+380501234568", "example.org")]
+        indexes = {index["name"] for index in inspect(db.connection()).get_indexes("contacts")}
+    assert {"ix_contacts_user_id_phone_e164", "ix_contacts_user_id_email_domain"} <= indexes
+    router.dispose()
+
+
+def test_move_user_refuses_foreign_contacts(shards, user_id):
+    source = shards.ring.lookup(user_id)
+    target = next(shard for shard in "abc" if shard != source)
+    with shards.session_factory(target)() as db:
+        db.add(Contact(first_name="Stray", user_id=user_id))
+        db.commit()
+
+    with pytest.raises(ValueError):
+        move_user(user_id, target, shards, TestingSessionLocal, grace=0)
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from services.singleflight import SingleFlight
+
+
+class TestSingleFlight(IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_share_one_run(self):
+        flight = SingleFlight("test")
+        calls = 0
+
+        async def query():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        results = await asyncio.gather(*(flight.do(1, "key", query) for _ in range(5)))
+
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(await flight.do(1, "key", query), 2)
+
+    async def test_errors_are_shared(self):
+        flight = SingleFlight("test")
+
+        async def query():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flight.do(1, "key", query), flight.do(1, "key", query),
+                                       return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_invalidate_during_flight(self):
+        flight = SingleFlight("test", window=60)
+        started = asyncio.Event()
+        values = iter(["old", "new"])
+
+        async def query():
+            started.set()
+            await asyncio.sleep(0.01)
+            return next(values)
+
+        first = asyncio.create_task(flight.do(1, "key", query))
+        await started.wait()
+        flight.invalidate(1)
+
+        self.assertEqual(await flight.do(1, "key", query), "new")
+        self.assertEqual(await first, "old")
+        self.assertEqual(await flight.do(1, "key", query), "new")
+
+    async def test_window(self):
+        flight = SingleFlight("test", window=60)
+        values = iter([1, 2, 3])
+
+        async def query():
+            return next(values)
+
+        self.assertEqual(await flight.do(1, "key", query), 1)
+        self.assertEqual(await flight.do(1, "key", query), 1)
+        self.assertEqual(await flight.do(2, "key", query), 2)
+        flight.invalidate(1)
+        self.assertEqual(await flight.do(1, "key", query), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
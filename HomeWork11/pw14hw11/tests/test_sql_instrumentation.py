@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import MagicMock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import InvalidRequestError, OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Contact, User
+from database.instrumentation import QueryStats, query_stats, instrument_engine, enable_strict_loading
+
+
+class TestQueryInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine)
+        Base.metadata.create_all(bind=engine)
+        self.Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        with self.Session() as db:
+            user = User(email="test@example.com", password="secret")
+            db.add(user)
+            db.flush()
+            db.add_all([Contact(first_name=f"name{i}", user_id=user.id) for i in range(3)])
+            db.commit()
+
+    def test_query_stats_recorded(self):
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        try:
+            with self.Session() as db:
+                db.query(User).all()
+                db.query(Contact).all()
+        finally:
+            query_stats.reset(token)
+
+        self.assertEqual(stats.count, 2)
+        self.assertGreater(stats.total_time, 0)
+        self.assertIn("FROM", stats.slowest_statement)
+
+    def test_repeated_statements_detected(self):
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        try:
+            with self.Session() as db:
+                for contact in db.query(Contact).all():
+                    db.expunge_all()
+                    db.query(User).filter(User.id == contact.user_id).first()
+        finally:
+            query_stats.reset(token)
+
+        repeated = stats.repeated_statements(3)
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0][1], 3)
+
+    def test_failed_statements_are_not_left_timing(self):
+        with self.Session() as db:
+            for _ in range(3):
+                with self.assertRaises(OperationalError):
+                    db.execute(text("SELECT * FROM missing"))
+                db.rollback()
+            db.query(User).all()
+            self.assertEqual(db.connection().info["query_start_time"], [])
+
+    def test_strict_loading_raises_on_lazy_load(self):
+        enable_strict_loading(self.Session)
+        with self.Session() as db:
+            contact = db.query(Contact).first()
+            with self.assertRaises(InvalidRequestError):
+                contact.user
+
+
+def test_debug_headers(client, user, monkeypatch):
+    monkeypatch.setattr("middleware.sql_stats.DEBUG", True)
+    monkeypatch.setattr("routes.auth.send_email", MagicMock())
+    response = client.post("/api/auth/signup", json=user)
+    assert response.status_code == 201, response.text
+    assert int(response.headers["X-DB-Query-Count"]) >= 2
+    assert float(response.headers["X-DB-Time-Ms"]) > 0
+    assert "X-DB-Slowest-Query" in response.headers
+
+
+if __name__ == '__main__':
+    unittest.main()
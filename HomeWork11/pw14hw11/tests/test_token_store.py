@@ -0,0 +1,68 @@
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import MagicMock
+
+from models import User
+from services.token_store import MemoryRefreshTokenStore, Rotation
+
+
+class TestMemoryRefreshTokenStore(IsolatedAsyncioTestCase):
+
+    async def test_rotate(self):
+        store = MemoryRefreshTokenStore()
+        await store.create_session("test@example.com", "sid", "jti1", ttl=60)
+
+        self.assertEqual(await store.rotate("test@example.com", "sid", "jti1", "jti2", ttl=60), Rotation.OK)
+        self.assertEqual(await store.rotate("test@example.com", "sid", "jti2", "jti3", ttl=60), Rotation.OK)
+
+    async def test_reuse_revokes_session(self):
+        store = MemoryRefreshTokenStore()
+        await store.create_session("test@example.com", "sid", "jti1", ttl=60)
+        await store.rotate("test@example.com", "sid", "jti1", "jti2", ttl=60)
+
+        self.assertEqual(await store.rotate("test@example.com", "sid", "jti1", "jti3", ttl=60), Rotation.REUSED)
+        self.assertEqual(await store.rotate("test@example.com", "sid", "jti2", "jti3", ttl=60), Rotation.UNKNOWN)
+
+    async def test_multiple_sessions(self):
+        store = MemoryRefreshTokenStore()
+        await store.create_session("test@example.com", "phone", "jti1", ttl=60)
+        await store.create_session("test@example.com", "laptop", "jti2", ttl=60)
+        await store.revoke_session("test@example.com", "phone")
+
+        self.assertEqual(await store.list_sessions("test@example.com"), ["laptop"])
+
+        await store.revoke_all("test@example.com")
+        self.assertEqual(await store.list_sessions("test@example.com"), [])
+
+    async def test_expired_session(self):
+        store = MemoryRefreshTokenStore()
+        await store.create_session("test@example.com", "sid", "jti1", ttl=0)
+
+        self.assertEqual(await store.rotate("test@example.com", "sid", "jti1", "jti2", ttl=60), Rotation.UNKNOWN)
+
+
+def test_refresh_token_rotation(client, session, user, monkeypatch):
+    monkeypatch.setattr("routes.auth.send_email", MagicMock())
+    client.post("/api/auth/signup", json=user)
+    current_user = session.query(User).filter(User.email == user.get("email")).first()
+    current_user.confirmed = True
+    session.commit()
+    tokens = client.post("/api/auth/login",
+                         data={"username": user.get("email"), "password": user.get("password")}).json()
+
+    response = client.get("/api/auth/refresh_token",
+                          headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+
+    # Replaying the old refresh token revokes the session, including the rotated token.
+    response = client.get("/api/auth/refresh_token",
+                          headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401
+    response = client.get("/api/auth/refresh_token",
+                          headers={"Authorization": f"Bearer {rotated['refresh_token']}"})
+    assert response.status_code == 401
+
+
+if __name__ == '__main__':
+    unittest.main()